@@ -6,6 +6,7 @@ from tqdm import tqdm
 import game_1
 import game_2
 from project import game_3
+from llm_overcooked.utils.llm_cache import chat_request, get_response_cache
 
 
 def parsing_dict(string):
@@ -107,6 +108,13 @@ class CooperativeAgent_game_simple:
             {"role": "system", "content": system_prompt},
             {"role": "user", "content": incoming_message},
         ]
+        cache = get_response_cache()
+        if cache is None:
+            return self._create(messages)
+        request = chat_request('openai', [(m["role"], m["content"]) for m in messages], model=self.model_name)
+        return cache.call(request, lambda: self._create(messages))
+
+    def _create(self, messages):
         resp = self.openai_client.chat.completions.create(
             model=self.model_name,
             messages=messages,
@@ -11,7 +11,7 @@ sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
 
 from levels.utils import convert_to_prompt
 from overcooked import World
-from utils.llm import chat_llm, chat_llm_vicuna, prepend_history, rules
+from utils.llm import chat_llm, chat_llm_vicuna, load_examples, prepend_history, rules
 
 
 def num_tokens_from_string(string: str, encoding_name: str) -> int:
@@ -95,13 +95,7 @@ def main(model, with_feedback_arg, with_notes_arg, num_agents, level_to_run):
                 elif num_agents == 4:
                     asset_file = './assets/amt_examples/prompt_4agent_level2.txt'
 
-            example = open(asset_file, 'r').read().split('###\n')[1].split('***\n')
-            example_history = []
-            for idx, exp in enumerate(example):
-                if idx % 2 == 0:
-                    example_history.append(("user", exp))
-                else:
-                    example_history.append(("assistant", exp))
+            example_history = load_examples(asset_file).history
 
             num_success = 0
             total = 0
@@ -10,7 +10,7 @@ sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
 
 from levels.utils import convert_to_prompt
 from overcooked import World
-from utils.llm import chat_llm_vicuna, prepend_history, rules
+from utils.llm import chat_llm_vicuna, load_examples, prepend_history, rules
 
 
 def num_tokens_from_string(string: str, encoding_name: str) -> int:
@@ -37,13 +37,7 @@ def main():
             max_episode = 3
             max_steps = 60
 
-            example = open('./assets/prompt_2.txt', 'r').read().split('###\n')[1].split('***\n')
-            example_history = []
-            for idx, exp in enumerate(example):
-                if idx % 2 == 0:
-                    example_history.append(("user", exp))
-                else:
-                    example_history.append(("assistant", exp))
+            example_history = load_examples('./assets/prompt_2.txt').history
 
             num_success = 0
             total = 0
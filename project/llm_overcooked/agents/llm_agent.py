@@ -1,3 +1,4 @@
+import asyncio
 import os
 import sys
 import time
@@ -5,7 +6,7 @@ import json
 import openai
 import re
 
-from utils.llm import chat_llm, prepend_history, rules
+from utils.llm import achat_llm, chat_llm, level_prompt, load_examples, prepend_history, rules
 from levels.utils import convert_to_prompt
 
 def broadcast_protocol(structured=True):
@@ -103,17 +104,12 @@ class LLMAgent(object):
         self.init_history()
 
     def init_history(self):
-        pre_prompt = ("user", rules(self.env, True) + broadcast_protocol(self.bc_str))
-        if self.bc_str:
-            example = open("./assets/prompt_structured.txt", "r").read().split('###\n')[1].split('***\n')
-        else:
-            example = open("./assets/prompt_nl.txt", "r").read().split('###\n')[1].split('***\n')
-        example_history = []
-        for idx, exp in enumerate(example):
-            if idx % 2 == 0:
-                example_history.append(("user", exp))
-            else:
-                example_history.append(("assistant", exp))
+        # the rules and the examples are shared by the agents and the episodes of a level, see `level_prompt`
+        variant = "structured" if self.bc_str else "nl"
+        pre_prompt = level_prompt(self.env, "agent_rules", lambda: rules(self.env, True) + broadcast_protocol(self.bc_str),
+                                  variant=variant)
+        pre_prompt = ("user", pre_prompt.text)
+        example_history = load_examples(f"./assets/prompt_{variant}.txt").history
         info_prompt = ("user", game_instruction_prompt(self.env, self.env_agent))
 
         self.history = [pre_prompt] + example_history + [info_prompt]
@@ -132,6 +128,17 @@ class LLMAgent(object):
         return prompt
     
     def step(self, obs, agents):
+        self.add_prompt(obs, agents)
+        reply = chat_llm(self.history, temperature=0.1, model=self.model)
+        return self.take_reply(reply)
+
+    async def astep(self, obs, agents):
+        # `step` with a non-blocking request, the agents of a step can query the LLM concurrently (see `astep_agents`)
+        self.add_prompt(obs, agents)
+        reply = await achat_llm(self.history, temperature=0.1, model=self.model)
+        return self.take_reply(reply)
+
+    def add_prompt(self, obs, agents):
         self.steps += 1
         prompt = convert_to_prompt(obs) + self.collect_broadcast(agents)
         # print current prompt
@@ -144,7 +151,7 @@ class LLMAgent(object):
             self.history = self.history[:self.initial_history_len] + self.history[self.initial_history_len+2:]
             self.history = prepend_history(self.history, prompt, verbose=True)
 
-        reply = chat_llm(self.history, temperature=0.1, model=self.model)
+    def take_reply(self, reply):
         print("-"*20 + "LLM reply:")
         print(reply)
         print("-"*20)
@@ -172,4 +179,9 @@ class LLMAgent(object):
         self.broadcast = self.broadcast_sync
         self.broadcast_sync = None
         return self.broadcast
-    
\ No newline at end of file
+
+
+async def astep_agents(agents, obs):
+    # the actions of all the agents for `obs`, their requests are sent concurrently. The broadcasts they read are
+    # the ones of the last `sync`, so the actions are the same as stepping the agents one by one
+    return await asyncio.gather(*[agent.astep(obs, agents) for agent in agents])
@@ -2,12 +2,12 @@ import os
 import numpy as np
 import json
 import matplotlib.pyplot as plt
-import re
 import pandas as pd
 import seaborn as sns
 import textwrap
 
 from collections import Counter
+from levels.constants import FeedbackCode, feedback_categories
 from overcooked import World
 
 result_files = [
@@ -74,11 +74,13 @@ def draw(prefix, files):
     plt.savefig('figs/' + prefix + '_valid-noop-count.png', dpi=300)
 
 def replay(level, num_agents, files):
-    output = ""
+    # feedback counts of the first episodes of every table, grouped by feedback code
+    rows = []
     for file in files:
         with open(file, 'r') as f:
             table = json.load(f)
 
+        config = 'Structured' if 'struct' in file else 'NL'
         alphas = list(table.keys())
         alphas.sort(key=lambda x: float(x))
 
@@ -89,68 +91,30 @@ def replay(level, num_agents, files):
             max_episode = 3
             max_steps = env.max_steps
 
-            feedback_histories_list = []
-            feedback_categories = {}
+            feedback_counts = Counter()
             for eps_id in range(max_episode):
                 obs = env.reset()
 
                 step = 0
-                feedback_histories = []
-
                 while (step < max_steps):
                     plan = table[alpha]['action_history'][eps_id][step]
 
                     if plan:
                         obs, done, info = env.step(plan)
-                    feedback_histories.append(env.feedback)
-                    if env.feedback:
-                        for feedback in env.feedback:
-                            if feedback not in feedback_categories:
-                                feedback_categories[feedback] = 0
-                            feedback_categories[feedback] += 1
-
                     step += 1
-                
-                feedback_histories_list.append(feedback_histories)
-
-            output += f"Feedback categories for {file} with alpha {alpha}:\n"
-            for feedback, count in feedback_categories.items():
-                output +=  f"{feedback}: {count}\n"
-            output += "-" * 50 + '\n'
-    return output
-
-def normalize_pattern(sentence):
-    sentence = re.sub(r'agent\d+', 'agent', sentence)
-    sentence = re.sub(r'blender\d+|storage\d+|servingtable\d+|pot\d+|mixer\d+|chopboard\d+|pan\d+|fryer\d+|steamer\d+|oven\d+', 'tool', sentence)
-    sentence = re.sub(r'salmonMeatcake|salmonSashimi|tunaSashimi|cookedRice|salmon|flour|rice|tuna', 'item', sentence)
-    return sentence.strip()
-
-def parse_failure_data(file_path):
-    data = []
-    alpha, config = None, None
-
-    pattern_set = set()
-    with open(file_path, 'r') as f:
-        for line in f:
-            line = line.strip()
-            header_match = re.match(r"Feedback categories for (.+?) with alpha ([\d.]+):", line)
-            if header_match:
-                config, alpha = header_match.groups()
-                config = 'Structured' if 'struct' in config else 'NL'
-                alpha = float(alpha)
-            elif line == '--------------------------------------------------' or not line:
-                continue
-            else:
-                normalized_cat = normalize_pattern(line.split(':')[0]).strip()
-                if normalized_cat:
-                    normalized_cat = '➣' + normalized_cat[0].upper() + normalized_cat[1:]
-                pattern_set.add(normalized_cat)
-                match = re.match(r"(.+): (\d+)", line)
-                if match:
-                    category, count = match.groups()
-                    data.append((config, normalized_cat, int(count)))
-
-    return pd.DataFrame(data, columns=["Config", "Category", "Count"])
+
+                feedback_counts.update(env.feedback_counts)
+
+            for code, count in feedback_counts.items():
+                rows.append((config, float(alpha), code.name, count))
+    return pd.DataFrame(rows, columns=["Config", "Alpha", "Code", "Count"])
+
+def categorize(df):
+    # one row per (config, category), the category is the feedback template with agents/tools/items anonymized
+    grouped = df.groupby(['Config', 'Code'])['Count'].sum().reset_index()
+    category = grouped['Code'].map(lambda code: feedback_categories[FeedbackCode[code]])
+    grouped['Category'] = '➣' + category.str[0].str.upper() + category.str[1:]
+    return grouped[['Config', 'Category', 'Count']]
 
 def aggregate_and_plot(df, top_n=20):
     grouped = df.groupby(['Config', 'Category'])['Count'].sum().reset_index()
@@ -222,9 +186,11 @@ def aggregate_and_plot(df, top_n=20):
     plt.savefig('figs/feedbacks_aggregated.png', dpi=300, bbox_inches='tight')
 
 def draw_feedback():
-    file_path = 'feedbacks.txt'
-    df_failures = parse_failure_data(file_path)
-    aggregate_and_plot(df_failures)
+    df_failures = pd.concat([
+        replay(level='level_0', num_agents=2, files=[result_files[0], result_files[1]]),
+        replay(level='level_3', num_agents=3, files=[result_files[2], result_files[3]]),
+    ])
+    aggregate_and_plot(categorize(df_failures))
 
 if __name__ == "__main__":
     level_0 = [result_files[0], result_files[1]]
@@ -233,9 +199,4 @@ if __name__ == "__main__":
     # draw('level_0', level_0)
     # draw('level_3', level_3)
 
-    if not os.path.exists("feedbacks.txt"):
-        output = replay(level='level_0', num_agents=2, files=level_0)
-        output += replay(level='level_3', num_agents=3, files=level_3)
-        with open('feedbacks.txt', 'w') as f:
-            f.write(output)
-    draw_feedback()
\ No newline at end of file
+    draw_feedback()
@@ -1,5 +1,6 @@
 import json
-from enum import Enum
+from enum import Enum, IntEnum
+from typing import NamedTuple, Optional
 
 # task interval and lifetime
 ALPHA = 2.2
@@ -71,6 +72,189 @@ for key, value in recipe.items():
 all_objecsts = sorted(list(set(all_objecsts)))
 ItemName = StrEnum(all_objecsts)
 
+# every object is interned to a small integer id (its index in `all_objecsts`), `waste` comes last
+object_names = all_objecsts + [ItemName.waste]
+object_ids = {name: idx for idx, name in enumerate(object_names)}
+WASTE_ID = object_ids[ItemName.waste]
+
+
+class Observation:
+    # the state returned by the engines, with the fields of `StepReturnType`. Agents and locations are captured as
+    # tuples (contents as object ids) and only rendered to the dicts of `StepReturnType` when they are first read
+    __slots__ = ('current_level', 'current_tasks_name', 'current_tasks_lifetime', 'current_step', 'max_steps',
+                 'game_over', 'task_just_success', 'task_just_success_location', 'accomplished_tasks', 'just_failed',
+                 '_agent_states', '_location_names', '_location_states', '_agents', '_locations', '_digest',
+                 'prompts')
+
+    def __init__(self, current_level, current_tasks_name,
+                 current_tasks_lifetime, current_step, max_steps,
+                 game_over, task_just_success, task_just_success_location,
+                 accomplished_tasks, just_failed,
+                 agent_states, location_names, location_states) -> None:
+        self.current_level = current_level
+        self.current_tasks_name = current_tasks_name
+        self.current_tasks_lifetime = current_tasks_lifetime
+        self.current_step = current_step
+        self.max_steps = max_steps
+        self.game_over = game_over
+
+        self.task_just_success = task_just_success
+        self.task_just_success_location = task_just_success_location
+        self.accomplished_tasks = accomplished_tasks
+        self.just_failed = just_failed
+        # (name, location name, holding ids or None, occupied time) of every agent
+        self._agent_states = agent_states
+        self._location_names = location_names
+        # (content ids or None, occupied time) of every location
+        self._location_states = location_states
+        self._agents = None
+        self._locations = None
+        self._digest = None
+        # prompts rendered from this observation (see `levels.utils.convert_to_prompt`), by kind
+        self.prompts = {}
+
+    @property
+    def digest(self):
+        # hashable summary of everything the prompts show, equal for equal states (the observation is not modified)
+        if self._digest is None:
+            self._digest = (self.current_level, tuple(self.current_tasks_name), tuple(self.current_tasks_lifetime),
+                            self.current_step, self.max_steps, self._agent_states, self._location_names,
+                            self._location_states, tuple(self.accomplished_tasks))
+        return self._digest
+
+    @property
+    def agent_states(self):
+        return self._agent_states
+
+    @property
+    def location_states(self):
+        return self._location_states
+
+    @property
+    def agents(self):
+        if self._agents is None:
+            self._agents = [{
+                'name': name,
+                'location': location,
+                'occupied': occupied,
+                'id': i,
+                'hold': '&'.join([object_names[j] for j in holding]) if holding else None,
+                'occupy': bool(occupied),
+            } for i, (name, location, holding, occupied) in enumerate(self._agent_states)]
+        return self._agents
+
+    @property
+    def locations(self):
+        if self._locations is None:
+            self._locations = [{
+                'id': name,
+                'content': '&'.join([object_names[j] for j in content]) if content else None,
+                'occupy': bool(occupied),
+            } for name, (content, occupied) in zip(self._location_names, self._location_states)]
+        return self._locations
+
+    def to_dict(self):
+        # the fields of `StepReturnType`, ex. for json logging
+        return {
+            'current_level': self.current_level,
+            'current_tasks_name': self.current_tasks_name,
+            'current_tasks_lifetime': self.current_tasks_lifetime,
+            'current_step': self.current_step,
+            'max_steps': self.max_steps,
+            'game_over': self.game_over,
+            'task_just_success': self.task_just_success,
+            'task_just_success_location': self.task_just_success_location,
+            'locations': self.locations,
+            'agents': self.agents,
+            'accomplished_tasks': self.accomplished_tasks,
+            'just_failed': self.just_failed,
+        }
+
+
+class FeedbackCode(IntEnum):
+    # execution feedback of the engine, the messages are rendered from `feedback_templates` only when needed
+    NOT_ENOUGH_ARGUMENTS = 0
+    UNSUPPORTED_ACTION = 1
+    AGENT_ID_NOT_FOUND = 2
+    TOOL_NOT_IN_LEVEL = 3
+    STORAGE_NEEDS_ITEM = 4
+    DUPLICATE_AGENTS = 5
+    ALL_NOOP = 6
+    NOT_LOCATED = 7
+    NOT_PICKABLE = 8
+    STORAGE_BASE_ONLY = 9
+    LOCATION_EMPTY = 10
+    AGENT_OCCUPIED = 11
+    HOLDING_CANNOT_GET = 12
+    LOCATION_OCCUPIED_GET = 13
+    DISH_NOT_NEEDED = 14
+    PUT_WASTE = 15
+    NOT_HOLDING = 16
+    LOCATION_OCCUPIED_PUT = 17
+    MAX_CAPACITY = 18
+    ACTIVATE_WASTE = 19
+    HOLDING_CANNOT_ACTIVATE = 20
+    LOCATION_OCCUPIED_ACTIVATE = 21
+    EMPTY_CANNOT_ACTIVATE = 22
+    # suggestions
+    PUT_WASTE_INTO_STORAGE = 23
+
+
+# {agent} is the agent name, {agent_id} its index, {location} the location name, {item} the object name and
+# {token} the part of the command that cannot be parsed
+feedback_templates = {
+    FeedbackCode.NOT_ENOUGH_ARGUMENTS: 'not enough arguments for action {token}',
+    FeedbackCode.UNSUPPORTED_ACTION: '{token} is not in the list of supported actions',
+    FeedbackCode.AGENT_ID_NOT_FOUND: 'agent id not found',
+    FeedbackCode.TOOL_NOT_IN_LEVEL: 'for agent{agent_id}, tool {location} is not in the current game level',
+    FeedbackCode.STORAGE_NEEDS_ITEM: 'for agent{agent_id}, need to specify the item to get from storage',
+    FeedbackCode.DUPLICATE_AGENTS: 'agent ids cannot be the same',
+    FeedbackCode.ALL_NOOP: 'None of the agents performed any actions which is not normal.',
+    FeedbackCode.NOT_LOCATED: '{agent} is not located in {location}',
+    FeedbackCode.NOT_PICKABLE: '{agent} is not allowed to pick up from {location} at this point',
+    FeedbackCode.STORAGE_BASE_ONLY: '{agent} can only pickup base ingredients from the storage',
+    FeedbackCode.LOCATION_EMPTY: '{location} is empty, you cannot get anything from there',
+    FeedbackCode.AGENT_OCCUPIED: '{agent} is occupied therefore cannot take any actions other than noop',
+    FeedbackCode.HOLDING_CANNOT_GET: '{agent} is holding objects, therefore cannot get objects from the tool',
+    FeedbackCode.LOCATION_OCCUPIED_GET: '{location} is occupied, therefore {agent} cannot get objects from the tool',
+    FeedbackCode.DISH_NOT_NEEDED: '{item} is not any dish needed in this level and cannot be put on {location}',
+    FeedbackCode.PUT_WASTE: 'putting {item} into {location} will result in waste',
+    FeedbackCode.NOT_HOLDING: '{agent} is not holding objects, therefore cannot put objects into the tool',
+    FeedbackCode.LOCATION_OCCUPIED_PUT: '{location} is occupied, therefore cannot put objects into it',
+    FeedbackCode.MAX_CAPACITY: '{location} reaches maximum capacity',
+    FeedbackCode.ACTIVATE_WASTE: 'activating {location} will result in waste',
+    FeedbackCode.HOLDING_CANNOT_ACTIVATE: '{agent} is holding objects, therefore cannot activate tools',
+    FeedbackCode.LOCATION_OCCUPIED_ACTIVATE: '{location} is occupied, therefore cannot be activated',
+    FeedbackCode.EMPTY_CANNOT_ACTIVATE: '{location} is empty, therefore cannot be activated',
+    FeedbackCode.PUT_WASTE_INTO_STORAGE: 'put the waste into the storage',
+}
+
+# the templates with agents, tools and items anonymized, used to group the feedback in the analysis
+feedback_categories = {
+    code: template.format(agent='agent', agent_id='', location='tool', item='item', token='action')
+    for code, template in feedback_templates.items()
+}
+
+
+class FeedbackEvent(NamedTuple):
+    code: FeedbackCode
+    agent: Optional[int] = None
+    # location name, or the part of the command that cannot be parsed
+    location: Optional[str] = None
+    # object ids
+    item: Optional[tuple] = None
+
+    def render(self, agent_names=None) -> str:
+        if self.agent is None:
+            agent = None
+        elif agent_names is not None:
+            agent = agent_names[self.agent]
+        else:
+            agent = f'agent{self.agent}'
+        item = '&'.join([object_names[i] for i in self.item]) if self.item else None
+        return feedback_templates[self.code].format(agent=agent, agent_id=self.agent, location=self.location,
+                                                   item=item, token=self.location)
+
 
 meat = ["pork", "beef","tuna", "salmon", "lamb", "chicken",  "turkey","egg", "duck", "lobster", "pepperoni"]
 vegetables = ["potato", "carrot", "onion", 'lettuce', 'tomato', 'cucumber', 'leek', "broccoli"]
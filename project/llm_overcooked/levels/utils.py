@@ -2,16 +2,13 @@ import json
 import math
 import re
 import uuid
+from functools import lru_cache
 
-import matplotlib
-import matplotlib.pyplot as plt
-
-matplotlib.use('agg')
 import networkx as nx
 
 from levels.constants import (ALPHA, BETA, GAMMA, StepReturnType,
                               all_location_types, all_objecsts,
-                              base_ingridients, occupied_time)
+                              base_ingridients, object_names, occupied_time)
 
 
 def filter_recipe(recipe, tasks):
@@ -35,62 +32,8 @@ def extract_agent_id(string):
         return match.group(1)
     return None
 
-def compute_wait_time(task_name):
-    with open('assets/recipe.json', 'r') as f:
-        recipes = json.load(f)
-
-    if task_name not in recipes:
-        return -1
-    # Define the set of nodes and edges in the graph
-    nodes = []
-    edges = []
-    queue  = [task_name]
-
-    wait_time = 0
-    while len(queue) > 0:
-        front = queue.pop(0)
-        nodes.append(front)
-        if front in base_ingridients:
-            continue
-        children = recipes[front]['ingredients']
-        # TODO(jxma): minus 1 to substract the "activate" action
-        if occupied_time[recipes[front]['location']] > 1:
-            wait_time += occupied_time[recipes[front]['location']] - 1
-
-        for child in children:
-            edges.append((child, front, {'label': recipes[front]['location']}))
-        queue.extend(children)
-    
-    # Create the graph object
-    G = nx.DiGraph()
-
-    # Add the nodes and edges to the graph
-    G.add_nodes_from(nodes)
-    G.add_edges_from(edges)
-
-    # Check if the graph is a DAG (i.e., has no cycles)
-    if not nx.is_directed_acyclic_graph(G):
-        print("Graph contains a cycle")
-
-    # Get the topological sort order of the nodes (i.e., the order in which to process the dependencies)
-    topological_order = list(nx.topological_sort(G))
-    # TODO(jxma): we tentatively view 1 edge as 3 time steps (get, goto, put)
-    total_wait_time = wait_time + len(topological_order) * 3
-    return total_wait_time
-
-def compute_dependency(task_name, return_mapping=False, return_graph=False):
-    # return the following:
-    # - topological order of the ingridients
-    # - tools required to finsih the task
-
-    with open('assets/recipe.json', 'r') as f:
-        recipes = json.load(f)
-
-    if task_name not in recipes:
-        if return_mapping:
-            return [], [], [], []
-        else:
-            return [], []
+def _build_dependency(task_name, recipes):
+    # dependency graph of a single recipe, see `compute_dependency` and `compute_wait_time`
     # Define the set of nodes and edges in the graph
     nodes = []
     edges = []
@@ -98,6 +41,7 @@ def compute_dependency(task_name, return_mapping=False, return_graph=False):
     stack = [task_name]
     tools = []
     mappings = {}
+    wait_time = 0
 
     depth_mapping = {task_name: 1 }
     while len(stack) > 0 :
@@ -122,6 +66,9 @@ def compute_dependency(task_name, return_mapping=False, return_graph=False):
             mappings[recipes[front]['location']] = [children]
         else:
             mappings[recipes[front]['location']].append(children)
+        # TODO(jxma): minus 1 to substract the "activate" action
+        if occupied_time[recipes[front]['location']] > 1:
+            wait_time += occupied_time[recipes[front]['location']] - 1
 
         for child in children:
             edges.append((child, front, {'label': recipes[front]['location']}))
@@ -142,17 +89,67 @@ def compute_dependency(task_name, return_mapping=False, return_graph=False):
 
     # Get the topological sort order of the nodes (i.e., the order in which to process the dependencies)
     topological_order = list(nx.topological_sort(G))
+    # TODO(jxma): we tentatively view 1 edge as 3 time steps (get, goto, put)
+    total_wait_time = wait_time + len(topological_order) * 3
+
+    return {
+        'nodes': nodes,
+        'edges': edges,
+        'topological_order': topological_order,
+        'tools': tools,
+        'reward_mapping': reward_mapping,
+        'mappings': mappings,
+        'wait_time': total_wait_time,
+    }
+
+
+@lru_cache(maxsize=None)
+def dependency_table(recipe_filename='assets/recipe.json'):
+    # the dependencies of every recipe, computed once per recipe file and process. Callers must not modify the
+    # returned entries, `compute_dependency` and `compute_wait_time` hand out copies
+    with open(recipe_filename, 'r') as f:
+        recipes = json.load(f)
+    return {task_name: _build_dependency(task_name, recipes) for task_name in recipes}
+
+
+def compute_wait_time(task_name):
+    table = dependency_table()
+    if task_name not in table:
+        return -1
+    return table[task_name]['wait_time']
+
+def compute_dependency(task_name, return_mapping=False, return_graph=False):
+    # return the following:
+    # - topological order of the ingridients
+    # - tools required to finsih the task
+    table = dependency_table()
+
+    if task_name not in table:
+        if return_mapping:
+            return [], [], [], []
+        else:
+            return [], []
+    entry = table[task_name]
 
     if return_graph:
+        G = nx.DiGraph()
+        G.add_nodes_from(entry['nodes'])
+        G.add_edges_from(entry['edges'])
         return G
 
     # Print the topological sort order
     if return_mapping:
-        return topological_order, tools, reward_mapping, mappings
+        return (list(entry['topological_order']), list(entry['tools']), dict(entry['reward_mapping']),
+                {key: list(value) for key, value in entry['mappings'].items()})
     else:
-        return topological_order, tools
+        return list(entry['topological_order']), list(entry['tools'])
 
 def draw_dependecy_graph(G, add_serving_table=True):
+    # pyplot is only imported when drawing, it is most of the import time of the engine
+    import matplotlib
+    matplotlib.use('agg')
+    import matplotlib.pyplot as plt
+
     plt.figure(figsize=(40, 13))
     if add_serving_table:
         G.add_node('success')
@@ -177,6 +174,7 @@ def draw_dependecy_graph(G, add_serving_table=True):
     return path
 
 
+@lru_cache(maxsize=None)
 def compute_lifetime_task_intervals(task_name:str, num_agents:int, alpha=None, beta=None):
     topological_order, tools  = compute_dependency(task_name=task_name)
     total_wait_time = compute_wait_time(task_name=task_name)
@@ -199,172 +197,87 @@ def compute_lifetime_task_intervals(task_name:str, num_agents:int, alpha=None, b
     return math.ceil(lifetime), math.ceil(task_interval)
 
 def get_goal_prompt(state: StepReturnType):
-    prompt = ""
-    prompt += "current dishes:\n"
-    for i, j in zip(state.current_tasks_name, state.current_tasks_lifetime):
-        prompt += f"    name: {i} lifetime: {j}\n"
-    return prompt
+    return render_prompt(state, 'goal')
 
 def get_state_prompt(state: StepReturnType):
-    num_agents = len(state.agents)
-
-    prompt = ""
-    prompt += f"current game step: {state.current_step}\n"
-    prompt += f"maximum game steps: {state.max_steps}\n"
-
-    prompt += '\n-agent state:\n'
-    # agent state
-    for i in range(num_agents):
-        prompt += f"at(agent{i}, {state.agents[i]['location'] })\n"
-        prompt += f"hold(agent{i}, {state.agents[i]['hold']})\n"
-        if state.agents[i]['occupy']:
-            prompt += f"occupy(agent{i}, {str(bool(state.agents[i]['occupy']))})\n"
-
-    prompt += '\n-kitchen state:\n'
-    # kitchen state
-    for location in state.locations:
-        content = location['content']
-        prompt += f"inside({location['id']}, {content})\n"
-        if location['occupy']:
-            prompt += f"occupy({location['id']})\n"
-
-    prompt += "\n-accomplished task:\n"
-    for task in state.accomplished_tasks:
-        prompt += f"{task}, "
-
-    prompt += "\n\n"
-    return prompt
+    return render_prompt(state, 'state')
 
 def convert_to_prompt(state: StepReturnType):
-    prompt = ""
-    num_agents = len(state.agents)
-
-    prompt += "-game state:\n"
-    # game state
-    prompt += f"current game level: {state.current_level}\n"
-    prompt += "current dishes:\n"
-    for i, j in zip(state.current_tasks_name, state.current_tasks_lifetime):
-        prompt += f"    name: {i} lifetime: {j}\n"
-    prompt += f"current game step: {state.current_step}\n"
-    prompt += f"maximum game steps: {state.max_steps}\n"
-
-    prompt += '\n-agent state:\n'
-    # agent state
-    for i in range(num_agents):
-        prompt += f"at({state.agents[i]['name']}, {state.agents[i]['location'] })\n"
-        prompt += f"hold({state.agents[i]['name']}, {state.agents[i]['hold']})\n"
-        if state.agents[i]['occupy']:
-            prompt += f"occupy({state.agents[i]['name']}, {str(bool(state.agents[i]['occupy']))})\n"
-
-    prompt += '\n-kitchen state:\n'
-    # kitchen state
-    for location in state.locations:
-        content = location['content']
-        prompt += f"inside({location['id']}, {content})\n"
-        if location['occupy']:
-            prompt += f"occupy({location['id']})\n"
-
-    prompt += "\n-accomplished task:\n"
-    for task in state.accomplished_tasks:
-        prompt += f"{task}, "
-
-    prompt += "\n\n"
-
+    return render_prompt(state, 'full')
+
+
+def render_prompt(state, kind):
+    # the prompts are rendered once per observation (the agents of a step share them) and memoized on the state
+    # digest (ex. replays of the same states), see `_render_prompt`
+    prompts = getattr(state, 'prompts', None)
+    if prompts is None:
+        return _render_prompt(kind, _state_digest(state))
+    prompt = prompts.get(kind)
+    if prompt is None:
+        prompt = _render_prompt(kind, state.digest)
+        prompts[kind] = prompt
     return prompt
 
-def convert_to_state(state: StepReturnType):
-    import numpy as np
-
-    # current tasks names [*5],  current lifetime[*5], $ 5
-    # current game step, maximum game step,  $ 2
-    # agent 1 location, agent 1 holding , agent1 occupied,  agent 2 location, agent 2 holding, agent 2 occupied $ 6
-    # total_tools *4 and its contents.
-    num_tools = len(all_location_types)
-    num_objects = len(all_objecsts)
-
-    feature = np.zeros(64)
-
-    start_idx = 0
-    for idx, task in enumerate(state.current_tasks_name):
-        num = all_objecsts.index(task)
-        feature[start_idx] = num
-        start_idx += 1
-
-    start_idx = 5
-    for lifetime in state.current_tasks_lifetime:
-        feature[start_idx] = lifetime
-        start_idx += 1
-
-    start_idx = 10
-    feature[start_idx] = state.current_step
-    start_idx = 11
-    feature[start_idx] = state.max_steps
-
-    start_idx = 12
-    loc_id = int(state.agents[0]['location'][-1])
-    loc = state.agents[0]['location'][:-1]
-    feature[start_idx] = all_location_types.index(loc)*3 + loc_id
-
-    start_idx = 13
-    if state.agents[0]['hold']:
-        if state.agents[0]['hold'] == 'waste':
-            feature[start_idx] = -2
-        else:
-            feature[start_idx] = all_objecsts.index(state.agents[0]['hold'])
-    else:
-        feature[start_idx] = -1
-
-    start_idx = 14
-    feature[start_idx] = int(state.agents[0]['occupy'])
-
-    start_idx = 15
-
-    loc_id = int(state.agents[1]['location'][-1])
-    loc = state.agents[1]['location'][:-1]
-    feature[start_idx] = all_location_types.index(loc)*3 + loc_id
-
-
-    start_idx = 16
-    if state.agents[1]['hold']:
-        if state.agents[1]['hold'] == 'waste':
-            feature[start_idx] = -2
-        else:
-            feature[start_idx] = all_objecsts.index(state.agents[1]['hold'])
-    else:
-        feature[start_idx] = -1
-    start_idx = 17
-    feature[start_idx] = int(state.agents[1]['occupy'])
-
-    start_idx = 18
-    max_num = 18
-
-    for location in state.locations:
-        content = location['content']
-        if content:
-
-            content_idx = 0
-            for c in content.split('&'):
-                if c == 'waste':
-                    content_idx = -2
-                    break
-                tmp = 1 << all_objecsts.index(c)
-                content_idx += tmp
-
-        else:
-            content_idx = -1
-        loc_id = int(location['id'][-1])
-        loc = location['id'][:-1]
-
-        loc_num = all_location_types.index(loc)*4 + loc_id + start_idx
-        occupancy_index = all_location_types.index(loc)*4 + 3 + start_idx
-
-        if location['occupy']:
-            feature[occupancy_index] = 1
-
-        feature[loc_num] = content_idx
-        max_num = max(max_num, loc_num)
-    return feature
 
+def _state_digest(state):
+    # `Observation.digest` of a state given as a `StepReturnType`, with the contents as rendered strings
+    return (state.current_level, tuple(state.current_tasks_name), tuple(state.current_tasks_lifetime),
+            state.current_step, state.max_steps,
+            tuple((agent['name'], agent['location'], agent['hold'], agent['occupy']) for agent in state.agents),
+            tuple(location['id'] for location in state.locations),
+            tuple((location['content'], location['occupy']) for location in state.locations),
+            tuple(state.accomplished_tasks))
+
+
+def _content_names(content):
+    # object ids (of `Observation`) as the names joined by '&', contents that are already strings are kept
+    if isinstance(content, tuple):
+        return '&'.join([object_names[i] for i in content]) if content else None
+    return content
+
+
+@lru_cache(maxsize=65536)
+def _task_line(name, lifetime):
+    return f"    name: {name} lifetime: {lifetime}\n"
+
+
+@lru_cache(maxsize=65536)
+def _agent_lines(label, location, holding, occupied):
+    lines = f"at({label}, {location})\nhold({label}, {_content_names(holding)})\n"
+    if occupied:
+        lines += f"occupy({label}, True)\n"
+    return lines
+
+
+@lru_cache(maxsize=65536)
+def _location_lines(name, content, occupied):
+    lines = f"inside({name}, {_content_names(content)})\n"
+    if occupied:
+        lines += f"occupy({name})\n"
+    return lines
+
+
+@lru_cache(maxsize=4096)
+def _render_prompt(kind, digest):
+    # kind: 'goal' (`get_goal_prompt`), 'state' (`get_state_prompt`, agents named agent<i>) or 'full'
+    # (`convert_to_prompt`). the predicate lines of every agent/location/task state are formatted once
+    level, tasks, lifetimes, step, max_steps, agent_states, location_names, location_states, accomplished = digest
+    goal = "current dishes:\n" + ''.join([_task_line(name, lifetime) for name, lifetime in zip(tasks, lifetimes)])
+    if kind == 'goal':
+        return goal
+
+    parts = [f"current game step: {step}\nmaximum game steps: {max_steps}\n\n-agent state:\n"]
+    for i, (name, location, holding, occupied) in enumerate(agent_states):
+        parts.append(_agent_lines(name if kind == 'full' else f'agent{i}', location, holding, bool(occupied)))
+    parts.append('\n-kitchen state:\n')
+    for name, (content, occupied) in zip(location_names, location_states):
+        parts.append(_location_lines(name, content, bool(occupied)))
+    parts.append("\n-accomplished task:\n")
+    parts.extend([f"{task}, " for task in accomplished])
+    parts.append("\n\n")
+    if kind == 'full':
+        parts.insert(0, f"-game state:\ncurrent game level: {level}\n{goal}")
+    return ''.join(parts)
 
 def load_data():
     import os
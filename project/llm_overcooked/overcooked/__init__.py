@@ -1,7 +1,17 @@
 from .game import World
+from .vec_game import VecWorld
+from .state_encoder import StateEncoder
 import gym
 gym.envs.register(
      id='Overcooked-v0',
      entry_point='overcooked:ARNNWrapper',
      max_episode_steps=60,
-)
\ No newline at end of file
+)
+
+
+def __getattr__(name):
+    # the wrappers (stable-baselines3, and torch once the text encoder is used) are only imported to make the env
+    if name == 'ARNNWrapper':
+        from .wrappers.ar_nn_wrapper import ARNNWrapper
+        return ARNNWrapper
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
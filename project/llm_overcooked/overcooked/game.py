@@ -4,29 +4,43 @@ import json
 import os
 import random
 import warnings
-from collections import Counter, defaultdict
-from typing import List, Optional
+from collections import Counter, OrderedDict, defaultdict
+from functools import lru_cache
+from itertools import combinations
+from typing import List, NamedTuple, Optional, Tuple
 from uuid import uuid1
 
 import gymnasium.spaces as spaces
 import numpy as np
 
-from levels.constants import (ItemName, LocationType, StepReturnType,
-                              all_objecsts, base_ingridients)
+from levels.constants import (WASTE_ID, FeedbackCode, FeedbackEvent, ItemName,
+                              LocationType, Observation, all_actions,
+                              all_objecsts, base_ingridients, capacity,
+                              need_watch, object_ids, object_names,
+                              occupied_time, type_table)
 from levels.utils import (compute_dependency, compute_lifetime_task_intervals,
                           extract_agent_id, filter_recipe)
 
+from .state_encoder import StateEncoder
+
+# ids of the base ingredients, the only items given out by the storages
+BASE_IDS = frozenset(object_ids[i] for i in base_ingridients)
+
 
 class Location:
+    __slots__ = ('type', 'name', 'content', 'refresh_time', 'is_occupied', 'need_watch', 'capacity', 'pickable')
+
     def __init__(self, loc_type : LocationType, name:str,  occupied_time : int, capacity: int, need_watch: bool) -> None:
         self.type : LocationType = loc_type
         self.name = name
-        self.content : Optional[Item] = None
         self.refresh_time = occupied_time
-        self.is_occupied : int = 0
         self.need_watch = need_watch
         self.capacity : int = capacity
+        self.reset()
 
+    def reset(self):
+        self.content : Optional[Item] = None
+        self.is_occupied : int = 0
         # TODO(jxma): you cannot pick from serving table and you can always pick from storage and chopboard
         self.pickable : bool = False
         if self.type == LocationType.STORAGE or self.type == LocationType.CHOPBOARD:
@@ -59,33 +73,69 @@ class Location:
             return 0
 
 class Item():
+    # the contents are a tuple of interned object ids (see `levels.constants.object_ids`) in insertion order,
+    # the '&'-joined name is only built when a prompt or a record asks for it
+    __slots__ = ('ids', '_name', '_key')
+
     def __init__(self, item ) -> None:
-        self.name = item
+        self.ids = tuple(object_ids[i] for i in item.split('&'))
+        self._name = item
+        self._key = None
+
+    @classmethod
+    def from_ids(cls, ids):
+        item = cls.__new__(cls)
+        item.ids = ids
+        item._name = None
+        item._key = None
+        return item
+
+    @property
+    def name(self):
+        if self._name is None:
+            self._name = '&'.join([object_names[i] for i in self.ids])
+        return self._name
+
+    @name.setter
+    def name(self, name):
+        self.ids = tuple(object_ids[i] for i in name.split('&'))
+        self._name = name
+        self._key = None
+
+    @property
+    def key(self):
+        # order-free multiset of the contents, used for recipe and task lookups
+        if self._key is None:
+            self._key = tuple(sorted(self.ids))
+        return self._key
+
+    def contains(self, item):
+        return len(item.ids) == 1 and item.ids[0] in self.ids
 
     def add(self, item, merge_item=True):
-        contents = self.name.split('&')
-        if merge_item and item.name in contents:
+        if merge_item and self.contains(item):
             return
-        self.name += '&' + item.name
+        self.ids += item.ids
+        self._name = None
+        self._key = None
 
     def all_content(self):
-        return self.name.split('&')
+        return [object_names[i] for i in self.ids]
 
     @property
     def quantity(self):
-        return len(self.all_content())
+        return len(self.ids)
 
     def cook(self, location: Location, recipe):
         # do the cook magic (inc. chop, steam, pan fry, blend, etc) here
         # based on recipe
-        all_ingredients = self.all_content()
-        dish = recipe.make(location, all_ingredients)
+        dish = recipe.make(location, self.key)
 
         return dish
 
     def __eq__(self, other):
         if isinstance(other, Item):
-            return self.name == other.name
+            return self.ids == other.ids
         return False
 
 # all the recipes
@@ -96,20 +146,38 @@ class RECIPE:
         self.process_recipe()
 
     def process_recipe(self):
+        # (sorted ingredient ids, location type) -> product id
         tmp = {}
+        # (location type, sorted content ids) -> ids that can still be put into the location, for every content that
+        # is part of some recipe of that location (the empty content included)
+        self.allowed_items = defaultdict(set)
         for k, v in self.recipe.items():
-            tmp['_'.join(sorted(v['ingredients']) + [v['location']])] = k
+            ingredients = tuple(sorted(object_ids[i] for i in v['ingredients']))
+            tmp[(ingredients, v['location'])] = object_ids[k]
+            for num in range(len(ingredients) + 1):
+                for content in combinations(ingredients, num):
+                    remaining = Counter(ingredients) - Counter(content)
+                    self.allowed_items[(v['location'], content)].update(remaining.keys())
+        self.allowed_items = {key: frozenset(value) for key, value in self.allowed_items.items()}
         self.recipe = tmp
 
-    def make(self, location: Location, all_ingredients: List[str]) -> Item:
-        sorted_ing = '_'.join(sorted(all_ingredients) + [location.type.value])
+    def allowed(self, location: Location, content: tuple) -> frozenset:
+        # ids that can be put into `location` holding `content` (sorted ids, see `Item.key`) without resulting in waste
+        return self.allowed_items.get((location.type.value, content), frozenset())
+
+    def cooks_to_waste(self, location: Location, content: tuple) -> bool:
+        # whether activating `location` holding `content` (sorted ids, see `Item.key`) would result in waste
+        return (content, location.type.value) not in self.recipe
+
+    def make(self, location: Location, ingredients: tuple) -> Item:
+        # `ingredients` is the sorted tuple of object ids, see `Item.key`
         # TODO: in the actual game, cooking will be impossible for wrong ingredients
         # but here we have them cooked into waste
-
-        if sorted_ing not in self.recipe:
-            return Item(ItemName.waste)
+        dish = self.recipe.get((ingredients, location.type.value))
+        if dish is None:
+            return Item.from_ids((WASTE_ID,))
         else:
-            return Item(ItemName.from_str(self.recipe[sorted_ing]))
+            return Item.from_ids((dish,))
 
 
 class TaskManagerReturnType:
@@ -127,6 +195,53 @@ class TaskManagerReturnType:
         self.just_success_remaining_time = just_success_remaining_time
         self.just_failed = just_failed
 
+class TaskManagerSnapshot(NamedTuple):
+    current_task_list: tuple
+    current_task_lifetime_list: tuple
+    timer: int
+    accomplished_task_list: tuple
+    base_picked: tuple
+    intermediate_cooked: tuple
+    hold_reward_given: tuple
+    loc_satisfied: tuple
+    # (name, tuple of rewarded contents or None) of every agent and location
+    reward_memory: tuple
+    rng_state: tuple
+    # the pre-sampled tasks of the episode (or None) and the number of them drawn so far
+    task_schedule: Optional[tuple]
+    schedule_pos: int
+
+
+def episode_seed(seed, episode_index):
+    # seed of the task stream of episode `episode_index`, independent of the episodes played before it
+    return int(np.random.SeedSequence([seed, episode_index]).generate_state(1)[0])
+
+
+@lru_cache(maxsize=None)
+def reward_shaping_increments(task):
+    # the object ids (and location keys) whose shaping memories are increased when `task` is added, computed once
+    # per task from its dependencies
+    all_required_items, tools, reaward_mappings, mappings = compute_dependency(task, return_mapping=True)
+    if len(mappings) == 0:
+        return (), (), (), ()
+
+    base_picked, intermediate_cooked, hold_reward_given = [], [], []
+    for item in all_required_items:
+        if item in base_ingridients:
+            base_picked.append(object_ids[item])
+        elif item != all_required_items[-1]:
+            intermediate_cooked.append(object_ids[item])
+        else:
+            hold_reward_given.append(object_ids[item])
+            intermediate_cooked.append(object_ids[item])
+
+    loc_satisfied = []
+    for loc_type , list_products in mappings.items():
+        for products in list_products:
+            loc_satisfied.append((loc_type, tuple(sorted(object_ids[i] for i in products))))
+    return tuple(base_picked), tuple(intermediate_cooked), tuple(hold_reward_given), tuple(loc_satisfied)
+
+
 class TaskManager:
 
     def __init__(self,
@@ -144,7 +259,14 @@ class TaskManager:
         self._task_def = task_def
         self.num_agents = num_agents
         self.rng = rng
+        # `rng.getstate()` is the most expensive part of a snapshot, it is cached until the next task is drawn
+        self._rng_state = None
+        # if set, the tasks are drawn from this schedule instead of the rng, see `sample_schedule`
+        self.task_schedule = None
+        self._schedule_pos = 0
         self._all_tasks = list(self._task_def['task_list'].keys())
+        # the contents (object ids) of the dishes of the tasks, what the serving tables take
+        self._all_task_ids = frozenset((object_ids[task],) for task in self._all_tasks)
 
         if use_task_lifetime_interval_oracle:
             # rewrite task def
@@ -168,25 +290,57 @@ class TaskManager:
         self._timer = 0
         self._accomplished_task_list = []
         self._tools_mapping = {}
+        self._locations_by_type = {}
+        # contents (object ids) of the locations that satisfied none of the current tasks at the last check, they
+        # only need to be checked again once they change or a task is added
+        self._unmatched_contents = {}
+        # required ingredients (as object id counters) of every task
+        self._task_requirements = {
+            task: Counter(object_ids[i] for i in value['ingredients'])
+            for task, value in self._task_def['task_list'].items()}
+
+    def _index_locations(self, tools_mapping):
+        self._tools_mapping = tools_mapping
+        self._locations_by_type = defaultdict(list)
+        for loc_name, loc in tools_mapping.items():
+            self._locations_by_type[loc.type.value].append((loc_name, loc))
+        self._unmatched_contents = {}
 
     def _random_task(self):
+        if self.task_schedule is not None and self._schedule_pos < len(self.task_schedule):
+            self._schedule_pos += 1
+            return self.task_schedule[self._schedule_pos - 1]
+        self._rng_state = None
         return self.rng.choice(self._all_tasks)
 
-    def reset(self, first_task=None, tools_mapping=None):
+    def sample_schedule(self, max_steps):
+        # all the tasks an episode of `max_steps` steps can draw (the first one and one per task interval), in the
+        # order they are drawn. they are the same tasks `_random_task` would draw from the rng
+        num_tasks = 1
+        if self._task_interval > 0:
+            num_tasks += max_steps // self._task_interval
+        self._rng_state = None
+        return tuple(self.rng.choice(self._all_tasks) for _ in range(num_tasks))
+
+    def reset(self, first_task=None, tools_mapping=None, task_schedule=None):
         #FIXME(jxma): tentatively use strict check
         assert tools_mapping is not None
-        self._tools_mapping = tools_mapping
+        self.task_schedule = tuple(task_schedule) if task_schedule is not None else None
+        self._schedule_pos = 0
+        if tools_mapping is not self._tools_mapping:
+            self._index_locations(tools_mapping)
+        self._unmatched_contents = {}
         self._all_tasks = list(self._task_def['task_list'].keys())
         self._current_task_list = []
         self._current_task_lifetime_list = []
-        # four types of memory to help shape the reward
-        self.base_picked = { key: 0 for key in all_objecsts }
+        # four types of memory to help shape the reward, indexed by object id
+        self.base_picked = [0] * len(object_names)
         self.loc_satisfied = {}
-        self.intermediate_cooked = {key: 0 for key in all_objecsts}
-        self.hold_reward_given = {key: 0 for key in all_objecsts}
+        self.intermediate_cooked = [0] * len(object_names)
+        self.hold_reward_given = [0] * len(object_names)
         self.reward_memory = {'agent_'+str(key): None for key in range(self.num_agents)}
         self.reward_memory.update({
-          key: [] for key, value in self._tools_mapping.items()
+          key: set() for key, value in self._tools_mapping.items()
         })
         if first_task:
             assert first_task in self._all_tasks
@@ -195,9 +349,7 @@ class TaskManager:
             first_task = self._random_task()
             self._current_task_list.append(first_task)
 
-        all_required_items, tools, reaward_mappings, mappings = compute_dependency(first_task, return_mapping=True)
-        if len(mappings) > 0:
-            self.update_reward_shaping_memories(all_required_items, mappings)
+        self.update_reward_shaping_memories(first_task)
 
         if 'task_lifetime' in self._task_def['task_list'][self._current_task_list[-1]]:
             self._current_task_lifetime_list.append(
@@ -208,23 +360,20 @@ class TaskManager:
         self._timer = 0
         self._accomplished_task_list = []
 
-    def update_reward_shaping_memories(self, all_required_items, mappings):
+    def update_reward_shaping_memories(self, task):
         # update the four memories
-        for item in all_required_items:
-            if item in base_ingridients:
-                self.base_picked[item] += 1
-            elif item != all_required_items[-1]:
-                self.intermediate_cooked[item] += 1
+        base_picked, intermediate_cooked, hold_reward_given, loc_satisfied = reward_shaping_increments(task)
+        for i in base_picked:
+            self.base_picked[i] += 1
+        for i in intermediate_cooked:
+            self.intermediate_cooked[i] += 1
+        for i in hold_reward_given:
+            self.hold_reward_given[i] += 1
+        for key in loc_satisfied:
+            if key not in self.loc_satisfied:
+                self.loc_satisfied[key] = 1
             else:
-                self.hold_reward_given[item] += 1
-                self.intermediate_cooked[item] += 1
-
-        for loc_type , list_products in mappings.items():
-            for products in list_products:
-                if (loc_type, '&'.join(sorted(products)) ) not in self.loc_satisfied:
-                    self.loc_satisfied[(loc_type, '&'.join(sorted(products)) ) ] = 1
-                else:
-                    self.loc_satisfied[(loc_type, '&'.join(sorted(products)) ) ] += 1
+                self.loc_satisfied[key] += 1
 
     def tick(self):
         self._timer += 1
@@ -238,22 +387,23 @@ class TaskManager:
         if self._timer == self._task_interval:
             if len(self._current_task_list) < self._max_num_tasks:
                 added_task = self._random_task()
-                self._current_task_list.append(added_task)
-                all_required_items, tools,  reaward_mappings, mappings = compute_dependency(added_task, return_mapping=True)
-                if len(mappings) > 0:
-                    self.update_reward_shaping_memories(all_required_items, mappings)
-                if 'task_lifetime' in self._task_def['task_list'][self._current_task_list[-1]]:
-                    self._current_task_lifetime_list.append(
-                        self._task_def['task_list'][self._current_task_list[-1]]['task_lifetime'])
+                self.update_reward_shaping_memories(added_task)
+                if 'task_lifetime' in self._task_def['task_list'][added_task]:
+                    lifetime = self._task_def['task_list'][added_task]['task_lifetime']
                 else:
-                    self._current_task_lifetime_list.append(self._task_lifetime)
+                    lifetime = self._task_lifetime
+                # the tasks are kept sorted by (lifetime, name), which the uniform lifetime decrease does not change,
+                # so the new task is inserted in place, after the equal ones. The new task usually has the longest
+                # lifetime: the scan starts from the end
+                tasks, lifetimes = self._current_task_list, self._current_task_lifetime_list
+                ind = len(tasks)
+                while ind > 0 and (lifetimes[ind - 1], tasks[ind - 1]) > (lifetime, added_task):
+                    ind -= 1
+                tasks.insert(ind, added_task)
+                lifetimes.insert(ind, lifetime)
+                self._unmatched_contents = {}
             self._timer = 0
 
-        # sort all tasks based on the lifetime
-        tmp = sorted(zip(self._current_task_lifetime_list, self._current_task_list))
-        self._current_task_list = [x[1] for x in tmp]
-        self._current_task_lifetime_list = [x[0] for x in tmp]
-
 
     def compute_reward(self, world_state, agents):
         # print('self.intermediate_cooked: ', self.intermediate_cooked)
@@ -262,39 +412,39 @@ class TaskManager:
 
         reward = 0
 
+        # the memories hold the sets of contents (tuples of object ids) that have been rewarded, `waste` is never
+        # rewarded since its counters stay at 0
         for agent_id, agent in enumerate(agents):
-            if agent.holding and agent.holding.name != 'waste' and self.base_picked[agent.holding.name] > 0:
-                if agent.holding.name not in self.reward_memory[agent.name]:
-                    self.reward_memory[agent.name].append(agent.holding.name)
+            if agent.holding and self.base_picked[agent.holding.ids[0]] > 0:
+                if agent.holding.ids not in self.reward_memory[agent.name]:
+                    self.reward_memory[agent.name].add(agent.holding.ids)
                     reward += 0.1
-                    self.base_picked[agent.holding.name] -= 1
+                    self.base_picked[agent.holding.ids[0]] -= 1
 
         for loc_name, loc in world_state.items():
-            loc_type = loc_name[:-1]
             if loc.content:
-                contents = sorted(loc.content.name.split('&'))
-                tmp = (loc_type, '&'.join(contents))
+                tmp = (loc.type.value, loc.content.key)
 
                 if tmp in  self.loc_satisfied and self.loc_satisfied[tmp] > 0:
-                    if loc.content.name not in self.reward_memory[loc_name]:
+                    if loc.content.ids not in self.reward_memory[loc_name]:
                         self.loc_satisfied[tmp] -= 1
                         reward += 0.5
-                        self.reward_memory[loc_name].append(loc.content.name)
+                        self.reward_memory[loc_name].add(loc.content.ids)
 
         for loc_name, loc in world_state.items():
-            if loc.content:
-                if  loc.content.name in self.intermediate_cooked and self.intermediate_cooked[loc.content.name] > 0:
-                    if loc.content.name not in self.reward_memory[loc_name]:
+            if loc.content and len(loc.content.ids) == 1:
+                if self.intermediate_cooked[loc.content.ids[0]] > 0:
+                    if loc.content.ids not in self.reward_memory[loc_name]:
                         reward += 1.0
-                        self.intermediate_cooked[loc.content.name] -= 1
-                        self.reward_memory[loc_name].append(loc.content.name)
+                        self.intermediate_cooked[loc.content.ids[0]] -= 1
+                        self.reward_memory[loc_name].add(loc.content.ids)
 
         for agent_id, agent in enumerate(agents):
-            if agent.holding and agent.holding.name != 'waste' and self.hold_reward_given[agent.holding.name] > 0:
-                if agent.holding.name in self.reward_memory[agent.name]:
-                    self.reward_memory[agent.name].append(agent.holding.name)
+            if agent.holding and self.hold_reward_given[agent.holding.ids[0]] > 0:
+                if agent.holding.ids in self.reward_memory[agent.name]:
+                    self.reward_memory[agent.name].add(agent.holding.ids)
                     reward += 0.5
-                    self.hold_reward_given[agent.holding.name] -= 1
+                    self.hold_reward_given[agent.holding.ids[0]] -= 1
 
         return reward
 
@@ -317,30 +467,40 @@ class TaskManager:
 
         # Note: here the we choose to remove the first task from the list (when there are multiple tasks of the same type).
         # check if any of the current task is accomplished
-        ingredients = [self.task_def['task_list'][i]['ingredients'] for i in self._current_task_list]
+        if world_state is not self._tools_mapping:
+            self._index_locations(world_state)
+        requirements = [self._task_requirements[i] for i in self._current_task_list]
         locations = [self.task_def['task_list'][i]['location'] for i in self._current_task_list]
 
+        # counters of the location contents are only built for the locations a task is checked against, and the
+        # locations that satisfied no task at the last check are skipped as long as their contents are unchanged
+        unmatched_contents = self._unmatched_contents
         all_loc_counter = {}
-        for loc_name, loc in world_state.items():
-            if loc.content:
-                loc_counter = Counter(loc.content.name.split('&'))
-            else:
-                loc_counter = None
-            all_loc_counter[loc_name] = loc_counter
-        for ind, (target_ing, target_loc) in enumerate(zip(ingredients, locations)):
-            target_counter = Counter(target_ing)
-            for loc_name, loc in world_state.items():
-                if loc.type.value == target_loc:
+        matched = set()
+        for ind, (target_counter, target_loc) in enumerate(zip(requirements, locations)):
+            if ind in failed_id:
+                continue
+            for loc_name, loc in self._locations_by_type.get(target_loc, ()):
+                if loc.content and unmatched_contents.get(loc_name) != loc.content.ids:
+                    if loc_name not in all_loc_counter:
+                        all_loc_counter[loc_name] = Counter(loc.content.ids)
+                    loc_counter = all_loc_counter[loc_name]
                     # all item in loc_counter is not less than requirement
-                    if all_loc_counter[loc_name] and ind not in failed_id:
-                        if all(all_loc_counter[loc_name][key] >= target_counter[key] for key in target_counter):
-                            # remove these items from all_loc_counter
-                            for k, v in target_counter.items():
-                                all_loc_counter[loc_name][k] -= v
-                            task_just_success.append(self._current_task_list[ind])
-                            task_just_success_location.append(loc_name)
-                            rmv_id.append(ind)
-                            break
+                    if all(loc_counter[key] >= target_counter[key] for key in target_counter):
+                        # remove these items from all_loc_counter
+                        for k, v in target_counter.items():
+                            loc_counter[k] -= v
+                        task_just_success.append(self._current_task_list[ind])
+                        task_just_success_location.append(loc_name)
+                        rmv_id.append(ind)
+                        matched.add(loc_name)
+                        break
+        # every remaining task of their type has been checked against the other locations without success
+        for loc_name in all_loc_counter:
+            if loc_name in matched:
+                unmatched_contents.pop(loc_name, None)
+            else:
+                unmatched_contents[loc_name] = self._tools_mapping[loc_name].content.ids
 
         # remove the accomplished task and failed task
         for i in rmv_id:
@@ -351,13 +511,42 @@ class TaskManager:
         just_success_reamaning_time = [x for i, x in enumerate(self._current_task_lifetime_list) if i in rmv_id and i not in failed_id]
         self._current_task_lifetime_list = [x for i, x in enumerate(self._current_task_lifetime_list) if i not in rmv_id]
 
-        # sort all tasks based on the lifetime
-        tmp = sorted(zip(self._current_task_lifetime_list, self._current_task_list))
-        self._current_task_list = [x[1] for x in tmp]
-        self._current_task_lifetime_list = [x[0] for x in tmp]
-
         return TaskManagerReturnType(task_just_success, task_just_success_location, game_over, just_success_reamaning_time, just_failed)
 
+    def snapshot(self) -> TaskManagerSnapshot:
+        if self._rng_state is None:
+            self._rng_state = self.rng.getstate()
+        return TaskManagerSnapshot(
+            tuple(self._current_task_list),
+            tuple(self._current_task_lifetime_list),
+            self._timer,
+            tuple(self._accomplished_task_list),
+            tuple(self.base_picked),
+            tuple(self.intermediate_cooked),
+            tuple(self.hold_reward_given),
+            tuple(self.loc_satisfied.items()),
+            tuple((key, None if value is None else frozenset(value)) for key, value in self.reward_memory.items()),
+            self._rng_state,
+            self.task_schedule,
+            self._schedule_pos)
+
+    def restore(self, snap: TaskManagerSnapshot):
+        self._current_task_list = list(snap.current_task_list)
+        self._current_task_lifetime_list = list(snap.current_task_lifetime_list)
+        self._timer = snap.timer
+        self._accomplished_task_list = list(snap.accomplished_task_list)
+        self.base_picked = list(snap.base_picked)
+        self.intermediate_cooked = list(snap.intermediate_cooked)
+        self.hold_reward_given = list(snap.hold_reward_given)
+        self.loc_satisfied = dict(snap.loc_satisfied)
+        self.reward_memory = {key: None if value is None else set(value) for key, value in snap.reward_memory}
+        self._unmatched_contents = {}
+        self.task_schedule = snap.task_schedule
+        self._schedule_pos = snap.schedule_pos
+        if snap.rng_state is not self._rng_state:
+            self.rng.setstate(snap.rng_state)
+            self._rng_state = snap.rng_state
+
     # a list of task name and its current lifetime
     def current_tasks(self):
         return list(zip(self._current_task_list, self._current_task_lifetime_list))
@@ -371,8 +560,93 @@ class TaskManager:
         return self._task_def
 
 
+class ActionCodec:
+    # converts the string commands of `World.step` (ex. get_agent0_flour_storage0) from and to the integer tuples
+    # of `World.step_ids`: (verb, agent, location, item), with verb the index in `all_actions`, location the index
+    # in the `name_mapping` of the level (-1 for noop) and item the object id (-1 if the command has none)
+    def __init__(self, location_names: List[str]) -> None:
+        self.location_names = list(location_names)
+        self.location_ids = {name: idx for idx, name in enumerate(self.location_names)}
+        self._commands = {}
+
+    def encode(self, cmd_str: str) -> tuple:
+        cmd = cmd_str.split('_')
+        if len(cmd) < 2 or len(cmd) > 4 or cmd[0] not in all_actions:
+            raise ValueError(f'invalid action {cmd_str}')
+        if len(cmd) == 4 and cmd[0] not in ['get', 'put']:
+            raise ValueError(f'invalid action {cmd_str}')
+        verb = all_actions.index(cmd[0])
+        agent = int(cmd[1].replace('agent', ''))
+        if len(cmd) == 2:
+            return (verb, agent, -1, -1)
+        if cmd[-1] not in self.location_ids:
+            raise ValueError(f'tool {cmd[-1]} is not in the current game level')
+        item = object_ids[ItemName.from_str(cmd[2])] if len(cmd) == 4 else -1
+        return (verb, agent, self.location_ids[cmd[-1]], item)
+
+    def decode(self, action_id: tuple) -> str:
+        cmd_str = self._commands.get(action_id)
+        if cmd_str is None:
+            verb, agent, location, item = action_id
+            cmd = [all_actions[verb], f'agent{agent}']
+            if item >= 0:
+                cmd.append(object_names[item])
+            if location >= 0:
+                cmd.append(self.location_names[location])
+            cmd_str = '_'.join(cmd)
+            self._commands[action_id] = cmd_str
+        return cmd_str
+
+
+class LevelBlueprint(NamedTuple):
+    # the parts of a level that never change, shared by all the worlds on the level. `tasks_def` is copied by every
+    # world since the task manager rewrites the lifetimes
+    tasks_def: dict
+    # (tool, location name) of every location of the kitchen
+    tools: Tuple[Tuple[str, str], ...]
+    recipe: RECIPE
+    codec: ActionCodec
+
+
+@lru_cache(maxsize=None)
+def level_blueprint(task_filename, level, recipe_filename):
+    # compiled once per level and process, callers must not modify the returned blueprint
+    with open(task_filename, 'r') as f:
+        tasks_def = json.load(f)[level]
+    if 'kitchen' not in tasks_def:
+        raise ValueError(f'kitchen not found in task definition')
+
+    tool_cnt = defaultdict(int)
+    tools = []
+    for tool in tasks_def['kitchen']:
+        tools.append((tool, f'{tool}{tool_cnt[tool]}'))
+        tool_cnt[tool] += 1
+
+    # TODO(jxma): only relevant recipe is valid
+    with open(recipe_filename, 'r') as f:
+        recipe = json.load(f)
+    recipe = RECIPE(filter_recipe(recipe, list(tasks_def['task_list'].keys())))
+    return LevelBlueprint(tasks_def, tuple(tools), recipe, ActionCodec([name for _, name in tools]))
+
+
+class WorldSnapshot(NamedTuple):
+    # (location name, holding ids or None, is_occupied) of every agent
+    agents: Tuple[tuple, ...]
+    # (content ids or None, is_occupied, pickable) of every location, in `name_mapping` order
+    locations: Tuple[tuple, ...]
+    task_manager: TaskManagerSnapshot
+    time_step: int
+    counts: Tuple[int, int, int, int]
+    episode_info: TaskManagerReturnType
+    # (action_history, state_history, action_success_history, previous_actions, feedback_events, suggestion_events,
+    #  feedback_counts)
+    histories: tuple
+
+
 class World:
     metadata = {"render.modes": ["text"]}
+    # number of (agent state, location state) signatures whose legal actions are cached, see `available_actions`
+    available_actions_cache_size = 4096
     def __init__(self,
                  num_agents=2,
                  max_steps=60, # assume every action is 4 seconds, and we have in total 4 minutes
@@ -385,10 +659,19 @@ class World:
                  max_num_tasks=6,
                  seed=0,
                  use_state_observation = False, alpha=None, beta=None, override_agent=False,
-                 play_mode = 'gpt_agent') -> None:
+                 play_mode = 'gpt_agent', mode='full', record_history=None, record_feedback=None,
+                 presample_tasks=False) -> None:
         # play_mode: standard, gpt_agent, play_with_human, random_agent 
         self.play_mode = play_mode
         assert self.play_mode in ['gpt_agent', 'play_with_human', 'random_agent']
+
+        # mode: full, fast. `fast` skips the bookkeeping only read by the LLM agents: the action/state/success
+        # histories (`record_history`) and the feedback and suggestions (`record_feedback`), the flags override the
+        # mode. the dynamics, the rewards and `previous_actions` do not depend on them
+        assert mode in ['full', 'fast']
+        self.mode = mode
+        self.record_history = mode == 'full' if record_history is None else record_history
+        self.record_feedback = mode == 'full' if record_feedback is None else record_feedback
         
         self.use_task_lifetime_interval_oracle = use_task_lifetime_interval_oracle
         self.alpha = alpha
@@ -396,22 +679,20 @@ class World:
 
         self.seed = seed
         self.rng = random.Random(seed)
+        # whether `reset` draws the tasks of the whole episode up front, see `TaskManager.sample_schedule`
+        self.presample_tasks = presample_tasks
         self.time_step = 0
         self.recipe_filename = recipe_filename
         self.use_state_observation = use_state_observation
-        if self.use_state_observation:
-            self.observation_space = spaces.Box(low = -np.inf, high=np.inf, shape=(64,))
-        else:
+        if not self.use_state_observation:
             self.observation_space = spaces.Box(low = -np.inf, high=np.inf, shape=(384*2,))
 
-        with open(task_filename, 'r') as f:
-            self.tasks_def = json.load(f)
-        if level is not None:
-            self.tasks_def = self.tasks_def[level]
-            self.level = level
-        else:
-            self.tasks_def = self.tasks_def['level_1']
-            self.level = 'level_1'
+        if level is None:
+            level = 'level_1'
+        self.level = level
+        self.blueprint = level_blueprint(task_filename, level, recipe_filename)
+        self.tasks_def = copy.deepcopy(self.blueprint.tasks_def)
+        self._locations = None
         # TODO(jxma): we now use num_agents in the task definition by default
         if 'num_agents' in self.tasks_def:
             self.num_agents = self.tasks_def['num_agents']
@@ -443,9 +724,43 @@ class World:
 
         self._episode_info = TaskManagerReturnType()
 
-        self.feedback = []
+        # feedback and suggestions of the last step, as `FeedbackEvent`s. the messages are rendered by the
+        # `feedback`/`suggestions` properties, `feedback_counts` counts the feedback codes over the episode
+        self.feedback_events = []
+        self.suggestion_events = []
+        self.feedback_counts = Counter()
         self.previous_actions= []
+        # the kitchen and the agents exist from the start (ex. for the action masks), `reset` starts the episode
+        self.load_level()
+        # the structured observations are sized by the level
+        self.state_encoder = StateEncoder.for_world(self)
+        if self.use_state_observation:
+            self.observation_space = spaces.Box(low=-np.inf, high=np.inf, shape=(self.state_encoder.size,),
+                                                dtype=np.float32)
+
 
+    @property
+    def feedback(self):
+        return self._render(self.feedback_events)
+
+    @property
+    def suggestions(self):
+        return self._render(self.suggestion_events)
+
+    def _render(self, events):
+        if not events:
+            return []
+        agent_names = [agent.name.replace('_', '') for agent in self.agents]
+        return [event.render(agent_names) for event in events]
+
+    def add_feedback(self, code, agent=None, location=None, item=None):
+        if self.record_feedback:
+            self.feedback_events.append(FeedbackEvent(code, agent, location, item))
+            self.feedback_counts[code] += 1
+
+    def add_suggestion(self, code):
+        if self.record_feedback:
+            self.suggestion_events.append(FeedbackEvent(code))
 
     def kitchen_def(self):
         #TODO (stg): return the list of cooking tools
@@ -459,32 +774,34 @@ class World:
         # TODO(jxma): legacy, return the first task of the current task list
         return self.task_manager._current_task_list[0]
 
-    def setup_tool(self, tool):
-        from levels.constants import (capacity, need_watch, occupied_time,
-                                      type_table)
-        tool_capacity = capacity[tool]
-        tool_occupied_time = occupied_time[tool]
-        tool_need_watch = need_watch[tool]
-
-        location = Location(type_table[tool], f"{tool}{self.tool_cnt[tool]}" ,tool_occupied_time, tool_capacity, tool_need_watch)
+    def setup_tool(self, tool, name=None):
+        if name is None:
+            name = f"{tool}{self.tool_cnt[tool]}"
+        location = Location(type_table[tool], name, occupied_time[tool], capacity[tool], need_watch[tool])
         self.tool_cnt[f'{tool}'] += 1
 
         return location
 
     def load_level(self):
-
-        # TODO(jxma): legacy, compute kitchen from the task, will be removed.
-        # from levels.utils import compute_dependency
-        # topological_order, level = compute_dependency(self.task)
-
-        level = self.kitchen_def()
+        # the locations and agents are built from the level blueprint on the first call, and only reset in place
+        # afterwards. the recipe, the codec and the available actions only depend on the level
+        if self._locations is not None:
+            for location in self._locations:
+                location.reset()
+            for agent in self.agents:
+                agent.reset()
+            return
 
         locations = []
-        for item in level:
-            location = self.setup_tool(item)
+        for tool, name in self.blueprint.tools:
+            location = self.setup_tool(tool, name)
             locations.append(location)
 
         self.name_mapping = { loc.name: loc for loc in locations }
+        self._locations = locations
+        self._location_names = tuple(self.name_mapping)
+        self.codec = self.blueprint.codec
+        self.recipe = self.blueprint.recipe
 
         for key, value in self.name_mapping.items():
             setattr(self, key, value)
@@ -492,13 +809,8 @@ class World:
         self.agents : List[Agent] = []
         for idx in range(self.num_agents):
             self.agents.append(Agent(idx, self))
-
-        # TODO(jxma): only relevant recipe is valid
-        with open(self.recipe_filename, 'r') as f:
-            tmp = json.load(f)
-        # tmp = json.load(open(self.recipe_filename, 'r'))
-        tmp = filter_recipe(tmp, list(self.tasks_def['task_list'].keys()))
-        self.recipe = RECIPE(tmp)
+        # least recently used first, trimmed to `available_actions_cache_size` entries
+        self._available_actions_cache = OrderedDict()
 
     def done(self):
         # Return TaskManagerReturnType:
@@ -526,12 +838,12 @@ class World:
 
         for task_name, loc_name in zip(task_manager_return.task_just_success, task_manager_return.task_just_success_location):
             assert self.name_mapping[loc_name].content is not None
-            current_content= self.name_mapping[loc_name].content.name.split('&')
+            current_content = list(self.name_mapping[loc_name].content.ids)
             for ing in self.task_manager.task_def['task_list'][task_name]['ingredients']:
                 # print(ing, current_content)
-                current_content.remove(ing)
+                current_content.remove(object_ids[ing])
             if current_content:
-                self.name_mapping[loc_name].content.name = '&'.join(current_content)
+                self.name_mapping[loc_name].content = Item.from_ids(tuple(current_content))
             else:
                 self.name_mapping[loc_name].content = None
 
@@ -556,19 +868,19 @@ class World:
             cmd_str = cmd_str.split('_')
             if len(cmd_str) < 2 or len(cmd_str) > 4:
                 # print('not enough arguments')
-                self.feedback.append(f'not enough arguments for action {action}')
+                self.add_feedback(FeedbackCode.NOT_ENOUGH_ARGUMENTS, location=action)
                 return False, None, None, None
 
             predicate = cmd_str[0]
             if predicate not in ['noop', 'goto', 'get', 'put', 'activate']:
-                self.feedback.append(f'{predicate} is not in the list of supported actions')
+                self.add_feedback(FeedbackCode.UNSUPPORTED_ACTION, location=predicate)
                 return False, None, None, None
 
             agent = cmd_str[1]
             try:
                 agent = int(agent.replace('agent', ''))
             except:
-                self.feedback.append(f'agent id not found')
+                self.add_feedback(FeedbackCode.AGENT_ID_NOT_FOUND)
                 return False, None, None, None
 
             if len(cmd_str) == 2:
@@ -587,11 +899,11 @@ class World:
                 location = cmd_str[-1]
                 if location not in self.name_mapping:
                     # print('invalid location')
-                    self.feedback.append(f'for agent{agent}, tool {location} is not in the current game level')
+                    self.add_feedback(FeedbackCode.TOOL_NOT_IN_LEVEL, agent, location)
                     return False, None, None, None
 
                 if predicate == 'get' and location == 'storage':
-                    self.feedback.append(f'for agent{agent}, need to specify the item to get from storage')
+                    self.add_feedback(FeedbackCode.STORAGE_NEEDS_ITEM, agent, location)
                     return False, None, None, None
 
                 arg = [agent, location]
@@ -604,7 +916,7 @@ class World:
                 location = cmd_str[3]
                 if location not in self.name_mapping:
                     # print('invalid location')
-                    self.feedback.append(f'for agent{agent}, tool {location} is not in the current game level')
+                    self.add_feedback(FeedbackCode.TOOL_NOT_IN_LEVEL, agent, location)
                     return False, None, None, None
                 arg = [agent, item,location]
 
@@ -616,7 +928,7 @@ class World:
         agents = [arg[0] for arg in args]
         if len(agents) != len(set(agents)):
             # print("duplicate agents")
-            self.feedback.append(f'agent ids cannot be the same')
+            self.add_feedback(FeedbackCode.DUPLICATE_AGENTS)
             return False, None, None, None
 
 
@@ -655,100 +967,117 @@ class World:
         return True, predicates, args, ignored_actions
 
     def available_actions(self, return_struct=False):
-        from levels.constants import base_ingridients
+        # the legal actions of an agent only depend on its own state and the location it stands at, they are
+        # cached on these (see `_agent_available_actions`) and only recomputed for the agents whose state or
+        # location changed into an unseen one. the returned lists are shared with the cache and must not be modified
         all_actions = []
         all_struct_actions = []
         for i in range(self.num_agents):
-            noops = []
-            gotos = []
-            gets = []
-            puts = []
-            activates = []
-            actions = []
-
-            # noop
-            # agent: not occupied
-            if not self.agents[i].is_occupied:
-                noops.append([i])
-                actions.append(f"noop")
-
-            # goto
-            # agent: not occupied; not at that location already
-            if not self.agents[i].is_occupied:
-                for loc_name, loc in self.name_mapping.items():
-                    if not self.agents[i].location.name == loc_name:
-                        gotos.append([i, loc_name])
-                        actions.append(f"goto {loc_name}")
-
-            # get
-            # agent: not holding anything, not occupied, at the location
-            # location: not occupied, not empty
-            #   if location is storage, can get anything
-            #   if location is not storage, can get only if there is something
-
-            # FIXED:  since it's possbile to get right after the first agent put in, so there is
-            # no longer a requirement on the if the location is empty.
-            # you cannot get anything from serving table
-            if (not self.agents[i].holding) and (not self.agents[i].is_occupied):
-                for loc_name, loc in self.name_mapping.items():
-                    if self.agents[i].location.name == loc_name and not loc.is_occupied:
-                        if loc_name.startswith("storage"):
-                            for item in base_ingridients:
-                                gets.append([i,item, loc_name])
-                                actions.append(f"get {item} {loc_name}")
-                        if not loc.content or loc_name.startswith("servingtable"):
-                            continue
-                        else:
-                            gets.append([i, loc_name])
-                            actions.append(f"get {loc_name}")
-
-            # put
-            # agent: not holding anything, not occupied, at the location
-            # location: not occupied
-            # we don't allow put action that will lead to waste, unless the tool is empty
-            if ( self.agents[i].holding ) and (not self.agents[i].is_occupied) :
-                for loc_name, loc in self.name_mapping.items():
-                        if self.agents[i].location.name == loc_name and not loc.is_occupied:
-                            if self.agents[i].holding and loc.content:
-                                if not loc.name.startswith("servingtable") and not loc.name.startswith("storage"):
-                                    tmp = copy.deepcopy(loc.content)
-                                    tmp.add(self.agents[i].holding)
-                                    if tmp.cook(loc, self.recipe).name == 'waste':
-                                        continue
-                            puts.append([i, loc_name])
-                            actions.append((f"put {loc_name}"))
-
-            # activate
-            # agent: not holding anything, not occupied, at the location
-            # location: not empty, not occupied, not storage or servingtable
-            # FIXED:  since it's possbile to activate right after the first agent put in, so there is
-            # no longer a requirement on the if the location is empty.
-            # activate action that will lead to waste is not allowed
-            if (not self.agents[i].holding) and (not self.agents[i].is_occupied):
-                for loc_name, loc in self.name_mapping.items():
-                    if loc.type in [LocationType.SERVINGTABLE, LocationType.STORAGE]:
-                        continue
-                    if self.agents[i].location.name == loc_name and (not loc.is_occupied):
-                        if loc.content and loc.content.cook(loc, self.recipe).name == 'waste':
-                            continue
-                        activates.append([i,loc_name] )
-                        actions.append(f"activate {loc_name}")
-
-            struct_actions = {
-                'noop': noops,
-                'goto': gotos,
-                'put': puts,
-                'get': gets,
-                'activate': activates
-            }
-
-            all_actions.append(actions)
-            all_struct_actions.append(struct_actions)
+            agent = self.agents[i]
+            loc = agent.location
+            signature = (i, agent.is_occupied > 0, agent.holding.ids if agent.holding else None,
+                         loc.name, loc.is_occupied > 0, loc.content.ids if loc.content else None)
+            cached = self._available_actions_cache.get(signature)
+            if cached is None:
+                cached = self._agent_available_actions(i)
+                self._available_actions_cache[signature] = cached
+                if len(self._available_actions_cache) > self.available_actions_cache_size:
+                    self._available_actions_cache.popitem(last=False)
+            else:
+                self._available_actions_cache.move_to_end(signature)
+            all_actions.append(cached[0])
+            all_struct_actions.append(cached[1])
 
         if return_struct:
             return all_struct_actions
         else:
             return all_actions
+
+    def _agent_available_actions(self, i):
+        noops = []
+        gotos = []
+        gets = []
+        puts = []
+        activates = []
+        actions = []
+        agent = self.agents[i]
+        loc = agent.location
+        loc_name = loc.name
+
+        # noop
+        # agent: not occupied
+        if not agent.is_occupied:
+            noops.append([i])
+            actions.append(f"noop")
+
+        # goto
+        # agent: not occupied; not at that location already
+        if not agent.is_occupied:
+            for name in self.name_mapping:
+                if not loc_name == name:
+                    gotos.append([i, name])
+                    actions.append(f"goto {name}")
+
+        # the remaining actions need the agent and the location it stands at to be free
+        if agent.is_occupied or loc.is_occupied:
+            loc = None
+
+        # get
+        # agent: not holding anything, not occupied, at the location
+        # location: not occupied, not empty
+        #   if location is storage, can get anything
+        #   if location is not storage, can get only if there is something
+
+        # FIXED:  since it's possbile to get right after the first agent put in, so there is
+        # no longer a requirement on the if the location is empty.
+        # you cannot get anything from serving table
+        if loc is not None and not agent.holding:
+            if loc_name.startswith("storage"):
+                for item in base_ingridients:
+                    gets.append([i,item, loc_name])
+                    actions.append(f"get {item} {loc_name}")
+            if loc.content and not loc_name.startswith("servingtable"):
+                gets.append([i, loc_name])
+                actions.append(f"get {loc_name}")
+
+        # put
+        # agent: not holding anything, not occupied, at the location
+        # location: not occupied
+        # we don't allow put action that will lead to waste, unless the tool is empty
+        if loc is not None and agent.holding:
+            waste = False
+            if loc.content and not loc_name.startswith("servingtable") and not loc_name.startswith("storage"):
+                ids = loc.content.ids
+                if not loc.content.contains(agent.holding):
+                    ids = ids + agent.holding.ids
+                waste = self.recipe.cooks_to_waste(loc, tuple(sorted(ids)))
+            if not waste:
+                puts.append([i, loc_name])
+                actions.append((f"put {loc_name}"))
+
+        # activate
+        # agent: not holding anything, not occupied, at the location
+        # location: not empty, not occupied, not storage or servingtable
+        # FIXED:  since it's possbile to activate right after the first agent put in, so there is
+        # no longer a requirement on the if the location is empty.
+        # activate action that will lead to waste is not allowed
+        if loc is not None and not agent.holding and loc.type not in [LocationType.SERVINGTABLE, LocationType.STORAGE]:
+            if not (loc.content and self.recipe.cooks_to_waste(loc, loc.content.key)):
+                activates.append([i,loc_name] )
+                actions.append(f"activate {loc_name}")
+
+        struct_actions = {
+            'noop': noops,
+            'goto': gotos,
+            'put': puts,
+            'get': gets,
+            'activate': activates
+        }
+        return actions, struct_actions
+
+    def close(self):
+        pass
+
     @property
     def unwrapped(self):
         """Returns the base non-wrapped environment.
@@ -758,7 +1087,18 @@ class World:
         """
         return self
 
-    def reset(self, task_name=None):
+    def reset(self, task_name=None, seed=None, episode_index=None, task_schedule=None):
+        # by default the episodes share one task stream. with `seed` and/or `episode_index` the rng is re-seeded
+        # (with `seed`, or with the seed derived from `seed`, or the world seed, and `episode_index`), which makes
+        # the episode reproducible on its own. `task_schedule` fixes the tasks drawn in the episode instead
+        if seed is not None or episode_index is not None:
+            if seed is None:
+                seed = self.seed
+            self.rng.seed(seed if episode_index is None else episode_seed(seed, episode_index))
+            self.task_manager._rng_state = None
+        if task_schedule is None and self.presample_tasks:
+            task_schedule = self.task_manager.sample_schedule(self.max_steps)
+
         self.load_level()
         self.time_step = 0
         self.action_history = []
@@ -768,11 +1108,12 @@ class World:
         self.failed_action_count = 0
 
         self._episode_info = TaskManagerReturnType()
-        self.task_manager.reset(task_name, tools_mapping=self.name_mapping)
+        self.task_manager.reset(task_name, tools_mapping=self.name_mapping, task_schedule=task_schedule)
         self.tool_cnt = defaultdict(int)
 
         self.success_count = 0
         self.failed_count = 0
+        self.feedback_counts = Counter()
 
         # self.setup_world()
         if hasattr(self, 'name_mapping'):
@@ -781,31 +1122,61 @@ class World:
 
         return self.all_state()
 
+    def snapshot(self) -> WorldSnapshot:
+        # the mutable state of the current episode, contents are stored as id tuples since `Item`s are mutated in place
+        agents = tuple(
+            (agent.location.name, agent.holding.ids if agent.holding else None, agent.is_occupied)
+            for agent in self.agents)
+        locations = tuple(
+            (loc.content.ids if loc.content else None, loc.is_occupied, loc.pickable)
+            for loc in self.name_mapping.values())
+        return WorldSnapshot(
+            agents,
+            locations,
+            self.task_manager.snapshot(),
+            self.time_step,
+            (self.noop_count, self.failed_action_count, self.success_count, self.failed_count),
+            self._episode_info,
+            (tuple(self.action_history), tuple(self.state_history), tuple(self.action_success_history),
+             tuple(self.previous_actions), tuple(self.feedback_events), tuple(self.suggestion_events),
+             tuple(self.feedback_counts.items())))
+
+    def restore(self, snap: WorldSnapshot):
+        # restore a snapshot taken on this world (on the same level), after any number of steps or resets
+        for agent, (location, holding, is_occupied) in zip(self.agents, snap.agents):
+            agent.location = self.name_mapping[location]
+            agent.holding = Item.from_ids(holding) if holding else None
+            agent.is_occupied = is_occupied
+        for loc, (content, is_occupied, pickable) in zip(self.name_mapping.values(), snap.locations):
+            loc.content = Item.from_ids(content) if content else None
+            loc.is_occupied = is_occupied
+            loc.pickable = pickable
+        self.task_manager.restore(snap.task_manager)
+        self.time_step = snap.time_step
+        self.noop_count, self.failed_action_count, self.success_count, self.failed_count = snap.counts
+        self._episode_info = snap.episode_info
+        (action_history, state_history, action_success_history, previous_actions,
+         feedback_events, suggestion_events, feedback_counts) = snap.histories
+        self.action_history = list(action_history)
+        self.state_history = list(state_history)
+        self.action_success_history = list(action_success_history)
+        self.previous_actions = list(previous_actions)
+        self.feedback_events = list(feedback_events)
+        self.suggestion_events = list(suggestion_events)
+        self.feedback_counts = Counter(dict(feedback_counts))
+
     def step(self, actions: List[str]):
         # clear feedback buffer
-        self.feedback = []
-        self.suggestions = []
+        self.feedback_events = []
+        self.suggestion_events = []
 
-        self.action_history.append(actions)
-        self.previous_actions = actions
+        if self.record_history:
+            self.action_history.append(actions)
        # parse the LLM generated dispatching command
         valid , predicates, args, ignored_actions = self.validate_n_parse(actions)
-        if predicates:
-            noop_count = 0
-            for predicate in predicates:
-                if predicate == 'noop':
-                    noop_count += 1
-            if noop_count == len(predicates):
-                self.feedback.append('None of the agents performed any actions which is not normal.')
-        action_successes = []
+        commands = []
         if valid:
-            # executate the command
-
             for predicate, arg, ignored_action in zip(predicates, args, ignored_actions):
-                if ignored_action:
-                    action_successes.append(False)
-                    continue
-
                 agent = arg[0]
                 if len(arg) == 2:
                     location = arg[1]
@@ -821,6 +1192,46 @@ class World:
 
                 if item:
                     item = Item(ItemName.from_str(item))
+                commands.append((predicate, agent, location, item, ignored_action))
+        return self._step(actions, valid, commands)
+
+    def step_ids(self, action_ids: List[tuple]):
+        # same as `step`, but with pre-resolved (verb, agent, location, item) tuples, see `ActionCodec`
+        self.feedback_events = []
+        self.suggestion_events = []
+
+        actions = [self.codec.decode(action_id) for action_id in action_ids]
+        if self.record_history:
+            self.action_history.append(actions)
+        valid = len(set(action_id[1] for action_id in action_ids)) == len(action_ids)
+        if not valid:
+            self.add_feedback(FeedbackCode.DUPLICATE_AGENTS)
+        commands = []
+        if valid:
+            locations = self._locations
+            for verb, agent, location, item in action_ids:
+                commands.append((all_actions[verb], agent, locations[location] if location >= 0 else None,
+                                 Item.from_ids((item,)) if item >= 0 else None, False))
+        return self._step(actions, valid, commands)
+
+    def _step(self, actions, valid, commands):
+        # the last plan is part of the state of the game, not of the histories: kept whatever `record_history`
+        self.previous_actions = list(actions)
+        if commands and self.record_feedback:
+            noop_count = 0
+            for command in commands:
+                if command[0] == 'noop':
+                    noop_count += 1
+            if noop_count == len(commands):
+                self.add_feedback(FeedbackCode.ALL_NOOP)
+        action_successes = []
+        if valid:
+            # executate the command
+
+            for predicate, agent, location, item, ignored_action in commands:
+                if ignored_action:
+                    action_successes.append(False)
+                    continue
 
                 if predicate == 'noop':
                     action_successes.append(ActionLib.noop(self.agents[agent], self))
@@ -840,7 +1251,8 @@ class World:
             if not sus:
                 self.failed_action_count += 1
 
-        self.action_success_history.append(action_successes)
+        if self.record_history:
+            self.action_success_history.append(action_successes)
         # check the refresh/occupying flag of agent and location
         for agent in self.agents:
             if agent.is_occupied > 0:
@@ -860,7 +1272,8 @@ class World:
         self.task_manager.tick()
 
         state = self.all_state()
-        self.state_history.append(state)
+        if self.record_history:
+            self.state_history.append(state)
 
         reward = -0.05
         # if there is a task just success add reward by 10 and remaining_time
@@ -876,82 +1289,58 @@ class World:
             self.failed_count += 1
 
 
-        if np.all(action_successes):
+        if all(action_successes):
             reward += 0.02
 
         reward += self.task_manager.compute_reward(self.name_mapping, self.agents)
         return state, success, {'action_success': action_successes, 'reward': reward}
 
     def all_state(self):
-        # TODO(jxma): legacy, the first task in the current task list
-        if self.task_manager.current_tasks():
-            task = self.task_manager.current_tasks()[0][0]
-        else:
-            task = ''
-
-        tmp = self.task_manager.current_tasks()
-
-        agents = []
-        for i in range(self.num_agents):
-            agent = {}
-            agent['name'] = self.agents[i].name
-            agent['location'] = self.agents[i].location.name
-            agent['occupied'] = self.agents[i].is_occupied
-            agent['id'] = i
-            if self.agents[i].holding:
-                agent['hold'] = self.agents[i].holding.name
-                if self.agents[i].holding.name == 'waste':
-                    self.suggestions.append("put the waste into the storage")
-            else:
-                agent['hold'] = None
-            if self.agents[i].is_occupied:
-                agent['occupy'] = True
-            else:
-                agent['occupy'] = False
-            agents.append(agent)
-
-        locations = []
-        for loc_name, loc in self.name_mapping.items():
-            location = {}
-            location['id'] = loc_name
-            if loc.content:
-                location['content'] = loc.content.name
-                if 'waste' in loc.content.name:
-                    self.suggestions.append("put the waste into the storage")
-            else:
-                location['content'] = None
-            if loc.is_occupied:
-                location['occupy'] = True
-            else:
-                location['occupy'] = False
-
-            locations.append(location)
-
-        return_object = StepReturnType(
-                        current_level=self.level,
-                        current_tasks_name=[i[0] for i in tmp],
-                        current_tasks_lifetime=[i[1] for i in tmp],
-                        current_step=self.time_step,
-                        max_steps=self.max_steps,
-                        game_over=self._episode_info.game_over,
-                        task_just_success=copy.deepcopy(self._episode_info.task_just_success),
-                        task_just_success_location=copy.deepcopy(self._episode_info.task_just_success_location),
-                        locations=locations,
-                        agents=agents,
-                        accomplished_tasks=self.task_manager.accomplished_tasks(),
-                        just_failed=self._episode_info.just_failed)
-        return return_object
+        # the agents and locations are captured as tuples of object ids, the dicts are only built if someone reads
+        # them (see `Observation`)
+        agent_states = tuple(
+            (agent.name, agent.location.name, agent.holding.ids if agent.holding else None, agent.is_occupied)
+            for agent in self.agents)
+        location_states = tuple(
+            (loc.content.ids if loc.content else None, loc.is_occupied) for loc in self._locations)
+        if self.record_feedback:
+            for agent in self.agents:
+                if agent.holding and agent.holding.ids == (WASTE_ID,):
+                    self.add_suggestion(FeedbackCode.PUT_WASTE_INTO_STORAGE)
+            for loc in self._locations:
+                if loc.content and WASTE_ID in loc.content.ids:
+                    self.add_suggestion(FeedbackCode.PUT_WASTE_INTO_STORAGE)
+
+        return Observation(
+            current_level=self.level,
+            current_tasks_name=list(self.task_manager._current_task_list),
+            current_tasks_lifetime=list(self.task_manager._current_task_lifetime_list),
+            current_step=self.time_step,
+            max_steps=self.max_steps,
+            game_over=self._episode_info.game_over,
+            task_just_success=list(self._episode_info.task_just_success),
+            task_just_success_location=list(self._episode_info.task_just_success_location),
+            accomplished_tasks=list(self.task_manager._accomplished_task_list),
+            just_failed=self._episode_info.just_failed,
+            agent_states=agent_states,
+            location_names=self._location_names,
+            location_states=location_states)
 
 
 class Agent:
+    __slots__ = ('holding', 'is_occupied', 'world', 'location', 'name', 'id')
 
     def __init__(self, ind: int, world:World) -> None:
 
+        self.world = world
+        self.id = ind
+        self.reset()
+
+    def reset(self):
         self.holding : Optional[Item] = None
         self.is_occupied: int = 0
-        self.world = world
         self.location = self.world.servingtable0
-        self.name = 'agent_' + str(ind)
+        self.name = 'agent_' + str(self.id)
 
 
 class ActionLib:
@@ -976,27 +1365,27 @@ class ActionLib:
         # agent must be at the location
         if agent.location.name != location.name or agent.location.type != location.type:
             # print('not at location, get failed')
-            world.feedback.append(f'{agent.name.replace("_", "")} is not located in {location.name}')
+            world.add_feedback(FeedbackCode.NOT_LOCATED, agent.id, location.name)
             return False
 
         # TODO(jxma): possible reason: location being serving table, location has
         # not been activated (except for storage and chopboard), etc
         if not location.pickable:
-            world.feedback.append(f'{agent.name.replace("_", "")} is not allowed to pick up from {location.name} at this point')
+            world.add_feedback(FeedbackCode.NOT_PICKABLE, agent.id, location.name)
             return False
 
         # agent must be unoccupied and hold nothing, location must be unoccupied
         if not agent.is_occupied and not agent.holding and not location.is_occupied:
             # if the tool is storage, just get anything as ong as it's base ingreidients that is allowed ()
             if location.type == LocationType.STORAGE:
-                if item and item.name in base_ingridients:
+                if item and len(item.ids) == 1 and item.ids[0] in BASE_IDS:
                     agent.holding = item
                     #TODO(jxma): reward shaping awaiting refactoring
-                    world.task_manager.reward_memory[agent.name] = []
-                    world.task_manager.reward_memory[location.name] = []
+                    world.task_manager.reward_memory[agent.name] = set()
+                    world.task_manager.reward_memory[location.name] = set()
                     return True
                 else:
-                    world.feedback.append(f'{agent.name.replace("_", "")} can only pickup base ingredients from the storage')
+                    world.add_feedback(FeedbackCode.STORAGE_BASE_ONLY, agent.id, location.name, item.ids if item else None)
                     return False
 
             # Now since we only allow picking up after activation, it is impossible to pick up more than 1 items from any location or pick up from an empty tool
@@ -1007,67 +1396,54 @@ class ActionLib:
                 agent.holding = Item(ItemName.waste)
                 location.content = None
                 #TODO(jxma): reward shaping awaiting refactoring
-                world.task_manager.reward_memory[agent.name] = []
-                world.task_manager.reward_memory[location.name] = []
+                world.task_manager.reward_memory[agent.name] = set()
+                world.task_manager.reward_memory[location.name] = set()
                 return True
             else:
                 if location.content:
                     agent.holding = location.content
                     location.content = None
                     #TODO(jxma): reward shaping awaiting refactoring
-                    world.task_manager.reward_memory[agent.name] = []
-                    world.task_manager.reward_memory[location.name] = []
+                    world.task_manager.reward_memory[agent.name] = set()
+                    world.task_manager.reward_memory[location.name] = set()
                     location.toggle_pickable()
                     if location.type != LocationType.STORAGE and location.type != LocationType.CHOPBOARD:
                         assert location.pickable == False
                     return True
                 else:
-                    world.feedback.append(f'{location} is empty, you cannot get anything from there')
+                    world.add_feedback(FeedbackCode.LOCATION_EMPTY, agent.id, location.name)
                     return False
         else:
             if agent.is_occupied:
-                world.feedback.append(f'{agent.name.replace("_", "")} is occupied therefore cannot take any actions other than noop')
+                world.add_feedback(FeedbackCode.AGENT_OCCUPIED, agent.id, location.name)
             if agent.holding:
-                world.feedback.append(f'{agent.name.replace("_", "")} is holding objects, therefore cannot get objects from the tool')
+                world.add_feedback(FeedbackCode.HOLDING_CANNOT_GET, agent.id, location.name, agent.holding.ids)
             if location.is_occupied:
-                world.feedback.append(f'{location.name} is occupied, therefore {agent.name.replace("_", "")} cannot get objects from the tool')
+                world.add_feedback(FeedbackCode.LOCATION_OCCUPIED_GET, agent.id, location.name)
             return False
 
     @staticmethod
     def put(agent: Agent, item: Item, location: Location, recipe: RECIPE, world: World) -> bool:
         # agent must be at the location
         if agent.location.name != location.name or agent.location.type != location.type:
-            world.feedback.append(f'{agent.name.replace("_", "")} is not located in {location.name}')
+            world.add_feedback(FeedbackCode.NOT_LOCATED, agent.id, location.name)
             return False
 
         # TODO(jxma): for serving table, you can only put dishes that need to be completed in this level
         if location.type == LocationType.SERVINGTABLE and agent.holding:
-            if agent.holding.name not in world.task_manager._all_tasks:
-                world.feedback.append(f'{agent.holding.name} is not any dish needed in this level and cannot be put on {location.name}')
+            if agent.holding.ids not in world.task_manager._all_task_ids:
+                world.add_feedback(FeedbackCode.DISH_NOT_NEEDED, agent.id, location.name, agent.holding.ids)
                 return False
 
         # TODO(jxma): for storage, you can put whatever into it whenever you want to
         # TODO(jxma): for other tools, raise error when putting irrelavent items to some tool, based off the recipe of this level
         if location.type != LocationType.SERVINGTABLE and location.type != LocationType.STORAGE and agent.holding is not None:
-            allow_combo = []
-            allow_item = []
-
-            for k, v in recipe.raw_recipe.items():
-                if v['location'] == location.type.value:
-                    allow_combo.append(v['ingredients'])
-
-            for combo in allow_combo:
-                if location.content:
-                    if all(i in combo for i in location.content.all_content()):
-                        tmp = Counter(combo) - Counter(location.content.all_content())
-                        allow_item.extend(list(tmp.keys()))
-                else:
-                    allow_item.extend(list(Counter(combo).keys()))
+            allow_item = recipe.allowed(location, location.content.key if location.content else ())
 
             # TODO(jxma): putting items that can be merged with existing content is OK
-            if not agent.holding.name in allow_item:
-                if not location.content or not agent.holding.name in location.content.all_content():
-                    world.feedback.append(f'putting {agent.holding.name} into {location.name} will result in waste')
+            if not (len(agent.holding.ids) == 1 and agent.holding.ids[0] in allow_item):
+                if not location.content or not location.content.contains(agent.holding):
+                    world.add_feedback(FeedbackCode.PUT_WASTE, agent.id, location.name, agent.holding.ids)
                     return False
 
         # agent must be unoccupied and hold something, location must be unoccupied and does not reach its capacity
@@ -1076,25 +1452,25 @@ class ActionLib:
                 and not location.is_occupied \
                     and (location.quantity < location.capacity or \
                         location.capacity == -1 or \
-                            (location.content and agent.holding.name in location.content.all_content())):
+                            (location.content and location.content.contains(agent.holding))):
             # if the tool is a storage, just clear the agent
             # TODO(jxma): we assume everything will be put into the location; therefore `item`` is not used
             if location.type != LocationType.STORAGE:
                 location.add(agent.holding)
             agent.holding = None
             #TODO(jxma): reward shaping awaiting refactoring
-            world.task_manager.reward_memory[agent.name] = []
-            world.task_manager.reward_memory[location.name] = []
+            world.task_manager.reward_memory[agent.name] = set()
+            world.task_manager.reward_memory[location.name] = set()
             return True
         else:
             if agent.is_occupied:
-                world.feedback.append(f'{agent.name.replace("_", "")} is occupied therefore cannot take any actions other than noop')
+                world.add_feedback(FeedbackCode.AGENT_OCCUPIED, agent.id, location.name)
             if not agent.holding:
-                world.feedback.append(f'{agent.name.replace("_", "")} is not holding objects, therefore cannot put objects into the tool')
+                world.add_feedback(FeedbackCode.NOT_HOLDING, agent.id, location.name)
             if location.is_occupied:
-                world.feedback.append(f'{location.name} is occupied, therefore cannot put objects into it')
+                world.add_feedback(FeedbackCode.LOCATION_OCCUPIED_PUT, agent.id, location.name)
             if location.quantity >= location.capacity and location.capacity != -1:
-                world.feedback.append(f'{location.name} reaches maximum capacity')
+                world.add_feedback(FeedbackCode.MAX_CAPACITY, agent.id, location.name)
             return False
 
     @staticmethod
@@ -1104,7 +1480,7 @@ class ActionLib:
 
         # agent must be at the location
         if agent.location.name != location.name:
-            world.feedback.append(f'{agent.name.replace("_", "")} is not located in {location.name}')
+            world.add_feedback(FeedbackCode.NOT_LOCATED, agent.id, location.name)
             return False
 
         # agent must be unoccupied and location must be unoccupied and has content inside (TODO: hold nothing)
@@ -1112,8 +1488,8 @@ class ActionLib:
 
             # reject activate action that will lead to waste
             tmp = location.content.cook(location, recipe=recipe)
-            if tmp.name.startswith('waste') :
-                world.feedback.append(f'activating {location.name} will result in waste')
+            if tmp.ids == (WASTE_ID,):
+                world.add_feedback(FeedbackCode.ACTIVATE_WASTE, agent.id, location.name)
                 return False
             location.content = tmp
             # set the location to be occupied and do the mixup magic
@@ -1122,7 +1498,7 @@ class ActionLib:
             if location.need_watch:
                 agent.is_occupied = location.refresh_time
             # TODO(jxma): reward shaping awaiting refactoring
-            world.task_manager.reward_memory[location.name] = []
+            world.task_manager.reward_memory[location.name] = set()
             # FIXME(jxma): this could be an issue as sometime you can activate a location twice without taking anything from it, ex.
             # put -> activate -> put -> activate (pasta, as in previous revision)
             location.toggle_pickable()
@@ -1130,11 +1506,11 @@ class ActionLib:
             return True
         else:
             if agent.is_occupied:
-                world.feedback.append(f'{agent.name.replace("_", "")} is occupied therefore cannot take any actions other than noop')
+                world.add_feedback(FeedbackCode.AGENT_OCCUPIED, agent.id, location.name)
             if agent.holding:
-                world.feedback.append(f'{agent.name.replace("_", "")} is holding objects, therefore cannot activate tools')
+                world.add_feedback(FeedbackCode.HOLDING_CANNOT_ACTIVATE, agent.id, location.name, agent.holding.ids)
             if location.is_occupied:
-                world.feedback.append(f'{location.name} is occupied, therefore cannot be activated')
+                world.add_feedback(FeedbackCode.LOCATION_OCCUPIED_ACTIVATE, agent.id, location.name)
             if not location.content:
-                world.feedback.append(f'{location.name} is empty, therefore cannot be activated')
+                world.add_feedback(FeedbackCode.EMPTY_CANNOT_ACTIVATE, agent.id, location.name)
             return False
@@ -0,0 +1,132 @@
+# structured (vector) observations of the NN policies, see `World(use_state_observation=True)`
+from typing import Optional, Sequence
+
+import numpy as np
+
+from levels.constants import Observation, object_ids, object_names
+
+# size of the state observations of `convert_to_state`, the encoding before `StateEncoder` (2 agents, fixed slots)
+LEGACY_STATE_SIZE = 64
+
+
+class StateEncoder:
+    """
+    Encodes the states of a level as flat float32 features, with slots sized by the level (its locations, agents
+    and maximum number of tasks):
+
+        for every task slot: one-hot dish, lifetime
+        current step, max steps
+        for every agent: one-hot location, multi-hot holding, occupied
+        for every location: multi-hot content, occupied
+
+    Objects are indexed by `object_ids` (waste included), the task slots follow the order of the current tasks
+    (by lifetime). `encode` reads an `Observation` of `World` and `encode_vec` the arrays of a `VecWorld`, into
+    `out` if given (ex. the rows of a vec env buffer).
+
+    The layout replaces the 64 features of `convert_to_state`: the policies trained on those cannot be used on
+    these observations (nor on the boolean action masks with one head per agent), see `check_space`.
+    """
+
+    def __init__(self, location_names: Sequence[str], num_agents: int, max_num_tasks: int) -> None:
+        self.location_names = tuple(location_names)
+        self.location_ids = {name: idx for idx, name in enumerate(self.location_names)}
+        self.num_agents = num_agents
+        self.max_num_tasks = max_num_tasks
+        self.num_objects = num_objects = len(object_names)
+        num_locations = len(self.location_names)
+
+        # offsets of the blocks, and sizes of the per task / agent / location slots
+        self.task_size = num_objects + 1
+        self.step_offset = max_num_tasks * self.task_size
+        self.agent_offset = self.step_offset + 2
+        self.agent_size = num_locations + num_objects + 1
+        self.location_offset = self.agent_offset + num_agents * self.agent_size
+        self.location_size = num_objects + 1
+        self.size = self.location_offset + num_locations * self.location_size
+
+        slots = np.arange(max_num_tasks)
+        self._lifetime_index = slots * self.task_size + num_objects
+        agents = np.arange(num_agents)
+        self._agent_start = self.agent_offset + agents * self.agent_size
+        self._occupied_index = self._agent_start + num_locations + num_objects
+        locations = np.arange(num_locations)
+        self._location_start = self.location_offset + locations * self.location_size
+        self._location_occupied_index = self._location_start + num_objects
+
+    @classmethod
+    def for_world(cls, world) -> 'StateEncoder':
+        # `world` is a `World` (after `load_level`) or a `VecWorld`
+        location_names = getattr(world, '_location_names', None) or world.location_names
+        max_num_tasks = getattr(world, 'max_num_tasks', None) or world.task_manager._max_num_tasks
+        return cls(location_names, world.num_agents, max_num_tasks)
+
+    def check_space(self, space) -> None:
+        # raises if `space` (ex. the observation space of a saved policy) does not have the layout of the encoder
+        shape = tuple(getattr(space, 'shape', None) or ())
+        if shape == (LEGACY_STATE_SIZE,):
+            raise ValueError(f'the observation space {space} has the layout of `convert_to_state` (64 features), '
+                             f'the state observations are now encoded by `StateEncoder` ({self.size} features on '
+                             f'this level): the policy has to be retrained')
+        if shape != (self.size,):
+            raise ValueError(f'the observation space {space} does not match the {self.size} features of the '
+                             f'`StateEncoder` of this level ({len(self.location_names)} locations, '
+                             f'{self.num_agents} agents, {self.max_num_tasks} tasks)')
+
+    def encode(self, state: Observation, out: Optional[np.ndarray] = None) -> np.ndarray:
+        if out is None:
+            out = np.zeros(self.size, dtype=np.float32)
+        else:
+            out.fill(0)
+        hot = []
+        for slot, (task, lifetime) in enumerate(zip(state.current_tasks_name[:self.max_num_tasks],
+                                                    state.current_tasks_lifetime)):
+            start = slot * self.task_size
+            hot.append(start + object_ids[task])
+            out[start + self.num_objects] = lifetime
+        out[self.step_offset] = state.current_step
+        out[self.step_offset + 1] = state.max_steps
+
+        location_ids = self.location_ids
+        num_locations = len(location_ids)
+        for start, (_, location, holding, occupied) in zip(self._agent_start.tolist(), state.agent_states):
+            hot.append(start + location_ids[location])
+            if holding:
+                hot.extend(start + num_locations + i for i in holding)
+            if occupied:
+                hot.append(start + num_locations + self.num_objects)
+        for start, (content, occupied) in zip(self._location_start.tolist(), state.location_states):
+            if content:
+                hot.extend(start + i for i in content)
+            if occupied:
+                hot.append(start + self.num_objects)
+        out[hot] = 1
+        return out
+
+    def encode_vec(self, vec_world, out: Optional[np.ndarray] = None) -> np.ndarray:
+        # the states of all the envs of `vec_world`, shape (num_envs, size)
+        n = vec_world.num_envs
+        if out is None:
+            out = np.zeros((n, self.size), dtype=np.float32)
+        else:
+            out.fill(0)
+        rows = np.arange(n)[:, None]
+
+        task_ids = vec_world.task_ids[:, :self.max_num_tasks]
+        has_task = task_ids >= 0
+        r, slot = np.nonzero(has_task)
+        out[r, slot * self.task_size + task_ids[r, slot]] = 1
+        out[:, self._lifetime_index] = vec_world.task_lifetimes[:, :self.max_num_tasks] * has_task
+        out[:, self.step_offset] = vec_world.time_step
+        out[:, self.step_offset + 1] = vec_world.max_steps
+
+        num_locations = len(self.location_names)
+        out[rows, self._agent_start + vec_world.agent_location] = 1
+        r, agent = np.nonzero(vec_world.holding >= 0)
+        out[r, self._agent_start[agent] + num_locations + vec_world.holding[r, agent]] = 1
+        out[:, self._occupied_index] = vec_world.agent_occupied > 0
+
+        length = vec_world.content_length
+        r, column, j = np.nonzero(np.arange(vec_world.content.shape[2]) < length[:, :, None])
+        out[r, self._location_start[column] + vec_world.content[r, column, j]] = 1
+        out[:, self._location_occupied_index] = vec_world.location_occupied > 0
+        return out
@@ -0,0 +1,682 @@
+# batched version of `World`: N episodes of the same level stepped with NumPy arrays
+import random
+from typing import List, Optional
+
+import numpy as np
+
+from levels.constants import (WASTE_ID, LocationType, Observation,
+                              all_actions, all_objecsts, base_ingridients,
+                              object_ids, object_names)
+from .game import World, episode_seed, reward_shaping_increments
+
+NOOP, GOTO, PUT, ACTIVATE, GET = [all_actions.index(verb) for verb in ["noop", "goto", "put", "activate", "get"]]
+NONE_ID = len(object_names)
+
+
+class VecWorld:
+    """
+    Steps `num_envs` episodes of the same level in lockstep. The mutable state of every episode (agent
+    locations/holdings, location contents, occupancy timers, pickable flags, task lists and lifetimes, reward
+    shaping memories) lives in preallocated arrays, and `step` applies the `ActionLib` semantics with vectorized
+    ops. Env `i` follows exactly the trajectory of `World(seed=seeds[i], **kwargs)` under the same actions, run in
+    the same order: the actions of a step run agent by agent, in index order or in the `order` given to `step` (the
+    order of the commands in the plan of `World.step`, see `plan_actions`).
+
+    Actions are integers per agent, see `action_string` / `action_id` for the mapping to the string commands:
+        0: noop, then goto / get / put / activate for every location of the level,
+        then get <object> from the storage for every object in `all_objecsts`.
+    Episodes do not reset by themselves, call `reset` once `dones` is set.
+    """
+
+    def __init__(self, num_envs: int, seeds: Optional[List[int]] = None, **world_kwargs) -> None:
+        self.num_envs = num_envs
+        if seeds is None:
+            seeds = list(range(num_envs))
+        assert len(seeds) == num_envs
+        self.seeds = list(seeds)
+        self.rngs = [random.Random(seed) for seed in self.seeds]
+
+        # the level definition is read from a template world, its rng is never used
+        world = World(**world_kwargs)
+        world.load_level()
+        self.level = world.level
+        self.num_agents = world.num_agents
+        self.max_steps = world.max_steps
+        self._build_level(world)
+        self._rows = np.arange(num_envs)
+        self._agent_order = np.tile(np.arange(self.num_agents), (num_envs, 1))
+
+        n, a, l = num_envs, self.num_agents, self.num_locations
+        self.agent_location = np.zeros((n, a), dtype=np.int64)
+        self.agent_occupied = np.zeros((n, a), dtype=np.int64)
+        self.holding = np.full((n, a), -1, dtype=np.int64)
+        self.location_occupied = np.zeros((n, l), dtype=np.int64)
+        self.pickable = np.zeros((n, l), dtype=bool)
+        # contents: object ids in insertion order, their count, a bitmask over the level objects and, for the
+        # serving tables, the count of every level object
+        self.content = np.full((n, l, 8), -1, dtype=np.int64)
+        self.content_length = np.zeros((n, l), dtype=np.int64)
+        self.content_mask = np.zeros((n, l), dtype=np.uint64)
+        self.serving_counts = np.zeros((n, len(self._serving_columns), self.num_level_objects), dtype=np.int64)
+
+        # current tasks (object ids, -1 for empty slots), sorted by (lifetime, name) like `TaskManager`
+        self.task_ids = np.full((n, self.max_num_tasks), -1, dtype=np.int64)
+        self.task_lifetimes = np.zeros((n, self.max_num_tasks), dtype=np.int64)
+        self.task_timer = 0
+
+        # reward shaping memories of `TaskManager`. A memory can only hold the current content/holding, as any
+        # other change of the content or holding either clears it or shrinks the content, so a flag is enough
+        self.base_picked = np.zeros((n, NONE_ID + 1), dtype=np.int64)
+        self.intermediate_cooked = np.zeros((n, NONE_ID + 1), dtype=np.int64)
+        self.hold_reward_given = np.zeros((n, NONE_ID + 1), dtype=np.int64)
+        self.loc_satisfied = np.zeros((n, len(self._satisfy_keys) + 1), dtype=np.int64)
+        self.agent_rewarded = np.zeros((n, a), dtype=bool)
+        self.location_rewarded = np.zeros((n, l), dtype=bool)
+
+        self.time_step = 0
+        self.success_count = np.zeros(n, dtype=np.int64)
+        self.failed_count = np.zeros(n, dtype=np.int64)
+        self.noop_count = np.zeros(n, dtype=np.int64)
+        self.failed_action_count = np.zeros(n, dtype=np.int64)
+        self.game_over = np.zeros(n, dtype=bool)
+        self.just_failed = np.zeros(n, dtype=bool)
+        self.accomplished_tasks = [[] for _ in range(n)]
+        self.task_just_success = [[] for _ in range(n)]
+        self.task_just_success_location = [[] for _ in range(n)]
+        self._just_success_rows = []
+
+    def _build_level(self, world: World):
+        locations = list(world.name_mapping.values())
+        self.location_names = [loc.name for loc in locations]
+        self.num_locations = len(locations)
+        location_types = list(LocationType)
+        self._location_type = np.array([location_types.index(loc.type) for loc in locations])
+        self._is_storage = np.array([loc.type == LocationType.STORAGE for loc in locations])
+        self._is_serving = np.array([loc.type == LocationType.SERVINGTABLE for loc in locations])
+        self._capacity = np.array([loc.capacity for loc in locations])
+        self._refresh_time = np.array([loc.refresh_time for loc in locations])
+        self._need_watch = np.array([loc.need_watch for loc in locations])
+        self._initial_pickable = np.array([loc.pickable for loc in locations])
+        # `Location.toggle_pickable`: serving tables are never pickable, storage and chopboards always are
+        self._always_pickable = np.array([loc.type in [LocationType.STORAGE, LocationType.CHOPBOARD] for loc in locations])
+        self._start_location = self.location_names.index('servingtable0')
+        self._storage_column = self.location_names.index('storage0')
+        self._serving_columns = [idx for idx, loc in enumerate(locations) if loc.type == LocationType.SERVINGTABLE]
+        self._serving_index = np.full(self.num_locations, -1)
+        self._serving_index[self._serving_columns] = np.arange(len(self._serving_columns))
+
+        task_manager = world.task_manager
+        self.all_tasks = list(task_manager._all_tasks)
+        self._task_object_ids = np.array([object_ids[task] for task in self.all_tasks])
+        self.max_num_tasks = task_manager._max_num_tasks
+        self.task_interval = task_manager._task_interval
+        for task, value in task_manager.task_def['task_list'].items():
+            if value['location'] != LocationType.SERVINGTABLE.value:
+                raise NotImplementedError(f'VecWorld only supports tasks served at the servingtable, got {task}')
+
+        # the objects that can end up inside a tool or on a serving table are the ones in the level recipes
+        level_objects = set(self.all_tasks)
+        for dish, value in world.recipe.raw_recipe.items():
+            level_objects.add(dish)
+            level_objects.update(value['ingredients'])
+        for value in task_manager.task_def['task_list'].values():
+            level_objects.update(value['ingredients'])
+        level_objects = sorted(object_ids[i] for i in level_objects)
+        if len(level_objects) > 64:
+            raise NotImplementedError(f'VecWorld supports at most 64 objects per level, got {len(level_objects)}')
+        self.num_level_objects = len(level_objects)
+        self._level_index = np.full(NONE_ID + 1, -1)
+        self._level_index[level_objects] = np.arange(len(level_objects))
+        self._bit = np.zeros(NONE_ID + 1, dtype=np.uint64)
+        self._bit[level_objects] = np.left_shift(np.uint64(1), np.arange(len(level_objects), dtype=np.uint64))
+
+        def to_mask(names):
+            mask = np.uint64(0)
+            for name in names:
+                mask |= self._bit[object_ids[name]]
+            return mask
+
+        # recipes per location type as (ingredient mask, product), which is exact as no recipe repeats an
+        # ingredient and tools never hold the same object twice
+        recipes = [[] for _ in location_types]
+        for (ingredients, location), dish in world.recipe.recipe.items():
+            names = [object_names[i] for i in ingredients]
+            recipes[location_types.index(LocationType(location))].append((to_mask(names), dish))
+        width = max(1, max(len(r) for r in recipes))
+        self._recipe_mask = np.zeros((len(location_types), width), dtype=np.uint64)
+        self._recipe_dish = np.full((len(location_types), width), WASTE_ID)
+        self._recipe_valid = np.zeros((len(location_types), width), dtype=bool)
+        for type_idx, type_recipes in enumerate(recipes):
+            for idx, (mask, dish) in enumerate(type_recipes):
+                self._recipe_mask[type_idx, idx] = mask
+                self._recipe_dish[type_idx, idx] = dish
+                self._recipe_valid[type_idx, idx] = True
+
+        self._is_base = np.zeros(NONE_ID + 1, dtype=bool)
+        self._is_base[[object_ids[i] for i in base_ingridients]] = True
+        self._is_task = np.zeros(NONE_ID + 1, dtype=bool)
+        self._is_task[[object_ids[i] for i in self.all_tasks]] = True
+        # tasks with the same lifetime are ordered by name, as `TaskManager` sorts (lifetime, name) tuples
+        self._name_rank = np.full(NONE_ID + 1, len(object_names))
+        self._name_rank[sorted(range(len(object_names)), key=lambda i: object_names[i])] = np.arange(len(object_names))
+        self._rank_name = np.argsort(self._name_rank)
+
+        # task requirements and lifetimes, indexed by object id
+        self._task_requirement = np.zeros((NONE_ID + 1, self.num_level_objects), dtype=np.int64)
+        self._task_ingredients = {}
+        self._task_lifetime = np.full(NONE_ID + 1, task_manager._task_lifetime)
+        for task, value in task_manager.task_def['task_list'].items():
+            self._task_ingredients[object_ids[task]] = [object_ids[i] for i in value['ingredients']]
+            for ingredient in value['ingredients']:
+                self._task_requirement[object_ids[task], self._level_index[object_ids[ingredient]]] += 1
+            if 'task_lifetime' in value:
+                self._task_lifetime[object_ids[task]] = value['task_lifetime']
+
+        # increments of the reward shaping memories when a task is added, see `update_reward_shaping_memories`
+        self._satisfy_keys = []
+        increments = {}
+        for task in self.all_tasks:
+            base, intermediate, hold, loc_satisfied = reward_shaping_increments(task)
+            satisfied = []
+            for loc_type, products in loc_satisfied:
+                key = (location_types.index(LocationType(loc_type)), to_mask([object_names[i] for i in products]))
+                if key not in self._satisfy_keys:
+                    self._satisfy_keys.append(key)
+                satisfied.append(self._satisfy_keys.index(key))
+            increments[object_ids[task]] = (list(base), list(intermediate), list(hold), satisfied)
+        self._base_increment = np.zeros((NONE_ID + 1, NONE_ID + 1), dtype=np.int64)
+        self._intermediate_increment = np.zeros((NONE_ID + 1, NONE_ID + 1), dtype=np.int64)
+        self._hold_increment = np.zeros((NONE_ID + 1, NONE_ID + 1), dtype=np.int64)
+        self._satisfy_increment = np.zeros((NONE_ID + 1, len(self._satisfy_keys) + 1), dtype=np.int64)
+        for task, (base, intermediate, hold, satisfied) in increments.items():
+            np.add.at(self._base_increment[task], base, 1)
+            np.add.at(self._intermediate_increment[task], intermediate, 1)
+            np.add.at(self._hold_increment[task], hold, 1)
+            np.add.at(self._satisfy_increment[task], satisfied, 1)
+        # keys are matched on (location type, content mask, content length), the length tells apart the serving
+        # tables holding the same dish twice
+        self._satisfy_type = np.array([key[0] for key in self._satisfy_keys] + [-1])
+        self._satisfy_mask = np.array([key[1] for key in self._satisfy_keys] + [0], dtype=np.uint64)
+        self._satisfy_length = np.array([bin(int(key[1])).count('1') for key in self._satisfy_keys] + [-1])
+
+        # per-agent action table
+        verbs, locations_, items = [NOOP], [0], [-1]
+        for verb in [GOTO, GET, PUT, ACTIVATE]:
+            for column in range(self.num_locations):
+                verbs.append(verb)
+                locations_.append(column)
+                items.append(-1)
+        for name in all_objecsts:
+            verbs.append(GET)
+            locations_.append(self._storage_column)
+            items.append(object_ids[name])
+        self._verb = np.array(verbs)
+        self._location = np.array(locations_)
+        self._item = np.array(items)
+        self._uses_location = np.isin(self._verb, [GET, PUT, ACTIVATE])
+        self.num_actions = len(verbs)
+        self._action_ids = {}
+        for agent in range(self.num_agents):
+            for idx in range(self.num_actions):
+                self._action_ids[self.action_string(agent, idx)] = (agent, idx)
+
+    def action_string(self, agent: int, action: int) -> str:
+        verb = all_actions[self._verb[action]]
+        if self._verb[action] == NOOP:
+            return f'noop_agent{agent}'
+        location = self.location_names[self._location[action]]
+        if self._item[action] >= 0:
+            return f'{verb}_agent{agent}_{object_names[self._item[action]]}_{location}'
+        return f'{verb}_agent{agent}_{location}'
+
+    def action_id(self, cmd_str: str):
+        # return (agent id, action id) of a string command
+        return self._action_ids[cmd_str]
+
+    def plan_actions(self, plans):
+        # (actions, order) for `step` of one plan of string commands per env, every agent once per plan
+        actions = np.zeros((self.num_envs, self.num_agents), dtype=np.int64)
+        order = np.zeros((self.num_envs, self.num_agents), dtype=np.int64)
+        for i, plan in enumerate(plans):
+            assert len(plan) == self.num_agents, "a plan needs one command per agent"
+            for k, cmd_str in enumerate(plan):
+                agent, action = self._plan_action(cmd_str)
+                actions[i, agent] = action
+                order[i, k] = agent
+            if len(set(order[i].tolist())) != self.num_agents:
+                raise ValueError(f'more than one command for an agent in {plan}')
+        return actions, order
+
+    def _plan_action(self, cmd_str: str):
+        # `World` puts whatever the agent holds and gets the whole content of the tools but the storage, the item of
+        # these commands does not matter
+        ids = self._action_ids.get(cmd_str)
+        if ids is None:
+            cmd = cmd_str.split('_')
+            if len(cmd) == 4 and (cmd[0] == 'put' or not cmd[3].startswith('storage')):
+                ids = self._action_ids.get('_'.join(cmd[:2] + cmd[3:]))
+        if ids is None:
+            raise ValueError(f'invalid action {cmd_str}')
+        return ids
+
+    def reset(self, task_name=None, episode_indices=None):
+        # with `episode_indices`, env `i` plays the episode of `World(seed=seeds[i]).reset(episode_index=...)`
+        if episode_indices is not None:
+            assert len(episode_indices) == self.num_envs
+            for rng, seed, episode_index in zip(self.rngs, self.seeds, episode_indices):
+                rng.seed(episode_seed(seed, episode_index))
+        self.agent_location[:] = self._start_location
+        self.agent_occupied[:] = 0
+        self.holding[:] = -1
+        self.location_occupied[:] = 0
+        self.pickable[:] = self._initial_pickable
+        self.content[:] = -1
+        self.content_length[:] = 0
+        self.content_mask[:] = 0
+        self.serving_counts[:] = 0
+
+        self.task_ids[:] = -1
+        self.task_lifetimes[:] = 0
+        self.task_timer = 0
+        self.base_picked[:] = 0
+        self.intermediate_cooked[:] = 0
+        self.hold_reward_given[:] = 0
+        self.loc_satisfied[:] = 0
+        self.agent_rewarded[:] = False
+        self.location_rewarded[:] = False
+        if task_name:
+            assert task_name in self.all_tasks
+            first_tasks = np.full(self.num_envs, object_ids[task_name])
+        else:
+            first_tasks = np.array([object_ids[rng.choice(self.all_tasks)] for rng in self.rngs])
+        self._add_tasks(self._rows, first_tasks)
+
+        self.time_step = 0
+        self.success_count[:] = 0
+        self.failed_count[:] = 0
+        self.noop_count[:] = 0
+        self.failed_action_count[:] = 0
+        self.game_over[:] = False
+        self.just_failed[:] = False
+        self.accomplished_tasks = [[] for _ in range(self.num_envs)]
+        self.task_just_success = [[] for _ in range(self.num_envs)]
+        self.task_just_success_location = [[] for _ in range(self.num_envs)]
+        self._just_success_rows = []
+
+    def _add_tasks(self, rows, tasks):
+        # tasks are appended to the first free slot, the list is sorted afterwards
+        slots = (self.task_ids[rows] >= 0).sum(1)
+        self.task_ids[rows, slots] = tasks
+        self.task_lifetimes[rows, slots] = self._task_lifetime[tasks]
+        self.base_picked[rows] += self._base_increment[tasks]
+        self.intermediate_cooked[rows] += self._intermediate_increment[tasks]
+        self.hold_reward_given[rows] += self._hold_increment[tasks]
+        self.loc_satisfied[rows] += self._satisfy_increment[tasks]
+
+    def _sort_tasks(self):
+        valid = self.task_ids >= 0
+        key = np.where(valid, (self.task_lifetimes + 1) * 256 + self._name_rank[self.task_ids], np.iinfo(np.int64).max)
+        key.sort(axis=1)
+        valid = key != np.iinfo(np.int64).max
+        self.task_ids = np.where(valid, self._rank_name[np.where(valid, key % 256, 0)], -1)
+        self.task_lifetimes = np.where(valid, key // 256 - 1, 0)
+
+    def _append_content(self, rows, columns, objects):
+        lengths = self.content_length[rows, columns]
+        if len(lengths) and lengths.max() >= self.content.shape[2]:
+            self.content = np.concatenate([self.content, np.full_like(self.content, -1)], axis=2)
+        self.content[rows, columns, lengths] = objects
+        self.content_length[rows, columns] = lengths + 1
+        self.content_mask[rows, columns] |= self._bit[objects]
+        serving = self._serving_index[columns]
+        is_serving = serving >= 0
+        if is_serving.any():
+            np.add.at(self.serving_counts,
+                      (rows[is_serving], serving[is_serving], self._level_index[objects[is_serving]]), 1)
+
+    def _toggle_pickable(self, flat):
+        # flat: indices (env * num_locations + column) of the locations
+        columns = flat % self.num_locations
+        pickable = self.pickable.reshape(-1)
+        pickable[flat] = np.where(self._is_serving.take(columns), False,
+                                  self._always_pickable.take(columns) | ~pickable.take(flat))
+
+    def _step_agent(self, agent, actions):
+        # agent: flat indices (env * num_agents + agent) of the acting agents, at most one per location of an env (see
+        # `step`), actions: their actions. Returns their successes. The arrays are read and written through flat
+        # indices, `take` on flat indices is several times faster than fancy indexing on (rows, columns) at these sizes
+        env = agent // self.num_agents
+        holding = self.holding.reshape(-1)
+        agent_location = self.agent_location.reshape(-1)
+        agent_rewarded = self.agent_rewarded.reshape(-1)
+        content_length = self.content_length.reshape(-1)
+        content_mask = self.content_mask.reshape(-1)
+        location_rewarded = self.location_rewarded.reshape(-1)
+
+        verb = self._verb.take(actions)
+        free = self.agent_occupied.reshape(-1).take(agent) <= 0
+
+        # noop
+        success = verb == NOOP
+        self.noop_count += np.bincount(env[success], minlength=self.num_envs)
+
+        # goto
+        ok = (verb == GOTO) & free
+        r = np.nonzero(ok)[0]
+        agent_location[agent.take(r)] = self._location.take(actions.take(r))
+        success |= ok
+
+        # get / put / activate: the agent must be at the location, and the location unoccupied. `r` are the positions
+        # in `agent`, `a` the agents and `f` the locations of these actions
+        r = np.nonzero(self._uses_location.take(actions) & free)[0]
+        a, act = agent.take(r), actions.take(r)
+        c = self._location.take(act)
+        ok = agent_location.take(a) == c
+        r, a, act, c = r[ok], a[ok], act[ok], c[ok]
+        f = env.take(r) * self.num_locations + c
+        ok = self.location_occupied.reshape(-1).take(f) <= 0
+        r, a, act, c, f = r[ok], a[ok], act[ok], c[ok], f[ok]
+        verb = self._verb.take(act)
+        held = holding.take(a)
+        has_item = held >= 0
+        length = content_length.take(f)
+
+        # get: base ingredients from the storage, the whole content from other tools
+        g = np.nonzero((verb == GET) & ~has_item & self.pickable.reshape(-1).take(f))[0]
+        if len(g):
+            rg, ag, cg, fg = r[g], a[g], c[g], f[g]
+            item = self._item.take(act.take(g))
+            is_storage = self._is_storage.take(cg)
+            from_storage = is_storage & self._is_base.take(item)
+            from_tool = ~is_storage & (length.take(g) > 0)
+            if (from_tool & (length.take(g) > 1)).any():
+                raise AssertionError('picking up more than one item from a tool')
+            content = self.content.reshape(-1)
+            first = fg * self.content.shape[2]
+            ok = from_storage | from_tool
+            holding[ag[ok]] = np.where(from_storage, item, content.take(first))[ok]
+            content[first[from_tool]] = -1
+            f_tool = fg[from_tool]
+            content_length[f_tool] = 0
+            content_mask[f_tool] = 0
+            self._toggle_pickable(f_tool)
+            agent_rewarded[ag[ok]] = False
+            location_rewarded[fg[ok]] = False
+            success[rg[ok]] = True
+
+        # put
+        p = np.nonzero((verb == PUT) & has_item)[0]
+        if len(p):
+            rp, ap, cp, fp = r[p], a[p], c[p], f[p]
+            held = held.take(p)
+            mask = content_mask.take(fp)
+            location_type = self._location_type.take(cp)
+            is_serving = self._is_serving.take(cp)
+            is_storage = self._is_storage.take(cp)
+            bit = self._bit.take(held)
+            in_content = (mask & bit) != 0
+            # only the dishes of this level can be served, tools only take items that keep the content a
+            # subset of some recipe (or items that are already inside)
+            combos = self._recipe_mask[location_type]
+            fits = (self._recipe_valid[location_type]
+                    & ((mask[:, None] & ~combos) == 0)
+                    & ((combos & bit[:, None]) != 0)).any(1)
+            allowed = np.where(is_serving, self._is_task.take(held), is_storage | fits | in_content)
+            capacity = self._capacity.take(cp)
+            room = (length.take(p) < capacity) | (capacity == -1) | in_content
+            ok = allowed & room
+            added = ok & ~is_storage & (is_serving | ~in_content)
+            if added.any():
+                self._append_content(env.take(rp[added]), cp[added], held[added])
+            holding[ap[ok]] = -1
+            agent_rewarded[ap[ok]] = False
+            location_rewarded[fp[ok]] = False
+            success[rp[ok]] = True
+
+        # activate: cook the content, activations that would result in waste are rejected
+        v = np.nonzero((verb == ACTIVATE) & ~has_item & (length > 0))[0]
+        if len(v):
+            rv, av, cv, fv = r[v], a[v], c[v], f[v]
+            location_type = self._location_type.take(cv)
+            match = self._recipe_valid[location_type] & (self._recipe_mask[location_type] ==
+                                                         content_mask.take(fv)[:, None])
+            dish = np.where(match.any(1), self._recipe_dish[location_type, match.argmax(1)], WASTE_ID)
+            ok = dish != WASTE_ID
+            rv, av, cv, fv, dish = rv[ok], av[ok], cv[ok], fv[ok], dish[ok]
+            self.content[env.take(rv), cv, :] = -1
+            self.content[env.take(rv), cv, 0] = dish
+            content_length[fv] = 1
+            content_mask[fv] = self._bit.take(dish)
+            refresh_time = self._refresh_time.take(cv)
+            self.location_occupied.reshape(-1)[fv] = refresh_time
+            watch = self._need_watch.take(cv)
+            self.agent_occupied.reshape(-1)[av[watch]] = refresh_time[watch]
+            location_rewarded[fv] = False
+            self._toggle_pickable(fv)
+            if not self.pickable.reshape(-1).take(fv).all():
+                raise AssertionError('activated location is not pickable')
+            success[rv] = True
+
+        return success
+
+    def _remove_content(self, row, column, objects):
+        # remove the first occurrence of every object, keeping the order of the rest
+        length = self.content_length[row, column]
+        content = list(self.content[row, column, :length])
+        for obj in objects:
+            content.remove(obj)
+        self.content[row, column, :] = -1
+        self.content[row, column, :len(content)] = content
+        self.content_length[row, column] = len(content)
+        mask = np.uint64(0)
+        for obj in content:
+            mask |= self._bit[obj]
+        self.content_mask[row, column] = mask
+        # the shrunk content has never been rewarded, see `TaskManager.compute_reward`
+        self.location_rewarded[row, column] = False
+        serving = self._serving_index[column]
+        for obj in objects:
+            self.serving_counts[row, serving, self._level_index[obj]] -= 1
+
+    def _check_task_success(self):
+        # `TaskManager.check_task_success` followed by the clean up in `World.done`. Returns the successes
+        # [num_envs, max_num_tasks] and the remaining times of the tasks, None if no task succeeded
+        valid = self.task_ids >= 0
+        failed = valid & (self.task_lifetimes == 0)
+        success = None
+        nonempty = self.content_length.take(self._serving_columns, axis=1) > 0
+        if nonempty.any():
+            success = np.zeros_like(valid)
+            success_column = np.zeros(self.task_ids.shape, dtype=np.int64)
+            counts = self.serving_counts.copy()
+            for slot in range(self.max_num_tasks):
+                candidate = valid[:, slot] & ~failed[:, slot]
+                if not candidate.any():
+                    continue
+                requirement = self._task_requirement[np.where(candidate, self.task_ids[:, slot], NONE_ID)]
+                for idx, column in enumerate(self._serving_columns):
+                    ok = candidate & ~success[:, slot] & nonempty[:, idx] & (counts[:, idx] >= requirement).all(1)
+                    counts[ok, idx] -= requirement[ok]
+                    success[ok, slot] = True
+                    success_column[ok, slot] = column
+
+        self.just_failed = failed.any(1)
+        self.failed_count += self.just_failed
+        for row in self._just_success_rows:
+            self.task_just_success[row] = []
+            self.task_just_success_location[row] = []
+        self._just_success_rows = []
+        if success is not None and not success.any():
+            success = None
+        remaining_time = None
+        if success is not None:
+            num_success = success.sum(1)
+            self.success_count += num_success
+            self._just_success_rows = np.nonzero(num_success)[0]
+            for row, slot in zip(*np.nonzero(success)):
+                task = self.task_ids[row, slot]
+                column = success_column[row, slot]
+                name = object_names[task]
+                self.task_just_success[row].append(name)
+                self.task_just_success_location[row].append(self.location_names[column])
+                self.accomplished_tasks[row].append(name)
+                self._remove_content(row, column, self._task_ingredients[task])
+            remaining_time = np.where(success, self.task_lifetimes, 0)
+            failed |= success
+        if failed.any():
+            self.task_ids = np.where(failed, -1, self.task_ids)
+            self._sort_tasks()
+        return success, remaining_time
+
+    def _tick(self):
+        self.task_timer += 1
+        valid = self.task_ids >= 0
+        self.task_lifetimes -= valid & (self.task_lifetimes != -1)
+        if self.task_timer == self.task_interval:
+            rows = np.nonzero(valid.sum(1) < self.max_num_tasks)[0]
+            if len(rows):
+                # `_randbelow` is what `choice` calls, without its overhead
+                tasks = self._task_object_ids[[self.rngs[row]._randbelow(len(self.all_tasks)) for row in rows]]
+                self._add_tasks(rows, tasks)
+                self._sort_tasks()
+            self.task_timer = 0
+        # decreasing all the finite lifetimes by one keeps the tasks sorted
+
+    @staticmethod
+    def _grant(counter, rows, keys):
+        # decrement `counter[rows, keys]` in order while it stays positive, return which of the pairs got it
+        granted = np.zeros(len(rows), dtype=bool)
+        pending = np.nonzero(counter[rows, keys] > 0)[0]
+        while len(pending):
+            # the first pending pair of every counter, the others wait for the next round
+            _, first = np.unique(rows[pending] * counter.shape[1] + keys[pending], return_index=True)
+            first = pending[first]
+            ok = first[counter[rows[first], keys[first]] > 0]
+            granted[ok] = True
+            counter[rows[ok], keys[ok]] -= 1
+            pending = np.setdiff1d(pending, first)
+        return granted
+
+    def _shaping_reward(self):
+        # `TaskManager.compute_reward`, the additions happen in the same order to get the same floats. The counters
+        # [num_envs, num_objects] are read through flat indices, see `_step_agent`
+        num_objects = self.base_picked.shape[1]
+        offset = self._rows * num_objects
+        reward = np.zeros(self.num_envs)
+        active = (self.task_ids >= 0).any(1)
+        base_picked = self.base_picked.reshape(-1)
+        held = np.where(self.holding >= 0, self.holding, NONE_ID) + offset[:, None]
+        for agent in range(self.num_agents):
+            ok = active & (base_picked.take(held[:, agent]) > 0) & ~self.agent_rewarded[:, agent]
+            if ok.any():
+                self.agent_rewarded[ok, agent] = True
+                reward += np.where(ok, 0.1, 0.0)
+                base_picked[held[ok, agent]] -= 1
+
+        # a location is only rewarded once per content, so only the locations whose content changed are checked
+        loc_rows, columns = np.nonzero(active[:, None] & ~self.location_rewarded & (self.content_length > 0))
+        if len(loc_rows):
+            mask = self.content_mask[loc_rows, columns]
+            match = ((self._satisfy_type[None, :] == self._location_type[columns][:, None])
+                     & (self._satisfy_mask[None, :] == mask[:, None])
+                     & (self._satisfy_length[None, :] == self.content_length[loc_rows, columns][:, None]))
+            keys = np.where(match.any(1), match.argmax(1), len(self._satisfy_keys))
+            ok = self._grant(self.loc_satisfied, loc_rows, keys)
+            np.add.at(reward, loc_rows[ok], 0.5)
+            self.location_rewarded[loc_rows[ok], columns[ok]] = True
+
+            loc_rows, columns = loc_rows[~ok], columns[~ok]
+            contents = np.where(self.content_length[loc_rows, columns] == 1, self.content[loc_rows, columns, 0], NONE_ID)
+            ok = self._grant(self.intermediate_cooked, loc_rows, contents)
+            np.add.at(reward, loc_rows[ok], 1.0)
+            self.location_rewarded[loc_rows[ok], columns[ok]] = True
+
+        hold_reward_given = self.hold_reward_given.reshape(-1)
+        for agent in range(self.num_agents):
+            ok = active & (hold_reward_given.take(held[:, agent]) > 0) & self.agent_rewarded[:, agent]
+            if ok.any():
+                reward += np.where(ok, 0.5, 0.0)
+                hold_reward_given[held[ok, agent]] -= 1
+        return reward
+
+    def step(self, actions, order=None):
+        """
+        actions: int array [num_envs, num_agents]
+        order: int array [num_envs, num_agents], the agents of every env in the order their actions run (default:
+            index order), see `plan_actions`
+        return: rewards [num_envs], task just success [num_envs], dones [num_envs],
+            info with the action successes [num_envs, num_agents]
+        """
+        actions = np.asarray(actions)
+        assert actions.shape == (self.num_envs, self.num_agents)
+        action_success = np.zeros((self.num_envs, self.num_agents), dtype=bool)
+        rows = self._rows
+        if order is None:
+            order = self._agent_order
+        else:
+            order = np.asarray(order)
+            assert order.shape == actions.shape
+        # the agents of an env only act on each other through the locations they share: all the agents of the envs
+        # where no two agents get / put / activate at the same location act at once, the others one after the other
+        agents = rows[:, None] * self.num_agents + order
+        batches = [agents.reshape(-1)]
+        if self.num_agents > 1:
+            target = np.where(self._uses_location.take(actions), self._location.take(actions),
+                              -1 - np.arange(self.num_agents))
+            target.sort(axis=1)
+            conflict = (target[:, 1:] == target[:, :-1]).any(1)
+            if conflict.any():
+                batches = [np.concatenate([agents[~conflict].reshape(-1), agents[conflict, 0]])] + \
+                    [agents[conflict, k] for k in range(1, self.num_agents)]
+        flat_actions = actions.reshape(-1)
+        flat_success = action_success.reshape(-1)
+        for agent in batches:
+            flat_success[agent] = self._step_agent(agent, flat_actions.take(agent))
+        all_success = action_success.all(1)
+        self.failed_action_count += self.num_agents - action_success.sum(1)
+
+        self.agent_occupied -= self.agent_occupied > 0
+        self.location_occupied -= self.location_occupied > 0
+
+        self.game_over[:] = self.time_step == self.max_steps
+        success, remaining_time = self._check_task_success()
+        self.time_step += 1
+        self._tick()
+
+        reward = np.full(self.num_envs, -0.05)
+        if success is not None:
+            for slot in range(self.max_num_tasks):
+                reward += np.where(success[:, slot], 50 + remaining_time[:, slot], 0.0)
+        reward += all_success * 0.02
+        reward += self._shaping_reward()
+
+        dones = np.full(self.num_envs, self.time_step == self.max_steps)
+        task_success = np.zeros(self.num_envs, dtype=bool) if success is None else success.any(1)
+        return reward, task_success, dones, {'action_success': action_success}
+
+    def get_state(self, env_idx: int) -> Observation:
+        # the observation of one episode, in the format of `World.all_state`
+        tasks = [task for task in self.task_ids[env_idx] if task >= 0]
+        agent_states = tuple(
+            ('agent_' + str(i), self.location_names[self.agent_location[env_idx, i]],
+             (int(self.holding[env_idx, i]),) if self.holding[env_idx, i] >= 0 else None,
+             int(self.agent_occupied[env_idx, i]))
+            for i in range(self.num_agents))
+        location_states = tuple(
+            (tuple(int(i) for i in self.content[env_idx, column, :self.content_length[env_idx, column]]) or None,
+             int(self.location_occupied[env_idx, column]))
+            for column in range(self.num_locations))
+        return Observation(
+            current_level=self.level,
+            current_tasks_name=[object_names[i] for i in tasks],
+            current_tasks_lifetime=[int(i) for i in self.task_lifetimes[env_idx, :len(tasks)]],
+            current_step=self.time_step,
+            max_steps=self.max_steps,
+            game_over=bool(self.game_over[env_idx]),
+            task_just_success=list(self.task_just_success[env_idx]),
+            task_just_success_location=list(self.task_just_success_location[env_idx]),
+            accomplished_tasks=list(self.accomplished_tasks[env_idx]),
+            just_failed=bool(self.just_failed[env_idx]),
+            agent_states=agent_states,
+            location_names=tuple(self.location_names),
+            location_states=location_states)
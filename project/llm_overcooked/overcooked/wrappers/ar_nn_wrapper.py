@@ -11,19 +11,46 @@ class ARNNWrapper(gym.Wrapper):
         self,
         sim,
     ):
-        sim = Monitor(_ARMasksWrapper(
+        masks_wrapper = _ARMasksWrapper(
                 _NNActionSpaceWrapper(
                     env=sim,
                 ),
-            ))
+            )
+        sim = Monitor(masks_wrapper)
         super().__init__(env=sim)
+        self.masks_wrapper = masks_wrapper
+        self.action_wrapper = masks_wrapper.env
 
-    def get_mask(self):
-        return self.env.get_mask()
+    def get_mask(self, out=None):
+        return self.masks_wrapper.get_mask(out=out)
+
+    def mask_row(self):
+        return self.masks_wrapper.mask_row()
     
     def action(self, action):
-        return self.env.env.action(action)
+        return self.action_wrapper.action(action)
 
     def reverse_action(self, action):
-        return self.env.env.reverse_action(action)
+        return self.action_wrapper.reverse_action(action)
+
+    def check_spaces(self, observation_space, action_space=None):
+        # raises a ValueError if a saved policy (its spaces) does not fit the observations and actions of the env,
+        # ex. the policies trained on the 64 features of `convert_to_state`, before `StateEncoder`
+        world = self.env.unwrapped
+        if world.use_state_observation:
+            world.state_encoder.check_space(observation_space)
+        elif getattr(observation_space, 'shape', None) != self.observation_space.shape:
+            raise ValueError(f'the observation space {observation_space} does not match the text encodings '
+                             f'{self.observation_space} of the env')
+        if action_space is not None and action_space != self.action_space:
+            raise ValueError(f'the action space {action_space} does not match the {self.action_space} of the env '
+                             f'({world.num_agents} agents)')
+
+    def defer_encoding(self):
+        # used by the vec envs, the text observations become (goal, state) prompts that they encode in one batch
+        # (`NNActionSpaceWrapper.encode_observations`), returns False for state observations
+        if self.env.unwrapped.use_state_observation:
+            return False
+        self.env.env.env.encode_prompts = False
+        return True
 
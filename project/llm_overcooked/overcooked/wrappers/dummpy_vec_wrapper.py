@@ -9,6 +9,8 @@ import numpy as np
 from stable_baselines3.common.vec_env.base_vec_env import VecEnv, VecEnvIndices, VecEnvObs, VecEnvStepReturn
 from stable_baselines3.common.vec_env.util import copy_obs_dict, dict_to_obs, obs_space_info
 
+from .nn_action_space_wrapper import NNActionSpaceWrapper
+
 
 class DummyVecEnv(VecEnv):
     """
@@ -36,6 +38,8 @@ class DummyVecEnv(VecEnv):
                 "Please read https://github.com/DLR-RM/stable-baselines3/issues/1151 for more information."
             )
         env = self.envs[0]
+        # text observations: the prompts of all the envs are encoded in one batch
+        self.encode_prompts = hasattr(env, 'defer_encoding') and all([env_i.defer_encoding() for env_i in self.envs])
         VecEnv.__init__(self, len(env_fns), env.observation_space, env.action_space)
         obs_space = env.observation_space
         self.keys, shapes, dtypes = obs_space_info(obs_space)
@@ -47,6 +51,8 @@ class DummyVecEnv(VecEnv):
         self.buf_infos = [{} for _ in range(self.num_envs)]
         self.actions = None
         self.metadata = env.metadata
+        self.buf_masks = None
+        self.buf_rows = None
 
     def reverse_action(self, actions: List[str] ):
         ras = []
@@ -56,20 +62,39 @@ class DummyVecEnv(VecEnv):
             ras.append(ra)
         
         return np.array(ras)
-        
+
+    def get_mask(self) -> np.ndarray:
+        # the masks of all the envs [num_envs, num_heads, num_actions], in a buffer allocated on the first call. The
+        # (cached) rows of all the envs are stacked at once and copied to every head
+        if self.buf_masks is None:
+            mask = self.envs[0].get_mask()
+            self.buf_masks = np.zeros((self.num_envs, *mask.shape), dtype=mask.dtype)
+            if hasattr(self.envs[0], 'mask_row'):
+                self.buf_rows = np.zeros((self.num_envs, mask.shape[1]), dtype=mask.dtype)
+        if self.buf_rows is None:
+            for env_idx in range(self.num_envs):
+                self.envs[env_idx].get_mask(out=self.buf_masks[env_idx])
+        else:
+            np.stack([env.mask_row() for env in self.envs], out=self.buf_rows)
+            self.buf_masks[:] = self.buf_rows[:, None]
+        return np.copy(self.buf_masks)
+
     def step_async(self, actions: np.ndarray) -> None:
         self.actions = actions
 
     def step_wait(self) -> VecEnvStepReturn:
+        observations = []
         for env_idx in range(self.num_envs):
-            obs, self.buf_rews[env_idx], self.buf_dones[env_idx], self.buf_dones[env_idx],self.buf_infos[env_idx] = self.envs[env_idx].step(
+            obs, self.buf_rews[env_idx], done, truncated, self.buf_infos[env_idx] = self.envs[env_idx].step(
                 self.actions[env_idx]
             )
+            self.buf_dones[env_idx] = done or truncated
             if self.buf_dones[env_idx]:
                 # save final observation where user can get it, then reset
                 self.buf_infos[env_idx]["terminal_observation"] = obs
-                obs = self.envs[env_idx].reset()
-            self._save_obs(env_idx, obs)
+                obs, _ = self.envs[env_idx].reset()
+            observations.append(obs)
+        self._save_all_obs(observations, self.buf_infos)
         return (self._obs_from_buf(), np.copy(self.buf_rews), np.copy(self.buf_dones), deepcopy(self.buf_infos))
 
     def seed(self, seed: Optional[int] = None) -> List[Union[None, int]]:
@@ -82,9 +107,7 @@ class DummyVecEnv(VecEnv):
         
 
     def reset(self) -> VecEnvObs:
-        for env_idx in range(self.num_envs):
-            obs = self.envs[env_idx].reset()
-            self._save_obs(env_idx, obs)
+        self._save_all_obs([env.reset()[0] for env in self.envs])
         return self._obs_from_buf()
 
     def close(self) -> None:
@@ -111,8 +134,13 @@ class DummyVecEnv(VecEnv):
         else:
             return super().render(mode=mode)
 
+    def _save_all_obs(self, observations: List[VecEnvObs], infos: Sequence[dict] = ()) -> None:
+        if self.encode_prompts:
+            observations = NNActionSpaceWrapper.encode_observations(observations, infos)
+        for env_idx, obs in enumerate(observations):
+            self._save_obs(env_idx, obs)
+
     def _save_obs(self, env_idx: int, obs: VecEnvObs) -> None:
-        obs = obs[0]
         for key in self.keys:
             if key is None:
                 self.buf_obs[key][env_idx] = obs
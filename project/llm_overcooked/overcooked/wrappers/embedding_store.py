@@ -0,0 +1,125 @@
+import fcntl
+import hashlib
+import os
+from typing import Dict, List, Optional, Sequence
+
+import numpy as np
+
+_MAGIC = b'EMB1'
+_HEADER = np.dtype([('magic', 'S4'), ('dim', '<u4'), ('max_rows', '<u8')])
+
+
+def prompt_key(prompt: str, model_name: str = '') -> bytes:
+    # content hash of a prompt, the model name is part of the key so that stores of different models never mix
+    return hashlib.blake2b(f'{model_name}\0{prompt}'.encode(), digest_size=16).digest()
+
+
+class EmbeddingStore:
+    """
+    On-disk store of float32 embeddings, shared by all the processes (vec env workers, later runs) that open the same
+    file. The file is a header followed by fixed size (key, embedding) records:
+
+    * reads go through a memory map of the file, the index (key -> row) of a process is extended with the records
+      appended by the others when a key is missing
+    * writes append records under an exclusive ``flock``, keys already in the file are skipped
+    * once the file holds more than `max_rows` records, the newest `max_rows // 2` are copied to a new file which
+      atomically replaces it (readers keep their map of the old file until they notice the new one)
+
+    :param path: file of the store, created on the first write
+    :param max_rows: number of records above which the store is compacted, saved in the file when it is created (the
+        value of an existing store is kept)
+    """
+
+    def __init__(self, path: str, max_rows: int = 2000000):
+        self.path = path
+        self.max_rows = max_rows
+        self.dtype = None
+        self.records = None
+        self.num_rows = 0
+        self.index: Dict[bytes, int] = {}
+        self._inode = None
+        self._refresh()
+
+    def __len__(self):
+        return self.num_rows
+
+    def _open(self, dim):
+        self.dtype = np.dtype([('key', 'V16'), ('embedding', '<f4', (dim,))])
+
+    def _header(self):
+        return np.array([(_MAGIC, self.dtype['embedding'].shape[0], self.max_rows)], dtype=_HEADER).tobytes()
+
+    def _refresh(self):
+        # maps the records written since the last refresh, or the whole file if it was replaced by a compaction
+        try:
+            stat = os.stat(self.path)
+        except FileNotFoundError:
+            return
+        if stat.st_ino != self._inode:
+            self.dtype = None
+            self.records = None
+            self.num_rows = 0
+            self.index = {}
+            self._inode = stat.st_ino
+        if stat.st_size < _HEADER.itemsize:
+            return
+        if self.dtype is None:
+            header = np.fromfile(self.path, dtype=_HEADER, count=1)[0]
+            assert header['magic'] == _MAGIC, f"{self.path} is not an embedding store"
+            self._open(int(header['dim']))
+            self.max_rows = int(header['max_rows'])
+        # an incomplete trailing record (being appended) is ignored
+        num_rows = (stat.st_size - _HEADER.itemsize) // self.dtype.itemsize
+        start = self.num_rows
+        if num_rows > start:
+            self.records = np.memmap(self.path, dtype=self.dtype, mode='r', offset=_HEADER.itemsize, shape=(num_rows,))
+            keys = self.records['key'][start:].tobytes()
+            for row in range(num_rows - start):
+                self.index[keys[16 * row:16 * (row + 1)]] = start + row
+            self.num_rows = num_rows
+
+    def get_many(self, keys: Sequence[bytes]) -> List[Optional[np.ndarray]]:
+        """
+        Embeddings of `keys`, None for the keys missing from the store.
+        """
+        if any(key not in self.index for key in keys):
+            self._refresh()
+        rows = [self.index.get(key) for key in keys]
+        return [None if row is None else np.array(self.records[row]['embedding']) for row in rows]
+
+    def put_many(self, keys: Sequence[bytes], embeddings: np.ndarray):
+        embeddings = np.asarray(embeddings, dtype=np.float32)
+        while True:
+            with open(self.path, 'ab') as f:
+                fcntl.flock(f, fcntl.LOCK_EX)
+                # the file may have been replaced by a compaction while we waited for the lock
+                if os.fstat(f.fileno()).st_ino != os.stat(self.path).st_ino:
+                    continue
+                self._refresh()
+                if self.dtype is None:
+                    self._open(embeddings.shape[1])
+                    f.write(self._header())
+                    self._inode = os.fstat(f.fileno()).st_ino
+                assert self.dtype['embedding'].shape == embeddings.shape[1:], "wrong embedding size for the store"
+                new = {key: embedding for key, embedding in zip(keys, embeddings) if key not in self.index}
+                if not new:
+                    return
+                records = np.empty(len(new), dtype=self.dtype)
+                records['key'] = list(new)
+                records['embedding'] = list(new.values())
+                f.write(records.tobytes())
+                f.flush()
+                self._refresh()
+                if self.num_rows > self.max_rows:
+                    self._compact()
+                return
+
+    def _compact(self):
+        # called with the lock held, keeps the newest records
+        keep = np.array(self.records[-(self.max_rows // 2):])
+        tmp_path = f'{self.path}.{os.getpid()}.tmp'
+        with open(tmp_path, 'wb') as f:
+            f.write(self._header())
+            f.write(keep.tobytes())
+        os.replace(tmp_path, self.path)
+        self._refresh()
@@ -31,6 +31,25 @@ class ARMasksWrapper(gym.ObservationWrapper):
         self.num_objects = len(self.all_objecsts)
         self.num_tools = len(self.all_location_types) 
         self.num_actions = len(self.all_actions)
+
+        # flat index of every (verb, location) and storage item in the action space of an agent, see
+        # `NNActionSpaceWrapper.action`
+        self.agent_offset = 1 + self.num_tools * 3 * 4 + self.num_objects
+        self.num_agents = env.num_agents
+        # attribute lookups through the gym wrappers are slow, the world is called directly
+        self.world = env.unwrapped
+        self.location_index = {
+            verb: {f'{tool}{tool_id}': 1 + (all_actions.index(verb) - 1) * self.num_tools * 3 + tool_idx * 3 + tool_id
+                   for tool_idx, tool in enumerate(self.all_location_types) for tool_id in range(3)}
+            for verb in ['goto', 'put', 'activate', 'get']
+        }
+        self.storage_item_index = {item: 1 + 4 * self.num_tools * 3 + idx for idx, item in enumerate(self.all_objecsts)}
+        # mask of the legal actions of an agent, keyed on the identity of the `available_actions` of the agent (which
+        # the world caches), the values keep these alive so that their ids cannot be reused. The rows of all the
+        # agents are cached the same way, on the identities of the actions of all the agents
+        self.agent_masks = {}
+        self.row_masks = {}
+        self.agent_masks_size = 65536
     
         obs_space = env.observation_space
         # total observations = # agents * (# actions + num_tools * (goto + get + put + activate) + #objects)
@@ -118,96 +137,56 @@ class ARMasksWrapper(gym.ObservationWrapper):
         #     }
         # )
 
-    def get_mask(self):
-        available_actions = self.env.available_actions(return_struct=True)
-         #  struct_actions = {
-        #         'noop': noops,
-        #         'goto': gotos,
-        #         'put': puts,
-        #         'get': gets,
-        #         'activate': activates
-        #     }
-        
-      
-        
-        self.agent_offset = 1 + self.num_tools * 3 * 4 + self.num_objects
-        masks = np.zeros(self.agent_offset * 2)
-        for agent_id,action in enumerate(available_actions):
-
-            # goto: self.num_tools * 3, # tools: noop, storage, blender, chopboard, pan, servingtable, fryer, mixer, pot, steamer,
-            # put: self.num_tools * 3, # tools: noop, storage, blender, chopboard, pan, servingtable, fryer, mixer, pot, steamer,
-            # activate: self.num_tools * 3, # tools: noop, storage, blender, chopboard, pan, servingtable, fryer, mixer, pot, steamer,
-            # get: self.num_tools * 3  + self.num_objects, # tools: noop, storage, blender, chopboard, pan, servingtable, fryer, mixer, pot, steamer,
-            # under this contraints get_storage will never be valid, it should be get_storage_something, we use something here to represent the location
-            
-            # noop_mask = np.array([1])
-            # goto_masks = np.zeros(self.num_tools * 3)
-            
-            # put_masks = np.zeros(self.num_tools * 3)
-            # activate_masks = np.zeros(self.num_tools * 3)
-            # get_masks = np.zeros(self.num_tools * 3 + self.num_objects)
-
-            # object_masks = np.zeros(self.num_objects)
-
-            
-            
-
-            #action primitives: noop, goto, get, put, activate
-            #noop
-            masks[agent_id * self.agent_offset] = 1
-
-            # goto
-            for loc in action['goto']:
-                verb = self.all_actions.index('goto')
-                start_idx = 1 + (verb-1) * self.num_tools * 3 + self.agent_offset * agent_id
-                loc_id = int(loc[-1][-1])
-                loc_name = loc[-1][:-1]
-                # self.all_location_types.index(cmd_str[-1][:-1]) * 3 + tool_id + start_idx
-                loc_idx = self.all_location_types.index(loc_name)*3 + loc_id +  start_idx
-                masks[loc_idx] = 1
-
-            # get
-           
-            for loc in action['get']:
-                verb = self.all_actions.index('get')
-                start_idx = 1 + (verb-1) * self.num_tools * 3 + self.agent_offset * agent_id
-                loc_id = int(loc[-1][-1])
-                loc_name = loc[-1][:-1]
-                
-                # if get from storage, need to specify items
-                if loc_name == 'storage':
-                    item = loc[1]
-                    # masks[self.all_objecsts.index(item)] = 1 
-                    start_idx = 1 + 4 * self.num_tools * 3 + self.agent_offset * agent_id
-                    item = loc[-2]
-                    loc_idx = self.all_objecsts.index(item) + start_idx
-                    masks[loc_idx] = 1
-                else:
-                    loc_idx = self.all_location_types.index(loc_name)*3 + loc_id +  start_idx
-                    masks[loc_idx] = 1
-            
-            #put 
-            for loc in action['put']:
-                verb = self.all_actions.index('put')
-                start_idx = 1 + (verb-1) * self.num_tools * 3 + self.agent_offset * agent_id
-                loc_id = int(loc[-1][-1])
-                loc_name = loc[-1][:-1]
-                
-                loc_idx = self.all_location_types.index(loc_name)*3 + loc_id +  start_idx
-                masks[loc_idx] = 1
-
-            #activate
-            for loc in action['activate']:
-                verb = self.all_actions.index('activate')
-                start_idx = 1 + (verb-1) * self.num_tools * 3 + self.agent_offset * agent_id
-                loc_id = int(loc[-1][-1])
-                loc_name = loc[-1][:-1]
-                
-                loc_idx = self.all_location_types.index(loc_name)*3 + loc_id +  start_idx
-                masks[loc_idx] = 1
+    def get_mask(self, out: Optional[np.ndarray] = None) -> np.ndarray:
+        """
+        Boolean masks of the legal actions, one row (the legal actions of all the agents) per action head, written
+        into `out` if given (ex. the rows of this env in the mask buffer of a vec env). The masks used to be float64
+        with 2 heads whatever the number of agents, the values are the same for 2 agents.
+        """
+        if out is None:
+            out = np.empty((self.num_agents, self.agent_offset * self.num_agents), dtype=bool)
+        # every head gets the same row
+        out[:] = self.mask_row()
+        return out
+
+    def mask_row(self) -> np.ndarray:
+        """
+        The row of `get_mask`, shared with the cache: it must not be modified. Vec envs stack the rows of all their
+        envs at once.
+        """
+        actions = self.world.available_actions(return_struct=True)
+        key = tuple(map(id, actions))
+        cached = self.row_masks.get(key)
+        if cached is None:
+            if len(self.row_masks) >= self.agent_masks_size:
+                self.row_masks.clear()
+            cached = (actions, np.concatenate([self._cached_agent_mask(action) for action in actions]))
+            self.row_masks[key] = cached
+        return cached[1]
+
+    def _cached_agent_mask(self, action):
+        cached = self.agent_masks.get(id(action))
+        if cached is None:
+            if len(self.agent_masks) >= self.agent_masks_size:
+                self.agent_masks.clear()
+            cached = (action, self._agent_mask(action))
+            self.agent_masks[id(action)] = cached
+        return cached[1]
+
+    def _agent_mask(self, action):
+        # noop is always allowed
+        indices = [0]
+        for verb in ['goto', 'put', 'activate']:
+            indices.extend(self.location_index[verb][loc[-1]] for loc in action[verb])
+        for loc in action['get']:
+            # the items of the storage have their own indices (get_agent0_storage0 is never legal)
+            if len(loc) == 3 and loc[-1].startswith('storage'):
+                indices.append(self.storage_item_index[loc[-2]])
+            else:
+                indices.append(self.location_index['get'][loc[-1]])
+        mask = np.zeros(self.agent_offset, dtype=bool)
+        mask[indices] = True
+        return mask
 
-        masks = np.array([masks, masks])
-        return masks
-    
     def observation(self, observation: dict[str, Any]):
         return observation
\ No newline at end of file
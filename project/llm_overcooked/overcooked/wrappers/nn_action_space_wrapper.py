@@ -1,4 +1,6 @@
 import math
+import os
+from functools import lru_cache
 from typing import Union, Sequence
 
 import gymnasium as gym
@@ -7,18 +9,54 @@ import numpy as np
 
 from levels.constants import all_actions, all_objecsts, all_location_types
 from overcooked.game import World
-from levels.utils import convert_to_prompt, convert_to_state, get_goal_prompt, get_state_prompt
-from sentence_transformers import SentenceTransformer
-from functools import lru_cache
+from levels.utils import convert_to_prompt, get_goal_prompt, get_state_prompt
+from .embedding_store import EmbeddingStore, prompt_key
+
+
+@lru_cache(maxsize=None)
+def action_tables(num_agents):
+    """
+    The command of every NN action (ids of `NNActionSpaceWrapper.action_space`) as a NumPy array, and the inverse
+    dict. The actions of an agent are noop, then goto/put/activate/get for the 3 locations of every location type,
+    then get from storage0 for every object.
+    """
+    commands = []
+    for agent_id in range(num_agents):
+        agent = f'agent{agent_id}'
+        commands.append(f'noop_{agent}')
+        for verb in ['goto', 'put', 'activate', 'get']:
+            commands.extend(f'{verb}_{agent}_{tool}{tool_id}' for tool in all_location_types for tool_id in range(3))
+        commands.extend(f'get_{agent}_{item}_storage0' for item in all_objecsts)
+    numbers = {command: number for number, command in enumerate(commands)}
+    return np.array(commands, dtype=object), numbers
+
+
+@lru_cache(maxsize=None)
+def action_id_table(num_agents, codec):
+    # the `World.step_ids` tuple of every NN action on the level of `codec`, None for the locations not on the level
+    ids = np.empty(len(action_tables(num_agents)[0]), dtype=object)
+    for number, command in enumerate(action_tables(num_agents)[0]):
+        try:
+            ids[number] = codec.encode(command)
+        except ValueError:
+            ids[number] = None
+    return ids
+
+
 class NNActionSpaceWrapper(gym.Wrapper):
     """
     Action wrapper to transform native action space to a new space friendly to train NNs
     """
-    model = SentenceTransformer('all-MiniLM-L6-v2')
-    # model = SentenceTransformer('sentence-transformers/all-distilroberta-v1')
-    model.eval()
+    model_name = 'all-MiniLM-L6-v2'
+    # model_name = 'sentence-transformers/all-distilroberta-v1'
+    # loaded by `get_model` when the first prompt is encoded, importing the wrapper does not import torch
+    model = None
 
+    # prompt -> encoding, shared by all the envs of the process
     prompt_cache = {}
+    prompt_cache_size = 2560000
+    # encodings on disk, shared with the other processes and runs, see `use_embedding_store`
+    embedding_store = None
 
     def __init__(
         self,
@@ -54,6 +92,10 @@ class NNActionSpaceWrapper(gym.Wrapper):
             noop_vec.extend([self.agent_offset * agent_id])
 
         self.action_space = spaces.MultiDiscrete( res)
+        self.commands, self.action_numbers = action_tables(self.num_agents)
+        self.action_ids = action_id_table(self.num_agents, env.unwrapped.codec)
+        # if False, the text observations are the (goal, state) prompts, encoded by the vec env (see `encode_many`)
+        self.encode_prompts = True
 
         obs_space = env.observation_space
         # obs_space["prompt"] = spaces.Box(low = -np.inf, high=np.inf, shape=(384,))
@@ -61,201 +103,126 @@ class NNActionSpaceWrapper(gym.Wrapper):
 
     def action(self, action: Sequence[int]):
         """
-        NN action to game action
+        NN action to game action, a batch of actions (shape (N, num_agents)) gives a list of N lists of commands
         """
-        # print('hello', action)
-        assert self.action_space.contains(action)
-
-        # ------ parse main actions ------
-        # parse agent verb tool and item
-
-        offset = 1
-        str_actions = []
-
-        for idx in range(self.num_agents):
-            start_idx = idx * offset
-
-            # agent_id = action[start_idx]
-            action_number = action[start_idx]
-            agent_id =  int(action_number // self.agent_offset)
-            action_number = action_number % self.agent_offset
-            def parse_action_number(action_number):
-                tool_type = None
-                tool_id = None
-                item = None
-
-                if action_number == 0:
-                    verb = all_actions[all_actions.index("noop")]
-
-                elif action_number < self.num_tools * 3 * 1 + 1:
-                    verb = all_actions[all_actions.index("goto")]
-                    start_idx = (action_number-1)
-                    tool_type = all_location_types[start_idx//3]
-                    tool_id = start_idx % 3
-
-                elif action_number < self.num_tools * 3 * 2 + 1:
-                    verb = all_actions[all_actions.index("put")]
-                    start_idx = (action_number-1 - self.num_tools * 3 * 1)
-                    tool_type = all_location_types[start_idx//3]
-                    tool_id = start_idx % 3
-
-                elif action_number < self.num_tools * 3 * 3 + 1:
-                    verb = all_actions[all_actions.index("activate")]
-                    start_idx = (action_number-1 - self.num_tools * 3 * 2)
-                    tool_type = all_location_types[start_idx//3]
-                    tool_id = start_idx % 3
-
-                elif action_number < self.num_tools * 3 * 4 + 1:
-                    verb = all_actions[all_actions.index("get")]
-                    start_idx = (action_number-1 - self.num_tools * 3 * 3)
-                    tool_type = all_location_types[start_idx//3]
-                    tool_id = start_idx % 3
-
-                else:
-                    verb = all_actions[all_actions.index("get")]
-                    start_idx = (action_number-1 - self.num_tools * 3 * 4)
-                    tool_type = 'storage'
-                    tool_id = 0
-                    item = self.all_objecsts[start_idx]
-
-                return verb, tool_type, tool_id, item
-
-
-            verb, tool_type, tool_id, item = parse_action_number(action_number=action_number)
-
-            if tool_type:
-                tool = tool_type + str(tool_id)
-
-            if verb == 'noop':
-                str_action = f'noop_agent{agent_id}'
-                
-            elif verb == 'goto':
-                str_action = f'goto_agent{agent_id}_{tool}'
-
-            elif verb == 'get':
-                if item:
-                    str_action = f'get_agent{agent_id}_{item}_{tool}'
-                else:
-                    str_action = f'get_agent{agent_id}_{tool}'
-
-            elif verb == 'put':
-                if item:
-                    str_action = f'put_agent{agent_id}_{item}_{tool}'
-                else:
-                    str_action = f'put_agent{agent_id}_{tool}'
-
-            elif verb == 'activate':
-                str_action = f'activate_agent{agent_id}_{tool}'
-
-            str_actions.append(str_action)
-        
-        return str_actions
+        action = self._check_action(action)
+        return self.commands[action].tolist()
+
+    def _check_action(self, action):
+        # same as `action_space.contains`, also for batches, without its overhead
+        action = np.asarray(action)
+        assert action.shape[-1:] == self.action_space.shape and action.dtype.kind in 'iu'
+        assert 0 <= action.min() and action.max() < len(self.commands), f'invalid action {action}'
+        return action
 
     def reverse_action(self, actions):
         """
         game action to NN action
         """
-        nn_actions = []
-        for idx, action in enumerate(actions):
-            cmd_str = action
-            
-            cmd_str = cmd_str.split('_')
-            
-            predicate = cmd_str[0]
-
-            agent = cmd_str[1]
-            
-            agent = int(agent.replace('agent', ''))
-            verb = all_actions.index(predicate)
-            tool = 0
-            item = 0
-            
-            start_idx = 1 + (verb-1) * self.num_tools * 3 + self.agent_offset * agent
-
-            if len(cmd_str) == 2:
-                # noop
-                tool = self.agent_offset * agent
-                
-            elif len(cmd_str) == 3:
-                #goto_agent0_somelocation
-                #get_agent0_somelocation
-                #put_agnet0_somelocation
-                #activate_agnet0_somelocation
-
-                tool_id = int(cmd_str[-1][-1])
-                
-                tool = self.all_location_types.index(cmd_str[-1][:-1]) * 3  + tool_id + start_idx
-                
-            elif len(cmd_str) == 4:
-            
-                #get_agent0_something_somelocation
-                #put_agnet0_something_somelocation
-                tool_id = int(cmd_str[-1][-1])
-                if cmd_str[-1][:-1] == 'storage':
-                    start_idx = 1 + 4 * self.num_tools * 3 + self.agent_offset * agent
-                    tool = self.all_objecsts.index(cmd_str[-2]) + start_idx
-                else:
-                    tool = self.all_location_types.index(cmd_str[-1][:-1]) * 3 + tool_id + start_idx
-                item = self.all_objecsts.index(cmd_str[2])
-            
-            nn_action = [tool]
-            nn_actions.append(nn_action)
-
-        # while len(nn_actions) < self.num_agents:
-        #     cur_agnet = len(nn_actions)
-        #     nn_actions.append([cur_agnet, 0, 0, 0])
-        from itertools import chain
-        nn_actions = list(chain(*nn_actions))
-        return nn_actions
-       
+        numbers = self.action_numbers
+        return [numbers[action] if action in numbers else numbers[self._canonical_command(action)]
+                for action in actions]
+
+    @staticmethod
+    def _canonical_command(action):
+        # the commands with an item that have no NN action of their own: the items of the storage are got from
+        # storage0, and an item put into (or got from) another location is the action on the location
+        cmd_str = action.split('_')
+        if len(cmd_str) == 4:
+            if cmd_str[-1].startswith('storage'):
+                return f'get_{cmd_str[1]}_{cmd_str[2]}_storage0'
+            del cmd_str[2]
+        return '_'.join(cmd_str)
 
     def reset(self, **kwargs):
         
         self.rewards = []
-        if kwargs['options']:
+        if kwargs.get('options'):
             task_name = kwargs['options']['task_name']
             obs = self.env.reset(task_name = task_name)
         else:
             obs = self.env.reset()
-        if self.env.use_state_observation:
-            obs = convert_to_state(obs)
-        else:
-            goal_prompt = get_goal_prompt(obs)
-            state_prompt = get_state_prompt(obs)
-            goal_encoding = self.encode(goal_prompt)
-            state_encoding = self.encode(state_prompt)
-
-            obs = np.hstack((goal_encoding, state_encoding))
-        
         
-        return obs, {}
-    
-    @lru_cache(maxsize=2560000)
+        return self.observation(obs), {}
+
+    @classmethod
+    def get_model(cls):
+        if cls.model is None:
+            from sentence_transformers import SentenceTransformer
+            cls.model = SentenceTransformer(cls.model_name)
+            cls.model.eval()
+        return cls.model
+
+    @classmethod
+    def use_embedding_store(cls, path: str, max_rows: int = 2000000):
+        # the path goes through the environment so that the vec env workers started afterwards use the store too
+        os.environ['OVERCOOKED_EMBEDDING_STORE'] = path
+        cls.embedding_store = EmbeddingStore(path, max_rows=max_rows)
+
+    @classmethod
+    def get_embedding_store(cls):
+        if cls.embedding_store is None and os.environ.get('OVERCOOKED_EMBEDDING_STORE'):
+            cls.embedding_store = EmbeddingStore(os.environ['OVERCOOKED_EMBEDDING_STORE'])
+        return cls.embedding_store
+
+    @classmethod
+    def encode_many(cls, prompts: Sequence[str], batch_size: int = 256) -> np.ndarray:
+        """
+        Encodings of `prompts`, shape (len(prompts), dim). The prompts missing from the cache (and from the embedding
+        store) are encoded together in one call of the model.
+        """
+        cache = cls.prompt_cache
+        missing = list(dict.fromkeys(prompt for prompt in prompts if prompt not in cache))
+        if missing:
+            if len(cache) + len(missing) > cls.prompt_cache_size:
+                cache.clear()
+            store = cls.get_embedding_store()
+            if store is not None:
+                stored = store.get_many([prompt_key(prompt, cls.model_name) for prompt in missing])
+                cache.update((prompt, encoding) for prompt, encoding in zip(missing, stored) if encoding is not None)
+                missing = [prompt for prompt in missing if prompt not in cache]
+        if missing:
+            encodings = cls.get_model().encode(missing, batch_size=batch_size)
+            cache.update(zip(missing, encodings))
+            if store is not None:
+                store.put_many([prompt_key(prompt, cls.model_name) for prompt in missing], encodings)
+        return np.stack([cache[prompt] for prompt in prompts])
+
+    @classmethod
+    def encode_observations(cls, observations, infos=()) -> np.ndarray:
+        """
+        Encodings of the (goal, state) prompts observed with `encode_prompts=False`, shape (len(observations), 2 * dim).
+        The terminal observations of `infos` are encoded in the same call and replaced by their encodings.
+        """
+        infos = [info for info in infos if 'terminal_observation' in info]
+        pairs = list(observations) + [info['terminal_observation'] for info in infos]
+        encodings = cls.encode_many([prompt for pair in pairs for prompt in pair]).reshape(len(pairs), -1)
+        for info, encoding in zip(infos, encodings[len(observations):]):
+            info['terminal_observation'] = encoding
+        return encodings[:len(observations)]
+
     def encode(self, input_prompt):
-        return NNActionSpaceWrapper.model.encode(input_prompt)
+        return self.encode_many([input_prompt])[0]
 
-    def step(self, action: Sequence[int]):
-        overcooked_action = self.action(action)
-        obs, done, info = self.env.step(overcooked_action)
-        reward = info['reward']
-        # obs = convert_to_prompt(obs)
+    def observation(self, obs):
         if self.env.use_state_observation:
-            obs = convert_to_state(obs)
+            return self.env.unwrapped.state_encoder.encode(obs)
+        prompts = (get_goal_prompt(obs), get_state_prompt(obs))
+        if not self.encode_prompts:
+            return prompts
+        # goal encoding followed by the state encoding
+        return self.encode_many(prompts).reshape(-1)
+
+    def step(self, action: Sequence[int]):
+        action = self._check_action(action)
+        action_ids = self.action_ids[action].tolist()
+        if None in action_ids:
+            # a location that is not on the level, `World.step` reports it
+            obs, done, info = self.env.step(self.commands[action].tolist())
         else:
-            # prompt = convert_to_prompt(obs)
-            goal_prompt = get_goal_prompt(obs)
-            state_prompt = get_state_prompt(obs)
-
-            goal_encoding = self.encode(goal_prompt)
-            state_encoding = self.encode(state_prompt)
-            # if prompt in NNActionSpaceWrapper.prompt_cache:
-            #     obs = NNActionSpaceWrapper.prompt_cache[prompt]
-            # else:
-            #     obs = NNActionSpaceWrapper.model.encode(prompt)
-            #     NNActionSpaceWrapper.prompt_cache[prompt] = obs
-            #     if len(NNActionSpaceWrapper.prompt_cache) % 1000 == 0:
-            #         print('cache size: ', len(NNActionSpaceWrapper.prompt_cache))
-            obs = np.hstack((goal_encoding, state_encoding))
+            obs, done, info = self.env.step_ids(action_ids)
+        reward = info['reward']
+        obs = self.observation(obs)
 
         self.rewards.append(reward)
 
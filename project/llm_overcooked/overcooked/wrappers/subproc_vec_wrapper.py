@@ -0,0 +1,318 @@
+import multiprocessing as mp
+from multiprocessing import resource_tracker, shared_memory
+from typing import Any, Callable, List, Optional, Sequence, Type, Union
+
+import gymnasium as gym
+import gymnasium.spaces as spaces
+import numpy as np
+
+from stable_baselines3.common.vec_env.base_vec_env import (CloudpickleWrapper, VecEnv, VecEnvIndices, VecEnvObs,
+                                                           VecEnvStepReturn)
+
+from .nn_action_space_wrapper import NNActionSpaceWrapper
+
+
+class _SharedBuffers:
+    """
+    NumPy views on the shared memory blocks holding the actions, observations, rewards, dones and masks of all the
+    envs. The blocks are created by the main process, the workers attach to them by name.
+    """
+
+    def __init__(self, layout, names=None):
+        # layout: {key: (shape, dtype)}
+        self.layout = layout
+        self.blocks = {}
+        self.arrays = {}
+        for key, (shape, dtype) in layout.items():
+            size = max(1, int(np.prod(shape)) * np.dtype(dtype).itemsize)
+            if names is None:
+                block = shared_memory.SharedMemory(create=True, size=size)
+            else:
+                # the main process owns (and unlinks) the blocks
+                block = shared_memory.SharedMemory(name=names[key])
+            self.blocks[key] = block
+            self.arrays[key] = np.ndarray(shape, dtype=dtype, buffer=block.buf)
+
+    @property
+    def names(self):
+        return {key: block.name for key, block in self.blocks.items()}
+
+    def __getattr__(self, key):
+        try:
+            return self.__dict__['arrays'][key]
+        except KeyError:
+            raise AttributeError(key)
+
+    def close(self, unlink=False):
+        self.arrays = {}
+        for block in self.blocks.values():
+            block.close()
+            if unlink:
+                block.unlink()
+        self.blocks = {}
+
+
+def _worker(remote, parent_remote, env_fns_wrapper, start):
+    # steps the envs `start, start + 1, ...` of the vec env, all the arrays go through the shared buffers and only
+    # the infos and the commands go through the pipe
+    parent_remote.close()
+    envs = [env_fn() for env_fn in env_fns_wrapper.var]
+    rows = range(start, start + len(envs))
+    buffers = None
+    # text observations: the prompts of all the envs of the worker are encoded in one batch
+    encode_prompts = hasattr(envs[0], 'defer_encoding') and all([env.defer_encoding() for env in envs])
+
+    def write(observations, infos=()):
+        if encode_prompts:
+            # the terminal prompts of `infos` are encoded in the same batch
+            observations = NNActionSpaceWrapper.encode_observations(observations, infos)
+        buffers.obs[rows.start:rows.stop] = observations
+        # the terminal observations are rows of the observation buffer, as if they had been written there
+        for info in infos:
+            if 'terminal_observation' in info:
+                info['terminal_observation'] = np.asarray(info['terminal_observation'], dtype=buffers.obs.dtype
+                                                          ).reshape(buffers.obs.shape[1:])
+        if 'masks' in buffers.arrays:
+            write_masks()
+
+    def write_masks():
+        # the (cached) rows of the masks of all the envs are stacked at once, see `DummyVecEnv.get_mask`
+        if hasattr(envs[0], 'mask_row'):
+            buffers.masks[rows.start:rows.stop] = np.stack([env.mask_row() for env in envs])[:, None]
+        else:
+            for row, env in zip(rows, envs):
+                env.get_mask(out=buffers.masks[row])
+
+    try:
+        while True:
+            cmd, data = remote.recv()
+            if cmd == 'close':
+                for env in envs:
+                    env.close()
+                remote.close()
+                break
+            try:
+                result = None
+                if cmd == 'step':
+                    result = []
+                    observations = []
+                    for row, env in zip(rows, envs):
+                        obs, reward, done, truncated, info = env.step(buffers.actions[row])
+                        if done or truncated:
+                            # save final observation where user can get it, then reset
+                            info['terminal_observation'] = obs
+                            obs, _ = env.reset()
+                        buffers.rewards[row] = reward
+                        buffers.dones[row] = done or truncated
+                        observations.append(obs)
+                        result.append(info)
+                    write(observations, result)
+                elif cmd == 'reset':
+                    write([env.reset(**data)[0] for env in envs])
+                elif cmd == 'get_mask':
+                    write_masks()
+                elif cmd == 'reverse_action':
+                    result = [env.reverse_action(actions) for env, actions in zip(envs, data)]
+                elif cmd == 'get_spaces':
+                    env = envs[0]
+                    mask = np.asarray(env.get_mask()) if hasattr(env, 'get_mask') else None
+                    result = (env.observation_space, env.action_space, env.metadata,
+                              None if mask is None else (mask.shape, mask.dtype))
+                elif cmd == 'attach':
+                    buffers = _SharedBuffers(*data)
+                elif cmd == 'seed':
+                    result = [env.seed(seed) for env, seed in zip(envs, data)]
+                elif cmd == 'env_method':
+                    indices, method_name, method_args, method_kwargs = data
+                    result = [getattr(envs[i], method_name)(*method_args, **method_kwargs) for i in indices]
+                elif cmd == 'get_attr':
+                    indices, attr_name = data
+                    result = [getattr(envs[i], attr_name) for i in indices]
+                elif cmd == 'set_attr':
+                    indices, attr_name, value = data
+                    for i in indices:
+                        setattr(envs[i], attr_name, value)
+                    result = [None for _ in indices]
+                elif cmd == 'is_wrapped':
+                    indices, wrapper_class = data
+                    from stable_baselines3.common import env_util
+                    result = [env_util.is_wrapped(envs[i], wrapper_class) for i in indices]
+                else:
+                    raise NotImplementedError(f"`{cmd}` is not implemented in the worker")
+            except Exception as e:
+                # raised again in the main process, see `SharedMemoryVecEnv._recv`
+                result = _WorkerError(e)
+            remote.send(result)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        if buffers is not None:
+            buffers.close()
+
+
+class _WorkerError:
+    def __init__(self, error):
+        self.error = error
+
+
+class SharedMemoryVecEnv(VecEnv):
+    """
+    Multiprocess vectorized wrapper for `World` envs wrapped by `ARNNWrapper` (or any env with its interface). Every
+    worker process steps a contiguous group of envs, the actions, observations, rewards, dones and action masks are
+    exchanged through shared memory NumPy buffers, so only the commands and the infos are pickled.
+
+    The masks (of `get_mask`) are computed by the workers together with the observations, `get_mask` returns them
+    for all the envs without another round trip. `reverse_action` is batched over the envs of every worker, and so
+    are the encodings of the text observations (see `ARNNWrapper.defer_encoding`).
+
+    :param env_fns: a list of functions that return environments to vectorize
+    :param num_workers: number of worker processes, the envs are split evenly among them (default: one per env)
+    :param start_method: method used to start the workers, see ``multiprocessing.get_context``
+        (default: ``forkserver`` if available, ``spawn`` otherwise)
+    :param copy_obs: return copies of the observations and masks. The buffers are overwritten by the next
+        `step`/`reset`, views can only be used if the caller does not keep them around
+    """
+
+    def __init__(self, env_fns: List[Callable[[], gym.Env]], num_workers: Optional[int] = None,
+                 start_method: Optional[str] = None, copy_obs: bool = True):
+        num_envs = len(env_fns)
+        num_workers = num_envs if num_workers is None else min(num_workers, num_envs)
+        self.copy_obs = copy_obs
+        self.waiting = False
+        self.closed = False
+
+        if start_method is None:
+            start_method = 'forkserver' if 'forkserver' in mp.get_all_start_methods() else 'spawn'
+        ctx = mp.get_context(start_method)
+        # the workers attach to the blocks created later on: started now, the tracker of this process is shared with
+        # them (forked workers would start their own, which would unlink the blocks again when they exit)
+        resource_tracker.ensure_running()
+
+        self.groups = [group.tolist() for group in np.array_split(np.arange(num_envs), num_workers)]
+        self.remotes, self.work_remotes = zip(*[ctx.Pipe() for _ in range(num_workers)])
+        self.processes = []
+        for work_remote, remote, group in zip(self.work_remotes, self.remotes, self.groups):
+            args = (work_remote, remote, CloudpickleWrapper([env_fns[i] for i in group]), group[0])
+            # daemon=True: if the main process crashes, we should not cause things to hang
+            process = ctx.Process(target=_worker, args=args, daemon=True)
+            process.start()
+            self.processes.append(process)
+            work_remote.close()
+
+        self.remotes[0].send(('get_spaces', None))
+        observation_space, action_space, metadata, mask_info = self._recv(self.remotes[:1])[0]
+        assert isinstance(observation_space, spaces.Box), "only `Box` observations can be shared"
+        VecEnv.__init__(self, num_envs, observation_space, action_space)
+        self.metadata = metadata
+
+        layout = {
+            'actions': ((num_envs, *action_space.shape), action_space.dtype),
+            'obs': ((num_envs, *observation_space.shape), observation_space.dtype),
+            'rewards': ((num_envs,), np.float32),
+            'dones': ((num_envs,), bool),
+        }
+        if mask_info is not None:
+            layout['masks'] = ((num_envs, *mask_info[0]), mask_info[1])
+        self.buffers = _SharedBuffers(layout)
+        for remote in self.remotes:
+            remote.send(('attach', (layout, self.buffers.names)))
+        self._recv(self.remotes)
+
+    @staticmethod
+    def _recv(remotes):
+        # the results of all the `remotes`, the errors of the workers are raised once every result is received
+        results = [remote.recv() for remote in remotes]
+        for result in results:
+            if isinstance(result, _WorkerError):
+                raise result.error
+        return results
+
+    def _out(self, array):
+        return np.copy(array) if self.copy_obs else array
+
+    def step_async(self, actions: np.ndarray) -> None:
+        self.buffers.actions[:] = np.asarray(actions).reshape(self.buffers.actions.shape)
+        for remote in self.remotes:
+            remote.send(('step', None))
+        self.waiting = True
+
+    def step_wait(self) -> VecEnvStepReturn:
+        self.waiting = False
+        infos = [info for result in self._recv(self.remotes) for info in result]
+        return self._out(self.buffers.obs), np.copy(self.buffers.rewards), np.copy(self.buffers.dones), infos
+
+    def reset(self, **kwargs) -> VecEnvObs:
+        kwargs.setdefault('options', None)
+        for remote in self.remotes:
+            remote.send(('reset', kwargs))
+        self._recv(self.remotes)
+        return self._out(self.buffers.obs)
+
+    def get_mask(self, refresh: bool = False) -> np.ndarray:
+        # the masks of the current observations of all the envs, `refresh` recomputes them
+        assert 'masks' in self.buffers.arrays, "the envs do not provide `get_mask`"
+        if refresh:
+            for remote in self.remotes:
+                remote.send(('get_mask', None))
+            self._recv(self.remotes)
+        return self._out(self.buffers.masks)
+
+    def reverse_action(self, actions: List[List[str]]) -> np.ndarray:
+        for remote, group in zip(self.remotes, self.groups):
+            remote.send(('reverse_action', [actions[i] for i in group]))
+        return np.array([ra for result in self._recv(self.remotes) for ra in result])
+
+    def seed(self, seed: Optional[int] = None) -> List[Union[None, int]]:
+        if seed is None:
+            seed = np.random.randint(0, 2**32 - 1)
+        for remote, group in zip(self.remotes, self.groups):
+            remote.send(('seed', [seed + i for i in group]))
+        return [s for result in self._recv(self.remotes) for s in result]
+
+    def close(self) -> None:
+        if self.closed:
+            return
+        if self.waiting:
+            for remote in self.remotes:
+                remote.recv()
+        for remote in self.remotes:
+            remote.send(('close', None))
+        for process in self.processes:
+            process.join()
+        self.buffers.close(unlink=True)
+        self.closed = True
+
+    def get_images(self) -> Sequence[np.ndarray]:
+        return self.env_method('render', mode='rgb_array')
+
+    def _remote_calls(self, cmd, indices, *args):
+        # send `cmd` to the workers of `indices`, with the local indices of their envs. The results follow `indices`
+        indices = list(self._get_indices(indices))
+        calls, positions = [], []
+        for remote, group in zip(self.remotes, self.groups):
+            sent = [k for k, i in enumerate(indices) if group[0] <= i <= group[-1]]
+            if sent:
+                remote.send((cmd, ([indices[k] - group[0] for k in sent], *args)))
+                calls.append(remote)
+                positions.append(sent)
+        values = [None] * len(indices)
+        for sent, result in zip(positions, self._recv(calls)):
+            for k, value in zip(sent, result):
+                values[k] = value
+        return values
+
+    def get_attr(self, attr_name: str, indices: VecEnvIndices = None) -> List[Any]:
+        """Return attribute from vectorized environment (see base class)."""
+        return self._remote_calls('get_attr', indices, attr_name)
+
+    def set_attr(self, attr_name: str, value: Any, indices: VecEnvIndices = None) -> None:
+        """Set attribute inside vectorized environments (see base class)."""
+        self._remote_calls('set_attr', indices, attr_name, value)
+
+    def env_method(self, method_name: str, *method_args, indices: VecEnvIndices = None, **method_kwargs) -> List[Any]:
+        """Call instance methods of vectorized environments."""
+        return self._remote_calls('env_method', indices, method_name, method_args, method_kwargs)
+
+    def env_is_wrapped(self, wrapper_class: Type[gym.Wrapper], indices: VecEnvIndices = None) -> List[bool]:
+        """Check if worker environments are wrapped with a given wrapper"""
+        return self._remote_calls('is_wrapped', indices, wrapper_class)
@@ -1,4 +1,5 @@
 import argparse
+import asyncio
 import json
 import os
 import sys
@@ -11,8 +12,9 @@ sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
 
 from levels.utils import convert_to_prompt
 from overcooked import World
-from utils.llm import chat_llm, chat_llm_vicuna, prepend_history, rules
-from agents.llm_agent import LLMAgent, extract_action, extract_broadcast
+from utils.llm import chat_llm, chat_llm_vicuna, prepend_history, rules, use_rate_limits
+from utils.llm_cache import CACHE_MODES, use_response_cache
+from agents.llm_agent import LLMAgent, astep_agents, extract_action, extract_broadcast
 
 
 def num_tokens_from_string(string: str, encoding_name: str) -> int:
@@ -58,81 +60,147 @@ def main(model, num_agents, level_to_run, args):
     else:
         levels = [level_to_run]
 
+    max_episode = 3
+    struct = "struct" if args.structured else "nl"
+    # the episodes not played yet (without a table entry or a record), played by `run_sweep`
+    tables = {}
+    episodes = []
     for level in levels:
-        save_file_name = f'result_{level}_{NUM_AGENTS}_{model}_{"struct" if args.structured else "nl"}.json'
+        save_file_name = f'result_{level}_{NUM_AGENTS}_{model}_{struct}.json'
         if os.path.exists(save_file_name):
             with open(save_file_name, 'r') as f:
-                table = json.load(f)
+                tables[level] = json.load(f)
         else:
-            table = {}
-        
+            tables[level] = {}
+
         for alpha in alphas :
-            if str(alpha) in table.keys():
+            if str(alpha) in tables[level].keys():
                 continue
-            env = World(recipe_filename='./assets/recipe.json', task_filename='./assets/tasks_level_final.json',
-                         level=level, use_task_lifetime_interval_oracle=True,
-                        alpha=alpha, beta=2.5, num_agents=NUM_AGENTS, override_agent=True)
-
-            max_episode = 3
-            max_steps = env.max_steps
+            for eps_id in range(max_episode):
+                record_file = episode_record_file(args.records_dir, level, NUM_AGENTS, model, struct, alpha, eps_id)
+                if not os.path.exists(record_file):
+                    episodes.append((level, alpha, eps_id, record_file))
 
-            total = 0
-            success = 0
-            failed = 0
+    asyncio.run(run_sweep(episodes, model, NUM_AGENTS, args.structured, args.concurrency, args.episode_seeding))
 
-            total_action_histories = []
-            total_action_success_histories = []
-            total_prompts = []
+    # the tables of the levels, from the records of their episodes
+    for level in levels:
+        table = tables[level]
+        for alpha in alphas :
+            if str(alpha) in table.keys():
+                continue
+            records = []
             for eps_id in range(max_episode):
-                obs = env.reset()
-                agents = [LLMAgent(i, model, env, bc_str=args.structured) for i in range(NUM_AGENTS)]
-
-                goal = env.task
-                step = 0
-                done = False
-                action_histories = []
-                action_success_histories = []
-
-                while (step < max_steps):
-                    plan = []
-                    for agent in agents:
-                        parts = agent.step(obs, agents).split('_')
-                        parts.insert(1, 'agent' + str(agent.id_env_agents))
-                        plan.append("_".join(parts))
-                        
-                    # synchronize the agents
-                    for agent in agents:
-                        agent.sync()
-
-                    if plan:
-                        obs, done, info = env.step(plan)
-                    action_histories.append(plan)
-                    # if with_feedback:
-                    #     feedback = '-execution error messages:\n  --  ' + str(env.feedback) + '\n'
-                    #     suggestions = '-execution suggestions:\n  --  ' + str(env.suggestions) + '\n'
-
-                    print(info['action_success'])
-                    action_success_histories.append(env.action_success_history)
-                    step += 1
-
-                total += env.success_count + env.failed_count + len(env.task_manager._current_task_list)
-                success += env.success_count
-                failed += env.failed_count
-                total_action_histories.append(action_histories)
-                total_action_success_histories.append(env.action_success_history)
+                with open(episode_record_file(args.records_dir, level, NUM_AGENTS, model, struct, alpha, eps_id), 'r') as f:
+                    records.append(json.load(f))
 
             table[alpha] = {
-                'total' : total,
-                'success' : success,
-                'failed': failed,
+                'total' : sum(record['total'] for record in records),
+                'success' : sum(record['success'] for record in records),
+                'failed': sum(record['failed'] for record in records),
                 'alpha': alpha,
-                'noop_count': env.noop_count,
-                'action_history': total_action_histories,
-                'action_success_history': total_action_success_histories,
-                'prompt_history': total_prompts
+                'noop_count': records[-1]['noop_count'],
+                'action_history': [record['action_history'] for record in records],
+                'action_success_history': [record['action_success_history'] for record in records],
+                'prompt_history': []
             }
-            with open(save_file_name, 'w') as fp:
-                json.dump(table, fp)
+        with open(f'result_{level}_{NUM_AGENTS}_{model}_{struct}.json', 'w') as fp:
+            json.dump(table, fp)
+
+
+def episode_record_file(records_dir, level, num_agents, model, struct, alpha, eps_id):
+    return os.path.join(records_dir, f'{level}_{num_agents}_{model}_{struct}', f'alpha_{alpha}_episode_{eps_id}.json')
+
+
+async def run_sweep(episodes, model, num_agents, structured, concurrency, episode_seeding=False):
+    # plays the (level, alpha, eps_id, record_file) episodes, at most `concurrency` at a time, every one writes its
+    # record once it is over. By default the episodes of a (level, alpha) share one task stream as in the published
+    # tables: they are played one after the other, each one continuing the stream where the previous one (its record)
+    # left it. With `episode_seeding` the tasks of an episode only depend on its index and all the episodes run at once
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def run(level, alpha, eps_id, record_file, task_stream=None):
+        async with semaphore:
+            record = await run_episode(level, alpha, eps_id, model, num_agents, structured, task_stream,
+                                       episode_seeding)
+        os.makedirs(os.path.dirname(record_file), exist_ok=True)
+        with open(record_file + '.tmp', 'w') as fp:
+            json.dump(record, fp)
+        os.replace(record_file + '.tmp', record_file)
+        # one line per episode: the progress of the concurrent episodes is not interleaved
+        print(f"{level} alpha {alpha} episode {eps_id}: {record['success']} succeeded, {record['failed']} failed "
+              f"of {record['total']} tasks, action successes {sum(map(sum, record['action_success_history']))}"
+              f"/{sum(map(len, record['action_success_history']))}")
+        return record
+
+    async def run_stream(group):
+        # the episodes of a (level, alpha) in order, the first one continues the stream of the last one recorded
+        level, alpha, eps_id, record_file = group[0]
+        task_stream = None
+        if eps_id > 0:
+            previous_file = record_file.replace(f'_episode_{eps_id}.json', f'_episode_{eps_id - 1}.json')
+            with open(previous_file, 'r') as f:
+                task_stream = json.load(f).get('task_stream')
+            if task_stream is None:
+                raise ValueError(f'{previous_file} was played with --episode_seeding, its task stream cannot be continued')
+        for episode in group:
+            task_stream = (await run(*episode, task_stream=task_stream))['task_stream']
+
+    if episode_seeding:
+        await asyncio.gather(*[run(*episode) for episode in episodes])
+    else:
+        groups = {}
+        for episode in sorted(episodes, key=lambda episode: episode[2]):
+            groups.setdefault(episode[:2], []).append(episode)
+        await asyncio.gather(*[run_stream(group) for group in groups.values()])
+
+
+async def run_episode(level, alpha, eps_id, model, num_agents, structured, task_stream=None, episode_seeding=False):
+    # `task_stream`: the state of the task rng left by the previous episode of the (level, alpha), see `run_sweep`
+    env = World(recipe_filename='./assets/recipe.json', task_filename='./assets/tasks_level_final.json',
+                level=level, use_task_lifetime_interval_oracle=True,
+                alpha=alpha, beta=2.5, num_agents=num_agents, override_agent=True)
+    max_steps = env.max_steps
+
+    if episode_seeding:
+        # the tasks of the episode only depend on its index, not on the episodes played before
+        obs = env.reset(episode_index=eps_id)
+    else:
+        if task_stream is not None:
+            version, internal_state, gauss_next = task_stream
+            env.rng.setstate((version, tuple(internal_state), gauss_next))
+        obs = env.reset()
+    agents = [LLMAgent(i, model, env, bc_str=structured) for i in range(num_agents)]
+
+    step = 0
+    action_histories = []
+
+    while (step < max_steps):
+        plan = []
+        actions = await astep_agents(agents, obs)
+        for agent, action in zip(agents, actions):
+            parts = action.split('_')
+            parts.insert(1, 'agent' + str(agent.id_env_agents))
+            plan.append("_".join(parts))
+
+        # synchronize the agents
+        for agent in agents:
+            agent.sync()
+
+        if plan:
+            obs, done, info = env.step(plan)
+        action_histories.append(plan)
+        step += 1
+
+    return {
+        'total': env.success_count + env.failed_count + len(env.task_manager._current_task_list),
+        'success': env.success_count,
+        'failed': env.failed_count,
+        'noop_count': env.noop_count,
+        'action_history': action_histories,
+        'action_success_history': env.action_success_history,
+        'task_stream': env.rng.getstate(),
+    }
 
 if __name__ == '__main__':
     parser = argparse.ArgumentParser(description="invoking GPT")
@@ -142,12 +210,24 @@ if __name__ == '__main__':
     parser.add_argument('--num_agents', metavar='num_agents', type=int, required=True ,help='number of agents')
     parser.add_argument('--level', metavar='level', type=str, required=True ,help='level of the game')
     parser.add_argument('--structured', action='store_true', default=False, help='use structured prompt')
+    parser.add_argument('--concurrency', type=int, default=16, help='maximum number of episodes played at the same time')
+    parser.add_argument('--records_dir', type=str, default='episode_records', help='directory of the per-episode results')
+    parser.add_argument('--episode_seeding', action='store_true', default=False, help='seed the tasks of every episode with its index, so that all the episodes run concurrently (the results are not comparable with the tables of the shared task stream)')
+    parser.add_argument('--rpm', type=float, default=None, help='requests per minute allowed per API key and model')
+    parser.add_argument('--tpm', type=float, default=None, help='tokens per minute allowed per API key and model')
+    parser.add_argument('--llm_cache', type=str, default=None, help='file of the persistent LLM response cache')
+    parser.add_argument('--llm_cache_mode', type=str, choices=CACHE_MODES, default='read_write', help='mode of the LLM response cache')
     # Parse the arguments
     args = parser.parse_args()
 
+    limiter = use_rate_limits(args.rpm, args.tpm)
+    cache = use_response_cache(args.llm_cache, args.llm_cache_mode) if args.llm_cache else None
     main(
         model = args.model_name,
         num_agents = int(args.num_agents), 
         level_to_run = args.level,
         args = args
-    )
\ No newline at end of file
+    )
+    if cache is not None:
+        print(f"LLM response cache: {cache.stats()}")
+    print(f"LLM rate limiter: {limiter.retries} retries, {limiter.throttled:.0f}s throttled")
@@ -0,0 +1,34 @@
+import os
+import sys
+
+import pytest
+
+# the modules import each other from llm_overcooked/ and open the assets relative to it
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+sys.path.insert(0, ROOT)
+
+
+@pytest.fixture(autouse=True)
+def in_root(monkeypatch):
+    monkeypatch.chdir(ROOT)
+
+
+def make_kwargs(level, num_agents):
+    return dict(recipe_filename='./assets/recipe.json', task_filename='./assets/tasks_level_final.json',
+                level=level, use_task_lifetime_interval_oracle=True,
+                alpha=2.5, beta=2.5, num_agents=num_agents, override_agent=True)
+
+
+def random_plan(world, rng, shuffle=True):
+    # one random legal command per agent (noop if the agent has none), in a random order
+    plan = []
+    for agent_id, actions in enumerate(world.available_actions(return_struct=True)):
+        candidates = [(verb, arg) for verb, args in actions.items() for arg in args]
+        if not candidates:
+            plan.append(f'noop_agent{agent_id}')
+            continue
+        verb, arg = rng.choice(candidates)
+        plan.append('_'.join([verb, f'agent{agent_id}'] + [str(i) for i in arg[1:]]))
+    if shuffle:
+        rng.shuffle(plan)
+    return plan
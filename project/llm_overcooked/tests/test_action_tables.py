@@ -0,0 +1,46 @@
+import numpy as np
+import pytest
+
+from conftest import make_kwargs
+from overcooked import World
+from overcooked.wrappers.nn_action_space_wrapper import NNActionSpaceWrapper, action_id_table, action_tables
+
+# every NN action has one command, and the command gives the action back
+
+
+@pytest.mark.parametrize('num_agents', [1, 2, 3])
+def test_round_trip(num_agents):
+    env = NNActionSpaceWrapper(World(seed=0, **make_kwargs('level_3', num_agents)))
+    commands, numbers = action_tables(num_agents)
+    assert len(commands) == len(numbers) == env.action_space.nvec[0] == env.agent_offset * num_agents
+    for number in range(len(commands)):
+        action = np.full(num_agents, number)
+        assert env.reverse_action(env.action(action)) == action.tolist()
+    # a batch of actions gives a list of plans
+    batch = np.arange(len(commands) * num_agents).reshape(-1, num_agents) % len(commands)
+    assert [env.reverse_action(plan) for plan in env.action(batch)] == batch.tolist()
+
+
+@pytest.mark.parametrize('num_agents', [1, 2, 3])
+def test_action_ids(num_agents):
+    # the `World.step_ids` tuples decode to the commands, the locations missing from the level have none
+    world = World(seed=0, **make_kwargs('level_3', num_agents))
+    commands = action_tables(num_agents)[0]
+    ids = action_id_table(num_agents, world.codec)
+    on_level = [number for number, action_id in enumerate(ids) if action_id is not None]
+    assert on_level
+    for number, action_id in enumerate(ids):
+        location = commands[number].split('_')[-1]
+        if action_id is None:
+            assert location not in world.codec.location_ids
+        else:
+            assert world.codec.decode(action_id) == commands[number]
+
+
+def test_canonical_commands():
+    # the commands with an item are the actions on their location (storage items are got from storage0)
+    env = NNActionSpaceWrapper(World(seed=0, **make_kwargs('level_3', 2)))
+    numbers = action_tables(2)[1]
+    assert env.reverse_action(['put_agent0_tuna_chopboard1', 'get_agent1_salmon_blender0']) == \
+        [numbers['put_agent0_chopboard1'], numbers['get_agent1_blender0']]
+    assert env.reverse_action(['get_agent1_rice_storage1']) == [numbers['get_agent1_rice_storage0']]
@@ -0,0 +1,54 @@
+import json
+import os
+import subprocess
+import sys
+
+import pytest
+
+from conftest import ROOT
+
+pytest.importorskip('utils.llm', reason='the LLM clients (openai, anthropic, vertexai) are not installed')
+
+# the level prompts are the start of every request: they must be the same in every process, whatever its hash seed,
+# for the response cache to be hit across runs
+
+RENDER = '''
+import json, sys
+sys.path.insert(0, {root!r})
+from conftest import make_kwargs
+from overcooked import World
+from utils import llm
+from utils.llm_cache import chat_request, request_key
+prompts = {{}}
+for level, num_agents in [('level_0', 2), ('level_3', 3), ('level_9', 2)]:
+    env = World(seed=0, **make_kwargs(level, num_agents))
+    text = llm.rules(env) + llm.generate_tool_descriptions(env)
+    prompts[level] = dict(
+        text=text, key=request_key(chat_request('openai', [('user', text)], temperature=0, model='gpt-4o')),
+        parts=[llm.level_prompt(env, part, None) for part in ('rules', 'recipes', 'tools')])
+print(json.dumps(prompts))
+'''
+
+
+def render(hash_seed):
+    env = dict(os.environ, PYTHONHASHSEED=str(hash_seed), PYTHONPATH=os.pathsep.join(sys.path))
+    script = RENDER.format(root=os.path.join(ROOT, 'tests'))
+    output = subprocess.run([sys.executable, '-c', script], cwd=ROOT, env=env, capture_output=True, text=True,
+                            check=True).stdout
+    return json.loads(output.splitlines()[-1])
+
+
+@pytest.fixture(scope='module')
+def renders():
+    return [render(hash_seed) for hash_seed in (0, 1, 2)]
+
+
+def test_request_keys(renders):
+    for level in renders[0]:
+        assert len({render[level]['key'] for render in renders}) == 1, level
+
+
+def test_cached_prompts(renders):
+    # the cached texts (and their token counts) of every part are byte-identical
+    for level in renders[0]:
+        assert all(render[level]['parts'] == renders[0][level]['parts'] for render in renders), level
@@ -0,0 +1,164 @@
+import asyncio
+import threading
+import time
+
+import pytest
+
+from utils.llm_cache import ResponseCache, ResponseCacheMiss, cached_chat, chat_request, request_key, \
+    use_response_cache
+from utils import llm_cache
+
+
+@pytest.fixture
+def path(tmp_path):
+    return str(tmp_path / 'cache.sqlite')
+
+
+def test_request_key():
+    # equal requests have equal keys, whatever the order of the arguments and the type of the sequences
+    assert request_key(chat_request('openai', [('user', 'hi')], temperature=0, model='gpt-4o')) == \
+        request_key(chat_request('openai', [['user', 'hi']], model='gpt-4o', temperature=0))
+    assert request_key(chat_request('openai', 'hi', model='gpt-4o')) != \
+        request_key(chat_request('openai', 'hi', model='gpt-4o-mini'))
+
+
+def test_modes(path):
+    calls = []
+
+    def send():
+        calls.append(1)
+        return f'response {len(calls)}'
+
+    request = chat_request('openai', 'hi', model='gpt-4o')
+    cache = ResponseCache(path)
+    assert cache.call(request, send) == 'response 1'
+    assert cache.call(request, send) == 'response 1' and len(calls) == 1
+    # failed requests (None) are not stored
+    assert cache.call(chat_request('openai', 'failed'), lambda: None) is None and len(cache) == 1
+    # 'write' sends again and refreshes, 'replay' never sends
+    assert ResponseCache(path, 'write').call(request, send) == 'response 2'
+    replay = ResponseCache(path, 'replay')
+    assert replay.call(request, send) == 'response 2' and len(calls) == 2
+    with pytest.raises(ResponseCacheMiss):
+        replay.call(chat_request('openai', 'new'), send)
+    assert cache.stats() == dict(hits=1, misses=2, writes=1, evictions=0, entries=1)
+
+
+def test_max_entries(path):
+    cache = ResponseCache(path, max_entries=20)
+    for i in range(25):
+        cache.put(chat_request('openai', f'q{i}'), f'r{i}')
+        # the first requests stay the most recently used
+        assert cache.get(chat_request('openai', 'q0')) == 'r0'
+        assert len(cache) <= 20
+    assert cache.entries == len(cache)
+    # evicted down to 90%: the eviction query does not run on every write past the limit
+    assert cache.evictions == 6
+    assert cache.get(chat_request('openai', 'q1')) is None and cache.get(chat_request('openai', 'q24')) == 'r24'
+
+
+def test_ttl(path):
+    cache = ResponseCache(path)
+    for i in range(10):
+        cache.put(chat_request('openai', f'q{i}'), f'r{i}')
+    time.sleep(0.05)
+    # a stale response is a miss, and the stale rows are purged when the cache is opened
+    stale = ResponseCache(path, ttl=0.01)
+    assert len(stale) == 0 and stale.evictions == 10
+    stale.put(chat_request('openai', 'q'), 'r')
+    time.sleep(0.05)
+    assert stale.get(chat_request('openai', 'q')) is None and len(stale) == 0
+
+    # and every `purge_interval` writes, in 'write' mode too (no lookups)
+    writer = ResponseCache(path, 'write', ttl=0.01)
+    writer.purge_interval = 5
+    for i in range(4):
+        writer.put(chat_request('openai', f'q{i}'), f'r{i}')
+    time.sleep(0.05)
+    writer.put(chat_request('openai', 'last'), 'r')
+    assert len(writer) == 1
+
+
+def test_threads(path):
+    cache = ResponseCache(path, max_entries=50)
+    errors = []
+
+    def work(thread):
+        try:
+            for i in range(100):
+                request = chat_request('openai', f'{thread} {i % 30}')
+                assert cache.call(request, lambda: f'{thread} {i % 30}') == f'{thread} {i % 30}'
+        except Exception as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=work, args=(thread,)) for thread in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert not errors
+    assert cache.hits + cache.misses == 800 and cache.writes == cache.misses
+    assert len(cache) <= 50
+
+
+def test_acall_does_not_block(path):
+    # the database is used from a thread: the other coroutines run while the cache waits for its lock
+    cache = ResponseCache(path)
+    request = chat_request('openai', 'hi')
+    cache.put(request, 'cached')
+    held = threading.Event()
+
+    def hold():
+        with cache.lock:
+            held.set()
+            time.sleep(0.2)
+
+    async def send():
+        return 'sent'
+
+    async def main():
+        ticks = 0
+
+        async def tick():
+            nonlocal ticks
+            while True:
+                ticks += 1
+                await asyncio.sleep(0.01)
+
+        task = asyncio.create_task(tick())
+        assert await cache.acall(request, send) == 'cached'
+        assert await cache.acall(chat_request('openai', 'new'), send) == 'sent'
+        task.cancel()
+        return ticks
+
+    thread = threading.Thread(target=hold)
+    thread.start()
+    held.wait()
+    assert asyncio.run(main()) >= 5
+    thread.join()
+    assert cache.get(chat_request('openai', 'new')) == 'sent'
+
+
+def test_cached_chat(path, monkeypatch):
+    # `use_response_cache` sets the environment, restored by monkeypatch
+    monkeypatch.setattr(llm_cache, '_response_cache', None)
+    monkeypatch.setenv('OVERCOOKED_LLM_CACHE', '')
+    monkeypatch.setenv('OVERCOOKED_LLM_CACHE_MODE', '')
+    calls = []
+
+    @cached_chat('openai')
+    def chat(history, temperature=0, model='gpt-4o'):
+        calls.append(history)
+        return f'{model}: {history}'
+
+    @cached_chat('claude', model='claude-2')
+    async def achat(history, temperature=0):
+        calls.append(history)
+        return f'claude: {history}'
+
+    # no cache in use: every call is sent
+    chat('hi'), chat('hi')
+    assert len(calls) == 2
+    use_response_cache(path)
+    assert chat('hi') == chat('hi', 0) == chat(history='hi', model='gpt-4o') == 'gpt-4o: hi' and len(calls) == 3
+    assert asyncio.run(achat('hi')) == asyncio.run(achat('hi')) == 'claude: hi' and len(calls) == 4
@@ -0,0 +1,145 @@
+import asyncio
+import logging
+import time
+from collections import Counter
+
+import pytest
+
+from utils.rate_limit import RateLimiter, TokenBucket, retry_after, status_code
+
+
+class Response:
+    def __init__(self, status_code, headers=None):
+        self.status_code = status_code
+        self.headers = headers or {}
+
+
+class APIError(Exception):
+    # an error of a client, with the response of the server
+    def __init__(self, status, retry_after=None):
+        super().__init__(f'status {status}')
+        self.response = Response(status, {} if retry_after is None else {'retry-after': str(retry_after)})
+
+
+def retryable(error):
+    return status_code(error) in (429, 500)
+
+
+def test_errors():
+    assert status_code(APIError(429)) == 429 and retry_after(APIError(429, 1.5)) == 1.5
+    assert status_code(ValueError()) is None and retry_after(APIError(500)) is None
+
+
+def test_token_bucket():
+    # the budget of a minute can be used at once, then the units come back at `rate` per minute
+    bucket = TokenBucket(60)
+    assert bucket.capacity == 60
+    assert all(bucket.reserve(1) == 0 for _ in range(60))
+    assert bucket.reserve(1) == pytest.approx(1, abs=0.05)
+    bucket.refund(1)
+    assert bucket.reserve(1) == pytest.approx(1, abs=0.05)
+    # smaller bursts spread the budget over the minute
+    paced = TokenBucket(600, capacity=1)
+    assert paced.reserve(1) == 0 and paced.reserve(1) == pytest.approx(0.1, abs=0.01)
+
+
+def test_limits():
+    limiter = RateLimiter(requests_per_min=60, tokens_per_min=1000)
+    state, wait = limiter.acquire('gpt-4o', 900)
+    assert wait == 0
+    # the tokens reported by the response correct the reservation
+    limiter.settle(state, 'gpt-4o', 900, 100)
+    assert limiter.acquire('gpt-4o', 900)[1] == 0
+    assert limiter.acquire('gpt-4o', 900)[1] > 0
+    # every model has its own budget
+    assert limiter.acquire('gpt-4o-mini', 900)[1] == 0
+
+
+def test_round_robin():
+    limiter = RateLimiter(keys=['k1', 'k2', 'k3'])
+    keys = [limiter.call('gpt-4o', 0, lambda key: (key, None), retryable) for _ in range(6)]
+    assert keys == ['k1', 'k2', 'k3', 'k1', 'k2', 'k3']
+
+
+def test_retry_after(caplog):
+    attempts = []
+
+    def send(key):
+        attempts.append(time.monotonic())
+        if len(attempts) == 1:
+            raise APIError(429, retry_after=0.1)
+        return 'ok', None
+
+    limiter = RateLimiter()
+    with caplog.at_level(logging.WARNING, logger='utils.rate_limit'):
+        assert limiter.call('gpt-4o', 0, send, retryable) == 'ok'
+    assert attempts[1] - attempts[0] >= 0.1 and limiter.retries == 1
+    assert 'status 429' in caplog.text
+
+
+def test_rate_limited_key_is_skipped():
+    # a 429 pauses the key, the retry goes to another key right away
+    sent = []
+
+    def send(key):
+        sent.append(key)
+        if key == 'k1':
+            raise APIError(429, retry_after=60)
+        return key, None
+
+    limiter = RateLimiter(keys=['k1', 'k2'])
+    start = time.monotonic()
+    assert [limiter.call('gpt-4o', 0, send, retryable) for _ in range(3)] == ['k2'] * 3
+    assert sent == ['k1', 'k2', 'k2', 'k2'] and time.monotonic() - start < 1
+
+
+def test_circuit_breaker():
+    sent = Counter()
+
+    def send(key):
+        sent[key] += 1
+        if key == 'bad':
+            raise APIError(500)
+        return key, None
+
+    limiter = RateLimiter(keys=['bad', 'good'], base_delay=0.001, failure_threshold=2, cooldown=60)
+    replies = [limiter.call('gpt-4o', 0, send, retryable) for _ in range(10)]
+    assert replies == ['good'] * 10
+    # the broken key is skipped once it failed `failure_threshold` times in a row
+    assert sent['bad'] == 2
+
+
+def test_errors_raised():
+    sent = []
+
+    def send(key):
+        sent.append(key)
+        raise APIError(401)
+
+    with pytest.raises(APIError):
+        RateLimiter().call('gpt-4o', 0, send, retryable)
+    assert len(sent) == 1
+
+    def failing(key):
+        sent.append(key)
+        raise APIError(500)
+
+    # the last error is raised after `max_retries` retries
+    sent.clear()
+    with pytest.raises(APIError):
+        RateLimiter(max_retries=3, base_delay=0.001).call('gpt-4o', 0, failing, retryable)
+    assert len(sent) == 4
+
+
+def test_acall():
+    attempts = []
+
+    async def send(key):
+        attempts.append(key)
+        if len(attempts) < 3:
+            raise APIError(500)
+        return 'ok', 10
+
+    limiter = RateLimiter(keys=['k1', 'k2'], base_delay=0.001, tokens_per_min=1000)
+    assert asyncio.run(limiter.acall('gpt-4o', 50, send, retryable)) == 'ok'
+    assert attempts == ['k1', 'k2', 'k1'] and limiter.retries == 2
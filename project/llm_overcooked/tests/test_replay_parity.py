@@ -0,0 +1,52 @@
+import glob
+import json
+import os
+import re
+
+import pytest
+
+from conftest import ROOT
+from levels.utils import convert_to_prompt
+from overcooked import World
+
+# the recorded action histories of `result_level_*.json` (generated by the original string based engine) are
+# replayed, the current engine has to reproduce the recorded action successes, task counts and states
+TABLES = sorted(os.path.basename(file) for file in glob.glob(os.path.join(ROOT, 'result_level_*.json')))
+
+
+@pytest.mark.parametrize('file', TABLES)
+def test_replay_table(file):
+    match = re.match(r'result_(level_\d+)_(\d+)_', file)
+    level, num_agents = match.group(1), int(match.group(2))
+    with open(file, 'r') as f:
+        table = json.load(f)
+
+    for alpha, record in table.items():
+        env = World(recipe_filename='./assets/recipe.json', task_filename='./assets/tasks_level_final.json',
+                    level=level, use_task_lifetime_interval_oracle=True,
+                    alpha=float(alpha), beta=2.5, num_agents=num_agents, override_agent=True)
+        success = 0
+        failed = 0
+        for eps_id, action_history in enumerate(record['action_history']):
+            env.reset()
+            # the recorded prompts come from LLM agents, which rename the env agents
+            for agent in env.agents:
+                agent.name = agent.name.replace('_', '')
+            prompts = [convert_to_prompt(env.all_state())]
+            for plan in action_history:
+                obs, done, info = env.step(plan)
+                prompts.append(convert_to_prompt(obs))
+
+            assert env.action_success_history == record['action_success_history'][eps_id], \
+                f'alpha {alpha} episode {eps_id}: action successes differ'
+            if record['prompt_history']:
+                for step, (prompt, recorded) in enumerate(zip(prompts, record['prompt_history'][eps_id])):
+                    assert prompt == recorded, f'alpha {alpha} episode {eps_id}: state differs at step {step}'
+            success += env.success_count
+            failed += env.failed_count
+
+        assert (success, failed) == (record['success'], record['failed']), f'alpha {alpha}: task counts differ'
+
+
+def test_tables_found():
+    assert TABLES, 'no recorded table to replay'
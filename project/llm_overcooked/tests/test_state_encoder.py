@@ -0,0 +1,93 @@
+import random
+
+import gymnasium.spaces as spaces
+import numpy as np
+import pytest
+
+from conftest import make_kwargs, random_plan
+from overcooked import VecWorld, World
+from overcooked.state_encoder import LEGACY_STATE_SIZE, StateEncoder
+from overcooked.wrappers.masks_wrapper import ARMasksWrapper
+from overcooked.wrappers.nn_action_space_wrapper import NNActionSpaceWrapper, action_tables
+
+# the batched features and masks have to be the ones computed env by env
+
+
+@pytest.mark.parametrize('level', [f'level_{i}' for i in range(13)])
+@pytest.mark.parametrize('num_agents', [2, 3])
+def test_encode_vec(level, num_agents):
+    kwargs = make_kwargs(level, num_agents)
+    seeds = list(range(4))
+    vec = VecWorld(len(seeds), seeds, **kwargs)
+    worlds = [World(seed=seed, use_state_observation=True, **kwargs) for seed in seeds]
+    encoder = worlds[0].state_encoder
+    assert StateEncoder.for_world(vec).size == encoder.size
+    rngs = [random.Random(seed) for seed in seeds]
+    out = np.full((len(seeds), encoder.size), np.nan, dtype=np.float32)
+    vec.reset()
+    observations = [world.reset() for world in worlds]
+    for _ in range(worlds[0].max_steps):
+        assert np.array_equal(encoder.encode_vec(vec, out=out), np.stack([encoder.encode(obs) for obs in observations]))
+        plans = [random_plan(world, rng) for world, rng in zip(worlds, rngs)]
+        vec.step(*vec.plan_actions(plans))
+        observations = [world.step(plan)[0] for world, plan in zip(worlds, plans)]
+
+
+def reference_mask(world):
+    # the legal commands of every agent, looked up in the command table of the action space
+    numbers = action_tables(world.num_agents)[1]
+    mask = np.zeros(len(numbers), dtype=bool)
+    for agent_id, actions in enumerate(world.available_actions(return_struct=True)):
+        mask[numbers[f'noop_agent{agent_id}']] = True
+        for verb, args in actions.items():
+            for arg in args:
+                mask[numbers['_'.join([verb, f'agent{agent_id}'] + [str(i) for i in arg[1:]])]] = True
+    return mask
+
+
+@pytest.mark.parametrize('level', ['level_0', 'level_3', 'level_9', 'level_12'])
+@pytest.mark.parametrize('num_agents', [1, 2, 3])
+def test_get_mask(level, num_agents):
+    world = World(seed=0, use_state_observation=True, **make_kwargs(level, num_agents))
+    env = ARMasksWrapper(NNActionSpaceWrapper(world))
+    env.reset()
+    rng = random.Random(0)
+    out = np.zeros((num_agents, env.agent_offset * num_agents), dtype=bool)
+    for _ in range(2 * world.max_steps):
+        expected = reference_mask(world)
+        assert (env.get_mask() == expected).all()
+        assert env.get_mask(out=out) is out and (out == expected).all()
+        world.step(random_plan(world, rng))
+        if world.time_step == world.max_steps:
+            world.reset()
+
+
+def test_check_space():
+    # the policies of the former 64 features (or of another level) are refused with an explicit error
+    world = World(seed=0, use_state_observation=True, **make_kwargs('level_3', 2))
+    encoder = world.state_encoder
+    encoder.check_space(world.observation_space)
+    with pytest.raises(ValueError, match='convert_to_state'):
+        encoder.check_space(spaces.Box(low=-np.inf, high=np.inf, shape=(LEGACY_STATE_SIZE,)))
+    with pytest.raises(ValueError, match='does not match'):
+        encoder.check_space(World(seed=0, use_state_observation=True, **make_kwargs('level_3', 3)).observation_space)
+
+
+def test_vec_masks():
+    # the masks of the agents of all the envs, stacked at once by `DummyVecEnv`
+    pytest.importorskip('stable_baselines3', reason='the vec envs are built on stable_baselines3')
+    from overcooked.wrappers.ar_nn_wrapper import ARNNWrapper
+    from overcooked.wrappers.dummpy_vec_wrapper import DummyVecEnv
+
+    num_envs, num_agents = 4, 3
+    vec = DummyVecEnv([lambda seed=seed: ARNNWrapper(World(seed=seed, use_state_observation=True,
+                                                            **make_kwargs('level_3', num_agents)))
+                       for seed in range(num_envs)])
+    vec.reset()
+    vec.action_space.seed(0)
+    for _ in range(100):
+        masks = vec.get_mask()
+        assert masks.shape == (num_envs, num_agents, vec.envs[0].masks_wrapper.agent_offset * num_agents)
+        for i, env in enumerate(vec.envs):
+            assert (masks[i] == reference_mask(env.unwrapped)).all()
+        vec.step(np.stack([vec.action_space.sample() for _ in range(num_envs)]))
@@ -0,0 +1,198 @@
+import functools
+import importlib
+import sys
+import types
+from multiprocessing import shared_memory
+from typing import Any
+
+import gymnasium as gym
+import gymnasium.spaces as spaces
+import numpy as np
+import pytest
+
+from conftest import make_kwargs
+from overcooked import World
+
+# `SharedMemoryVecEnv` has to return what the envs stepped one by one return
+
+
+class VecEnv:
+    # the part of the `VecEnv` of stable_baselines3 used by `SharedMemoryVecEnv`
+    def __init__(self, num_envs, observation_space, action_space):
+        self.num_envs = num_envs
+        self.observation_space = observation_space
+        self.action_space = action_space
+
+    def step(self, actions):
+        self.step_async(actions)
+        return self.step_wait()
+
+    def _get_indices(self, indices):
+        if indices is None:
+            return range(self.num_envs)
+        return [indices] if isinstance(indices, int) else indices
+
+
+class CloudpickleWrapper:
+    # the forked workers get the env factories without pickling
+    def __init__(self, var):
+        self.var = var
+
+
+@pytest.fixture
+def vec_env_class(monkeypatch):
+    # `SharedMemoryVecEnv`, built on the `VecEnv` above if stable_baselines3 is not installed: the workers are then
+    # forked and inherit it, the modules are removed once the test is over
+    try:
+        import stable_baselines3  # noqa: F401
+        from overcooked.wrappers.subproc_vec_wrapper import SharedMemoryVecEnv
+        return SharedMemoryVecEnv
+    except ImportError:
+        pass
+    base = types.ModuleType('stable_baselines3.common.vec_env.base_vec_env')
+    base.VecEnv, base.CloudpickleWrapper = VecEnv, CloudpickleWrapper
+    base.VecEnvIndices = base.VecEnvObs = base.VecEnvStepReturn = Any
+    for name in ['stable_baselines3', 'stable_baselines3.common', 'stable_baselines3.common.vec_env']:
+        monkeypatch.setitem(sys.modules, name, types.ModuleType(name))
+    monkeypatch.setitem(sys.modules, base.__name__, base)
+    module = importlib.import_module('overcooked.wrappers.subproc_vec_wrapper')
+    monkeypatch.setitem(sys.modules, module.__name__, module)
+    return functools.partial(module.SharedMemoryVecEnv, start_method='fork')
+
+
+class CountingEnv(gym.Env):
+    # observations (seed, step), rewards the sum of the actions, episodes of `seed + 2` steps, one legal action
+    # per head that changes every step
+    observation_space = spaces.Box(low=-np.inf, high=np.inf, shape=(2,), dtype=np.float32)
+    action_space = spaces.MultiDiscrete([4, 4])
+
+    def __init__(self, seed):
+        self.seed = seed
+        self.t = 0
+
+    def reset(self, seed=None, options=None):
+        self.t = 0
+        return self._obs(), {}
+
+    def step(self, action):
+        self.t += 1
+        return self._obs(), float(np.sum(action)), self.t == self.seed + 2, False, {'t': self.t}
+
+    def _obs(self):
+        return np.array([self.seed, self.t], dtype=np.float32)
+
+    def get_mask(self, out=None):
+        if out is None:
+            out = np.empty((2, 4), dtype=bool)
+        out[:] = np.arange(4) == self.t % 4
+        return out
+
+    def reverse_action(self, commands):
+        return [len(command) for command in commands]
+
+
+def test_shared_memory(vec_env_class):
+    num_envs = 5
+    vec = vec_env_class([functools.partial(CountingEnv, seed) for seed in range(num_envs)], num_workers=2)
+    names = list(vec.buffers.names.values())
+    try:
+        assert np.array_equal(vec.reset(), [[seed, 0] for seed in range(num_envs)])
+        assert np.array_equal(vec.get_mask()[:, :, 0], np.ones((num_envs, 2), dtype=bool))
+        steps = np.zeros(num_envs)
+        for t in range(1, 8):
+            actions = np.full((num_envs, 2), t % 4)
+            obs, rewards, dones, infos = vec.step(actions)
+            steps += 1
+            assert np.array_equal(rewards, actions.sum(1)) and np.array_equal(dones, steps == np.arange(num_envs) + 2)
+            for i, info in enumerate(infos):
+                if dones[i]:
+                    # the last observation of the episode, then the one of the reset
+                    assert np.array_equal(info['terminal_observation'], [i, steps[i]]) and info['t'] == steps[i]
+                    steps[i] = 0
+            assert np.array_equal(obs, np.stack([np.arange(num_envs), steps], 1))
+            assert np.array_equal(vec.get_mask().argmax(2), np.repeat(steps[:, None] % 4, 2, 1))
+        assert np.array_equal(vec.get_mask(refresh=True).argmax(2), np.repeat(steps[:, None] % 4, 2, 1))
+        assert np.array_equal(vec.reverse_action([['a' * i, 'b'] for i in range(num_envs)]),
+                              [[i, 1] for i in range(num_envs)])
+        assert vec.get_attr('seed', [4, 0]) == [4, 0]
+        assert np.array_equal(vec.reset(), [[seed, 0] for seed in range(num_envs)])
+    finally:
+        vec.close()
+    # the workers are gone and the shared memory blocks unlinked, closing again does nothing
+    assert all(not process.is_alive() for process in vec.processes)
+    for name in names:
+        with pytest.raises(FileNotFoundError):
+            shared_memory.SharedMemory(name=name)
+    vec.close()
+
+
+@pytest.fixture
+def nn_envs():
+    pytest.importorskip('stable_baselines3', reason='ARNNWrapper is built on the Monitor of stable_baselines3')
+    from overcooked.wrappers.ar_nn_wrapper import ARNNWrapper
+    from overcooked.wrappers.subproc_vec_wrapper import SharedMemoryVecEnv
+    return ARNNWrapper, SharedMemoryVecEnv
+
+
+class make_env:
+    # picklable env factory for the workers
+    def __init__(self, seed, use_state_observation):
+        self.seed = seed
+        self.use_state_observation = use_state_observation
+
+    def __call__(self):
+        from overcooked.wrappers.ar_nn_wrapper import ARNNWrapper
+        return ARNNWrapper(World(seed=self.seed, use_state_observation=self.use_state_observation,
+                                 **make_kwargs('level_3', 2)))
+
+
+@pytest.fixture(params=[True, False], ids=['state', 'text'])
+def use_state_observation(request, nn_envs):
+    if not request.param:
+        pytest.importorskip('sentence_transformers', reason='the text observations are encoded by sentence_transformers')
+    return request.param
+
+
+def test_steps_and_terminal_observations(nn_envs, use_state_observation):
+    SharedMemoryVecEnv = nn_envs[1]
+    num_envs = 4
+    vec = SharedMemoryVecEnv([make_env(seed, use_state_observation) for seed in range(num_envs)], num_workers=2)
+    envs = [make_env(seed, use_state_observation)() for seed in range(num_envs)]
+    try:
+        obs = vec.reset()
+        assert np.allclose(obs, np.stack([env.reset()[0] for env in envs]))
+        envs[0].action_space.seed(0)
+        terminals = 0
+        while terminals < num_envs:
+            actions = np.stack([envs[0].action_space.sample() for _ in range(num_envs)])
+            vec.step_async(actions)
+            obs, rewards, dones, infos = vec.step_wait()
+            for i, env in enumerate(envs):
+                env_obs, reward, done, truncated, _ = env.step(actions[i])
+                assert np.isclose(rewards[i], reward) and dones[i] == (done or truncated)
+                if dones[i]:
+                    # the encoded last observation of the episode, not the prompts
+                    terminal = infos[i]['terminal_observation']
+                    assert terminal.dtype == obs.dtype and terminal.shape == obs.shape[1:]
+                    assert np.allclose(terminal, env_obs)
+                    terminals += 1
+                    env_obs, _ = env.reset()
+                assert np.allclose(obs[i], env_obs)
+                assert np.array_equal(vec.get_mask()[i], env.get_mask())
+    finally:
+        vec.close()
+
+
+def test_remote_calls_follow_indices(nn_envs):
+    SharedMemoryVecEnv = nn_envs[1]
+    vec = SharedMemoryVecEnv([make_env(seed, True) for seed in range(5)], num_workers=2)
+    try:
+        vec.reset()
+        seeds = [env.unwrapped.seed for env in [make_env(seed, True)() for seed in range(5)]]
+        for indices in ([4, 0, 2], [3, 1], [2, 2, 0]):
+            assert vec.get_attr('seed', indices) == [seeds[i] for i in indices]
+            assert vec.env_method('get_mask', indices=indices)[0].shape == vec.get_mask()[0].shape
+        vec.set_attr('tag', 'x', [4, 1])
+        assert vec.get_attr('tag', [1, 4]) == ['x', 'x']
+    finally:
+        vec.close()
@@ -0,0 +1,79 @@
+import glob
+import json
+import os
+import random
+import re
+
+import numpy as np
+import pytest
+
+from conftest import ROOT, make_kwargs, random_plan
+from overcooked import VecWorld, World
+
+# `VecWorld` has to follow `World` step by step: rewards, task successes, action successes and states
+
+
+def step_both(vec, worlds, plans):
+    actions, order = vec.plan_actions(plans)
+    rewards, success, dones, info = vec.step(actions, order)
+    for i, (world, plan) in enumerate(zip(worlds, plans)):
+        obs, world_success, world_info = world.step(plan)
+        assert rewards[i] == world_info['reward'], plan
+        assert success[i] == world_success, plan
+        # the successes of `World` follow the plan, the ones of `VecWorld` the agents
+        assert info['action_success'][i, order[i]].tolist() == world_info['action_success'], plan
+        assert dones[i] == (world.time_step == world.max_steps)
+        assert vec.get_state(i).to_dict() == obs.to_dict(), plan
+
+
+@pytest.mark.parametrize('level', [f'level_{i}' for i in range(13)])
+@pytest.mark.parametrize('num_agents', [2, 3])
+def test_random_plans(level, num_agents):
+    kwargs = make_kwargs(level, num_agents)
+    seeds = list(range(4))
+    vec = VecWorld(len(seeds), seeds, **kwargs)
+    worlds = [World(seed=seed, **kwargs) for seed in seeds]
+    rngs = [random.Random(seed) for seed in seeds]
+    for episode in range(2):
+        vec.reset(episode_indices=[episode] * len(seeds))
+        for i, world in enumerate(worlds):
+            assert vec.get_state(i).to_dict() == world.reset(episode_index=episode).to_dict()
+        for _ in range(worlds[0].max_steps):
+            step_both(vec, worlds, [random_plan(world, rng) for world, rng in zip(worlds, rngs)])
+        for i, world in enumerate(worlds):
+            assert (vec.success_count[i], vec.failed_count[i]) == (world.success_count, world.failed_count)
+            assert (vec.noop_count[i], vec.failed_action_count[i]) == (world.noop_count, world.failed_action_count)
+
+
+@pytest.mark.parametrize('path', sorted(glob.glob(os.path.join(ROOT, 'result_level_*.json'))),
+                         ids=os.path.basename)
+def test_recorded_plans(path):
+    # the plans of LLM agents, in the order they wrote them (ex. put before the activate of the other agent). An
+    # episode is replayed up to its first plan `VecWorld` has no actions for (invalid commands)
+    level, num_agents = re.match(r'result_(level_\d+)_(\d+)_', os.path.basename(path)).groups()
+    with open(path, 'r') as f:
+        table = json.load(f)
+    steps = 0
+    for alpha, record in table.items():
+        kwargs = dict(make_kwargs(level, int(num_agents)), alpha=float(alpha))
+        vec = VecWorld(1, [0], **kwargs)
+        world = World(seed=0, **kwargs)
+        for action_history in record['action_history']:
+            vec.reset()
+            world.reset()
+            for plan in action_history:
+                try:
+                    vec.plan_actions([plan])
+                except (ValueError, AssertionError):
+                    break
+                step_both(vec, [world], [plan])
+                steps += 1
+    assert steps > 0
+
+
+def test_agent_order():
+    # without `order` the actions run in agent index order
+    vec = VecWorld(1, [0], **make_kwargs('level_0', 2))
+    actions, order = vec.plan_actions([['noop_agent1', 'noop_agent0']])
+    assert actions.tolist() == [[0, 0]] and order.tolist() == [[1, 0]]
+    assert np.array_equal(vec._agent_order, [[0, 1]])
@@ -0,0 +1,67 @@
+import random
+
+from conftest import make_kwargs, random_plan
+from overcooked import World
+
+# the caches and the snapshots of `World` must not change what the world does
+
+
+def test_available_actions_cache():
+    # the cache of the legal actions stays bounded, the evicted entries are computed again
+    world = World(seed=0, **make_kwargs('level_3', 3))
+    world.available_actions_cache_size = 8
+    world.reset()
+    rng = random.Random(0)
+    for _ in range(3 * world.max_steps):
+        actions = world.available_actions(return_struct=True)
+        assert actions == [world._agent_available_actions(i)[1] for i in range(world.num_agents)]
+        assert len(world._available_actions_cache) <= 8
+        world.step(random_plan(world, rng))
+        if world.time_step == world.max_steps:
+            world.reset()
+
+
+def test_snapshot_fork():
+    # the branches restored from a snapshot share nothing with it, `previous_actions` included
+    world = World(seed=0, **make_kwargs('level_3', 2))
+    world.reset()
+    rng = random.Random(0)
+    for _ in range(10):
+        world.step(random_plan(world, rng))
+    snap = world.snapshot()
+    before = list(world.previous_actions)
+
+    plan_a, plan_b = random_plan(world, rng), random_plan(world, rng)
+    world.step(plan_a)
+    branch_a = (list(world.previous_actions), world.all_state().to_dict(), world.snapshot().task_manager)
+    # the plans and the actions of a branch are modified in place
+    plan_a.clear()
+    world.previous_actions.append('noop_agent0')
+
+    world.restore(snap)
+    assert world.previous_actions == before
+    world.previous_actions.append('noop_agent0')
+    world.restore(snap)
+    assert world.previous_actions == before
+    world.step(plan_b)
+    assert world.previous_actions == plan_b
+
+    world.restore(snap)
+    world.step(branch_a[0])
+    assert (world.previous_actions, world.all_state().to_dict(), world.snapshot().task_manager) == branch_a
+    assert snap.histories[3] == tuple(before)
+
+
+def test_tasks_sorted():
+    # the new tasks are inserted in place: the list stays sorted by (lifetime, name). A task every 2 steps fills the
+    # list, with equal lifetimes of different tasks
+    world = World(seed=0, **dict(make_kwargs('level_9', 2), max_num_tasks=12))
+    world.task_manager._task_interval = 2
+    rng = random.Random(0)
+    for episode in range(3):
+        world.reset()
+        for _ in range(world.max_steps):
+            world.step(random_plan(world, rng))
+            manager = world.task_manager
+            tasks = list(zip(manager._current_task_lifetime_list, manager._current_task_list))
+            assert tasks == sorted(tasks)
@@ -0,0 +1,44 @@
+import itertools
+import random
+
+import pytest
+
+from conftest import make_kwargs, random_plan
+from overcooked import World
+
+# `record_history` / `record_feedback` only skip bookkeeping: the trajectories and `previous_actions` stay the same
+
+
+def play(level, record_history, record_feedback, use_ids=False):
+    world = World(seed=0, record_history=record_history, record_feedback=record_feedback,
+                  **make_kwargs(level, 2))
+    rng = random.Random(0)
+    steps = []
+    for episode in range(2):
+        world.reset(episode_index=episode)
+        for _ in range(world.max_steps):
+            plan = random_plan(world, rng, shuffle=False)
+            if use_ids:
+                obs, success, info = world.step_ids([world.codec.encode(cmd) for cmd in plan])
+            else:
+                obs, success, info = world.step(plan)
+            steps.append((obs.to_dict(), success, info['reward'], info['action_success'],
+                          list(world.previous_actions)))
+            assert world.previous_actions == plan
+    return steps, (world.success_count, world.failed_count, world.noop_count, world.failed_action_count)
+
+
+@pytest.mark.parametrize('level', ['level_0', 'level_3', 'level_9'])
+def test_flags_keep_trajectories(level):
+    reference = play(level, True, True)
+    for record_history, record_feedback in itertools.product([True, False], repeat=2):
+        assert play(level, record_history, record_feedback) == reference
+        assert play(level, record_history, record_feedback, use_ids=True) == reference
+
+
+def test_fast_mode_skips_histories():
+    world = World(seed=0, mode='fast', **make_kwargs('level_0', 2))
+    world.reset()
+    world.step(['noop_agent0', 'noop_agent1'])
+    assert world.action_history == [] and world.feedback_events == []
+    assert world.previous_actions == ['noop_agent0', 'noop_agent1']
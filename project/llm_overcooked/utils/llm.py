@@ -1,8 +1,12 @@
 import argparse
+import asyncio
 import json
 import os
 import random
 import time
+from functools import lru_cache
+from typing import List, NamedTuple, Optional, Tuple
+
 import requests
 import openai
 from anthropic import AI_PROMPT, HUMAN_PROMPT, Anthropic
@@ -12,13 +16,89 @@ from vertexai.preview.language_models import (ChatModel, InputOutputTextPair,
 from levels.constants import all_objecsts, base_ingridients, capacity
 from levels.utils import compute_dependency
 from overcooked.game import World
-from openai import OpenAI
+from utils.llm_cache import cached_chat
+from utils.rate_limit import RETRY_STATUS_CODES, RateLimiter, status_code
+from openai import AsyncOpenAI, OpenAI
 client = OpenAI()
+# created by the first async request, see `get_async_client`
+async_client = None
+# clients of the keys of the OpenAI key pool, see `get_rate_limiter`
+key_clients = {}
+rate_limiters = {}
 
 CLAUDE_KEY = ""
 
 key_id = 0
+
+
+class CachedPrompt(NamedTuple):
+    text: str
+    # tokens of the text (tiktoken cl100k_base), None if tiktoken is not installed
+    num_tokens: Optional[int]
+
+
+class CachedExamples(NamedTuple):
+    # few-shot history [(role, text)], see `load_examples`
+    history: List[Tuple[str, str]]
+    num_tokens: Optional[int]
+
+
+# the prompts of the levels, by (level, num_agents, notes, variant, part), see `level_prompt`. They are built
+# at most once per process (an agent of every episode of a sweep reuses them)
+_level_prompts = {}
+_examples = {}
+
+
+def count_tokens(text: str) -> Optional[int]:
+    try:
+        import tiktoken
+    except ImportError:
+        return None
+    return len(_token_encoding(tiktoken).encode(text))
+
+
+@lru_cache(maxsize=None)
+def _token_encoding(tiktoken):
+    return tiktoken.get_encoding('cl100k_base')
+
+
+def level_prompt(env, part, build, notes=True, variant=''):
+    """
+    The cached `CachedPrompt` of a part ('rules', 'recipes', 'tools' or any other) of the prompts of the level of
+    `env`, `build()` renders its text when it is not cached yet. `notes` and `variant` (ex. the broadcast protocol
+    of the agent) tell apart the different texts of the same level.
+    """
+    # the task list and the tools are part of the key, the same level may be loaded from different task files
+    key = (env.level, env.num_agents, notes, variant, part, tuple(env.task_manager._all_tasks), tuple(env.name_mapping))
+    prompt = _level_prompts.get(key)
+    if prompt is None:
+        text = build()
+        prompt = _level_prompts[key] = CachedPrompt(text, count_tokens(text))
+    return prompt
+
+
+def load_examples(filename) -> CachedExamples:
+    """
+    The few-shot examples of a prompt file: the part after the '###' line, split at the '***' lines into alternating
+    user and assistant messages. The files are parsed once per process (again if they are modified).
+    """
+    key = (os.path.abspath(filename), os.stat(filename).st_mtime_ns)
+    examples = _examples.get(key)
+    if examples is None:
+        with open(filename, 'r') as f:
+            example = f.read().split('###\n')[1].split('***\n')
+        history = [("user" if idx % 2 == 0 else "assistant", exp) for idx, exp in enumerate(example)]
+        num_tokens = count_tokens(''.join(example))
+        examples = _examples[key] = CachedExamples(history, num_tokens)
+    # a new list, the callers extend their histories
+    return CachedExamples(list(examples.history), examples.num_tokens)
+
+
 def rules(env, notes=True):
+    return level_prompt(env, 'rules', lambda: _rules(env, notes), notes=notes).text
+
+
+def _rules(env, notes):
     prompt = 'You are an agent in a cooperative game (Overcooked!). Your task is to work with other agents to achieve the goals of the game following the rules below.\n'
     prompt += 'The available actions are :\n'
     prompt += '1) goto: goto a tool location \n'
@@ -53,17 +133,24 @@ def rules(env, notes=True):
     return prompt
 
 def recipes(env: World):
-    import copy
-    tasks =  copy.deepcopy(env.task_manager._all_tasks)
+    return level_prompt(env, 'recipes', lambda: _recipes(env)).text
+
+
+@lru_cache(maxsize=None)
+def _load_recipe(filename='assets/recipe.json'):
+    with open(filename, 'r') as f:
+        return json.load(f)
+
+
+def _recipes(env: World):
     required_components = []
 
-    for task in tasks:
+    for task in env.task_manager._all_tasks:
         required_components.extend(compute_dependency(task)[0])
     required_components = set(required_components)
 
     prompt = '\n'
-    with open('assets/recipe.json', 'r') as f:
-        recipe = json.load(f)
+    recipe = _load_recipe()
 
     task_related_objects = set()
     task_related_tools = set()
@@ -81,6 +168,8 @@ def recipes(env: World):
                 prompt += f'    {ingredient}, '
             prompt += '\n'
 
+    # sorted: the prompts (and the keys of the response cache) must not depend on the hash seed of the process
+    task_related_objects = sorted(task_related_objects)
     prompt += 'The following objects are available: \n'
     for idx, item in enumerate(task_related_objects):
         prompt += f' --{idx+1}) {item} \n'
@@ -106,6 +195,10 @@ def recipes(env: World):
     return prompt
 
 def generate_tool_descriptions(env: World):
+    return level_prompt(env, 'tools', lambda: _tool_descriptions(env)).text
+
+
+def _tool_descriptions(env: World):
     prompt = '** Only ** the following tools are available: \n'
     for tool_name, tool in env.name_mapping.items():
         prompt += f'{tool_name}, '
@@ -151,6 +244,7 @@ def completion_llm(prompt, temperature=0, max_tokens=100):
             total_trials += 1
     return response.choices[0].text
 
+@cached_chat('vicuna', model='vicuna-33b-v1.3')
 def chat_llm_vicuna(history, temperature=0, max_tokens=100):
     openai.api_key = "EMPTY" # Not support yet
     openai.api_base = "http://localhost:8000/v1"
@@ -182,6 +276,7 @@ def chat_llm_vicuna(history, temperature=0, max_tokens=100):
 
     return response.choices[0].message.content
 
+@cached_chat('azure', model='gpt-4')
 def chat_azure(history, temperature, max_tokens):
     url = 'https://gcrgpt4aoai4c.openai.azure.com/openai/deployments/gpt-4/chat/completions?api-version=2023-06-01-preview'
     api_key = ''
@@ -205,14 +300,14 @@ def chat_azure(history, temperature, max_tokens):
         "temperature": temperature,
         "n":1
     }
-    
 
-    while True:
-        try:
-            response = requests.post(url, json=data, headers=headers)
-            return response.json()['choices'][0]['message']['content']
-        except:
-            pass
+    def send(key):
+        response = requests.post(url, json=data, headers=headers)
+        response.raise_for_status()
+        response = response.json()
+        return response['choices'][0]['message']['content'], response.get('usage', {}).get('total_tokens')
+
+    return get_rate_limiter('azure').call('gpt-4', request_tokens(chat_history, max_tokens), send, retryable_error)
 
 def chat_llm(history, temperature=0, max_tokens=100, model='gpt-4', context=''):
     if context:
@@ -226,9 +321,24 @@ def chat_llm(history, temperature=0, max_tokens=100, model='gpt-4', context=''):
 
     if model == 'claude-2':
         return chat_claude(history, temperature, max_tokens=200)
-    if openai.api_key is None:
-        next_key()
+    return chat_openai(history, temperature=temperature, max_tokens=max_tokens, model=model)
+
+@cached_chat('openai')
+def chat_openai(history, temperature=0, max_tokens=100, model='gpt-4'):
+    chat_history = openai_messages(history)
+
+    def send(key):
+        response = get_client(key).chat.completions.create(
+            model = model,
+            messages=chat_history,
+            temperature=temperature,
+            max_tokens=max_tokens
+        )
+        return response.choices[0].message.content, used_tokens(response)
+
+    return get_rate_limiter('openai').call(model, request_tokens(chat_history, max_tokens), send, retryable_error)
 
+def openai_messages(history):
     if type(history) == str:
         history = [('user', history)]
 
@@ -246,22 +356,92 @@ def chat_llm(history, temperature=0, max_tokens=100, model='gpt-4', context=''):
             })
         else:
             raise NotImplementedError
+    return chat_history
+
+def get_client(key=None):
+    # the client of a key of the pool, None is the default key (OPENAI_API_KEY)
+    if key is None:
+        return client
+    if ('sync', key) not in key_clients:
+        key_clients[('sync', key)] = OpenAI(api_key=key)
+    return key_clients[('sync', key)]
+
+def get_async_client(key=None):
+    # the async clients are bound to the event loop of their first request, keep one loop for all the steps
+    global async_client
+    if key is not None:
+        if ('async', key) not in key_clients:
+            key_clients[('async', key)] = AsyncOpenAI(api_key=key)
+        return key_clients[('async', key)]
+    if async_client is None:
+        async_client = AsyncOpenAI()
+    return async_client
+
+def use_rate_limits(requests_per_min=None, tokens_per_min=None, keys=None):
+    # limits (per key and model) of the OpenAI requests of this process and of the processes started afterwards.
+    # `keys` is the key pool, by default the keys of OPENAI_API_KEYS (comma separated) or the default key
+    if requests_per_min is not None:
+        os.environ['OVERCOOKED_LLM_RPM'] = str(requests_per_min)
+    if tokens_per_min is not None:
+        os.environ['OVERCOOKED_LLM_TPM'] = str(tokens_per_min)
+    if keys:
+        os.environ['OPENAI_API_KEYS'] = ','.join(keys)
+    rate_limiters.clear()
+    return get_rate_limiter('openai')
+
+def get_rate_limiter(provider):
+    # one limiter per provider, shared by all the requests (threads and coroutines) of the process
+    limiter = rate_limiters.get(provider)
+    if limiter is None:
+        keys = [None]
+        if provider == 'openai' and os.getenv('OPENAI_API_KEYS'):
+            keys = [key.strip() for key in os.getenv('OPENAI_API_KEYS').split(',') if key.strip()]
+        rpm, tpm = os.getenv('OVERCOOKED_LLM_RPM'), os.getenv('OVERCOOKED_LLM_TPM')
+        limiter = rate_limiters[provider] = RateLimiter(keys, requests_per_min=float(rpm) if rpm else None,
+                                                        tokens_per_min=float(tpm) if tpm else None)
+    return limiter
+
+def retryable_error(e):
+    # rate limits, server errors and lost connections are retried, the other errors (ex. a wrong key) are raised
+    # (the retries are logged by the rate limiter)
+    return (status_code(e) in RETRY_STATUS_CODES
+            or isinstance(e, (openai.APIConnectionError, requests.ConnectionError, requests.Timeout)))
+
+def request_tokens(chat_history, max_tokens):
+    # tokens reserved for a request: the messages (about 4 characters per token without tiktoken) and the reply
+    text = ''.join(message['content'] for message in chat_history)
+    num_tokens = count_tokens(text)
+    return (len(text) // 4 if num_tokens is None else num_tokens) + max_tokens
+
+def used_tokens(response):
+    usage = getattr(response, 'usage', None)
+    return getattr(usage, 'total_tokens', None)
+
+async def achat_llm(history, temperature=0, max_tokens=100, model='gpt-4', context=''):
+    # `chat_llm` for concurrent requests: the OpenAI models go through the async client, the other providers run
+    # their blocking calls in a thread
+    if model in ['gpt-4-azure', 'palm-2', 'claude-2']:
+        return await asyncio.to_thread(chat_llm, history, temperature, max_tokens, model, context)
+    if context:
+        history = [('user', context)] + history
+    return await achat_openai(history, temperature=temperature, max_tokens=max_tokens, model=model)
+
+@cached_chat('openai')
+async def achat_openai(history, temperature=0, max_tokens=100, model='gpt-4'):
+    # same requests (and cache entries) as `chat_openai`
+    chat_history = openai_messages(history)
+
+    async def send(key):
+        response = await get_async_client(key).chat.completions.create(
+            model = model,
+            messages=chat_history,
+            temperature=temperature,
+            max_tokens=max_tokens
+        )
+        return response.choices[0].message.content, used_tokens(response)
 
-    while True:
-
-        try:
-            response = client.chat.completions.create(
-                model = model,
-                messages=chat_history,
-                temperature=temperature,
-                max_tokens=max_tokens
-            )
-            break
-        except openai.OpenAIError as e:
-            print(e)
-            next_key()
-            time.sleep(0.1)
-    return response.choices[0].message.content
+    return await get_rate_limiter('openai').acall(model, request_tokens(chat_history, max_tokens), send,
+                                                  retryable_error)
 
 def completion_claude(prompt, temperature=0, max_tokens=100):
     anthropic = Anthropic(api_key=CLAUDE_KEY)
@@ -276,6 +456,7 @@ def completion_claude(prompt, temperature=0, max_tokens=100):
         return
     return completion.completion
 
+@cached_chat('anthropic', model='claude-2')
 def chat_claude(history, temperature=0, max_tokens=100):
     if type(history) == str:
         chat_history = f"{HUMAN_PROMPT} {history}"
@@ -320,6 +501,7 @@ def completion_palm(prompt, temperature=0, max_tokens=100):
     return response.text
 
 
+@cached_chat('vertexai', model='chat-bison@001')
 def chat_palm(history, temperature=0, max_tokens=100, context=''):
     chat_model = ChatModel.from_pretrained("chat-bison@001")
     parameters = {
@@ -0,0 +1,220 @@
+import asyncio
+import functools
+import hashlib
+import inspect
+import json
+import os
+import sqlite3
+import threading
+import time
+from typing import Optional
+
+# modes of `ResponseCache`:
+# - 'read_write': answers from the cache, the requests that miss are sent and their responses stored
+# - 'write': every request is sent and its response stored (refreshes the cache)
+# - 'replay': answers from the cache only, a miss raises `ResponseCacheMiss` (offline replays, no network)
+CACHE_MODES = ('read_write', 'write', 'replay')
+
+
+class ResponseCacheMiss(KeyError):
+    pass
+
+
+def request_key(request: dict) -> str:
+    # content hash of a request, equal for equal requests (keys sorted, tuples as lists, no whitespace)
+    canonical = json.dumps(request, sort_keys=True, separators=(',', ':'), ensure_ascii=False)
+    return hashlib.sha256(canonical.encode()).hexdigest()
+
+
+def chat_request(provider, history, **arguments) -> dict:
+    # the request of a chat function of `utils.llm`, the history (a prompt or [(role, text)]) as [[role, text]]
+    if isinstance(history, str):
+        history = [('user', history)]
+    return dict(provider=provider, messages=[list(message) for message in history], **arguments)
+
+
+class ResponseCache:
+    """
+    Persistent cache of the LLM responses, a SQLite table keyed by the hash of the request (see `request_key`). It
+    can be shared by processes and sweeps that open the same file, and by the threads of a process (the connection
+    and the counters are guarded by a lock).
+
+    :param path: file of the cache
+    :param mode: one of `CACHE_MODES`
+    :param max_entries: once the cache holds more responses, the least recently used ones are evicted (down to 90%
+        of `max_entries`, so that the eviction query runs once every many writes)
+    :param ttl: seconds after which a response is stale (a miss, evicted). The stale responses are purged when the
+        cache is opened and then every `purge_interval` writes
+    """
+
+    purge_interval = 256
+
+    def __init__(self, path: str, mode: str = 'read_write', max_entries: Optional[int] = None,
+                 ttl: Optional[float] = None):
+        assert mode in CACHE_MODES, f"unknown cache mode {mode}, expected one of {CACHE_MODES}"
+        self.path = path
+        self.mode = mode
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self.writes = 0
+        self.evictions = 0
+        self.lock = threading.Lock()
+        self.connection = sqlite3.connect(path, timeout=60, isolation_level=None, check_same_thread=False)
+        self.connection.execute('PRAGMA journal_mode=WAL')
+        self.connection.execute('CREATE TABLE IF NOT EXISTS responses (key TEXT PRIMARY KEY, request TEXT, '
+                                'response TEXT, created REAL, used REAL)')
+        self.connection.execute('CREATE INDEX IF NOT EXISTS responses_used ON responses (used)')
+        self.connection.execute('CREATE INDEX IF NOT EXISTS responses_created ON responses (created)')
+        with self.lock:
+            # running count of the responses (an upper bound: the replaced ones are counted again), recounted by
+            # `evict`
+            self.entries = self._count()
+            self.evict()
+
+    def _count(self):
+        return self.connection.execute('SELECT COUNT(*) FROM responses').fetchone()[0]
+
+    def __len__(self):
+        with self.lock:
+            return self._count()
+
+    def stats(self):
+        entries = len(self)
+        with self.lock:
+            return dict(hits=self.hits, misses=self.misses, writes=self.writes, evictions=self.evictions,
+                        entries=entries)
+
+    def get(self, request: dict) -> Optional[str]:
+        # the cached response of `request`, None if it is missing or stale (no lookup in 'write' mode)
+        if self.mode == 'write':
+            return None
+        key = request_key(request)
+        with self.lock:
+            row = self.connection.execute('SELECT response, created FROM responses WHERE key = ?',
+                                          (key,)).fetchone()
+            now = time.time()
+            if row is not None and self.ttl is not None and now - row[1] > self.ttl:
+                deleted = self.connection.execute('DELETE FROM responses WHERE key = ?', (key,)).rowcount
+                self.evictions += deleted
+                self.entries -= deleted
+                row = None
+            if row is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self.connection.execute('UPDATE responses SET used = ? WHERE key = ?', (now, key))
+            return row[0]
+
+    def put(self, request: dict, response: str):
+        now = time.time()
+        with self.lock:
+            self.connection.execute('INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?, ?)',
+                                    (request_key(request), json.dumps(request, sort_keys=True), response, now, now))
+            self.writes += 1
+            self.entries += 1
+            if (self.max_entries is not None and self.entries > self.max_entries) or \
+                    (self.ttl is not None and self.writes % self.purge_interval == 0):
+                self.evict()
+
+    def evict(self):
+        # drops the stale responses, then the least recently used ones above 90% of `max_entries`. The caller holds
+        # the lock
+        if self.ttl is not None:
+            self.evictions += self.connection.execute('DELETE FROM responses WHERE created < ?',
+                                                      (time.time() - self.ttl,)).rowcount
+        if self.max_entries is not None and self._count() > self.max_entries:
+            self.evictions += self.connection.execute(
+                'DELETE FROM responses WHERE key IN (SELECT key FROM responses ORDER BY used DESC LIMIT -1 OFFSET ?)',
+                (self.max_entries - self.max_entries // 10,)).rowcount
+        self.entries = self._count()
+
+    def call(self, request: dict, send):
+        """
+        The response of `request`, from the cache or from `send()` according to the mode. None responses (failed
+        requests of some providers) are not stored.
+        """
+        response = self.get(request)
+        if response is not None:
+            return response
+        if self.mode == 'replay':
+            raise ResponseCacheMiss(f"no cached response for {request_key(request)} in {self.path}")
+        response = send()
+        if response is not None:
+            self.put(request, response)
+        return response
+
+    async def acall(self, request: dict, send):
+        # `call` with a coroutine function `send`. The database is read and written in a thread: the lock and the
+        # SQLite calls (busy waits on the file included) would block the other coroutines of the event loop
+        response = await asyncio.to_thread(self.get, request)
+        if response is not None:
+            return response
+        if self.mode == 'replay':
+            raise ResponseCacheMiss(f"no cached response for {request_key(request)} in {self.path}")
+        response = await send()
+        if response is not None:
+            await asyncio.to_thread(self.put, request, response)
+        return response
+
+    def close(self):
+        with self.lock:
+            self.connection.close()
+
+
+_response_cache = None
+
+
+def use_response_cache(path: str, mode: str = 'read_write', max_entries: Optional[int] = None,
+                       ttl: Optional[float] = None) -> ResponseCache:
+    # the path and the mode go through the environment so that the processes started afterwards use the cache too
+    global _response_cache
+    os.environ['OVERCOOKED_LLM_CACHE'] = path
+    os.environ['OVERCOOKED_LLM_CACHE_MODE'] = mode
+    _response_cache = ResponseCache(path, mode, max_entries=max_entries, ttl=ttl)
+    return _response_cache
+
+
+def get_response_cache() -> Optional[ResponseCache]:
+    global _response_cache
+    if _response_cache is None and os.environ.get('OVERCOOKED_LLM_CACHE'):
+        _response_cache = ResponseCache(os.environ['OVERCOOKED_LLM_CACHE'],
+                                        os.environ.get('OVERCOOKED_LLM_CACHE_MODE', 'read_write'))
+    return _response_cache
+
+
+def cached_chat(provider, model=None):
+    """
+    Puts the response cache (if one is in use, see `use_response_cache`) in front of a chat function
+    `f(history, ...)`. The request is keyed by the provider, all the arguments of the call (defaults included) and
+    `model` for the providers that serve a single model. Coroutine functions are wrapped by coroutine functions.
+    """
+    def decorator(f):
+        signature = inspect.signature(f)
+
+        def request(args, kwargs):
+            arguments = signature.bind(*args, **kwargs)
+            arguments.apply_defaults()
+            arguments = dict(arguments.arguments)
+            if model is not None:
+                arguments['model'] = model
+            return chat_request(provider, **arguments)
+
+        if inspect.iscoroutinefunction(f):
+            @functools.wraps(f)
+            async def async_wrapper(*args, **kwargs):
+                cache = get_response_cache()
+                if cache is None:
+                    return await f(*args, **kwargs)
+                return await cache.acall(request(args, kwargs), lambda: f(*args, **kwargs))
+            return async_wrapper
+
+        @functools.wraps(f)
+        def wrapper(*args, **kwargs):
+            cache = get_response_cache()
+            if cache is None:
+                return f(*args, **kwargs)
+            return cache.call(request(args, kwargs), lambda: f(*args, **kwargs))
+        return wrapper
+    return decorator
@@ -0,0 +1,215 @@
+import asyncio
+import logging
+import random
+import threading
+import time
+from typing import Callable, Dict, Optional, Sequence
+
+logger = logging.getLogger(__name__)
+
+# status codes of the errors worth retrying (rate limits, overloaded or failing servers)
+RETRY_STATUS_CODES = (408, 409, 429, 500, 502, 503, 504)
+
+
+class TokenBucket:
+    """
+    Budget of `rate` units per minute, with bursts of up to `capacity` units (by default the budget of a minute,
+    like the limits of the APIs). `reserve` takes the units right away, possibly into debt, and returns the seconds
+    to wait before using them, so that concurrent callers queue up instead of all retrying at once.
+    """
+
+    def __init__(self, rate: float, capacity: Optional[float] = None):
+        self.rate = rate / 60
+        self.capacity = capacity if capacity is not None else rate
+        self.level = self.capacity
+        self.updated = time.monotonic()
+
+    def reserve(self, amount: float) -> float:
+        now = time.monotonic()
+        self.level = min(self.capacity, self.level + (now - self.updated) * self.rate)
+        self.updated = now
+        self.level -= amount
+        return max(0., -self.level / self.rate)
+
+    def refund(self, amount: float):
+        # gives back units reserved but not used (negative: takes the units used beyond the reservation)
+        self.level = min(self.capacity, self.level + amount)
+
+
+class _KeyState:
+    def __init__(self, key):
+        self.key = key
+        self.buckets: Dict[str, tuple] = {}
+        self.failures = 0
+        self.open_until = 0.
+
+
+class RateLimiter:
+    """
+    Client-side limiter of the requests to an API, shared by the threads and the coroutines of a process:
+
+    * the requests go round-robin over a pool of keys, every (key, model) has a token bucket of requests per minute
+      and one of tokens per minute (none if the limit is None)
+    * the failed requests are retried (when `retryable(error)`) after a jittered exponential backoff, or after the
+      ``Retry-After`` of the response
+    * a rate limited key (429) is skipped until its ``Retry-After``. After `failure_threshold` other failures in a
+      row (server errors, lost connections) a key is skipped for `cooldown` seconds (circuit breaker). When every
+      key is skipped, the next request waits for the first one to come back
+
+    :param keys: the API keys (None for the default key of the client)
+    :param requests_per_min: requests per minute per key and model
+    :param tokens_per_min: tokens (prompt and completion) per minute per key and model
+    :param max_retries: retries of a request before its last error is raised
+    """
+
+    def __init__(self, keys: Sequence[Optional[str]] = (None,), requests_per_min: Optional[float] = None,
+                 tokens_per_min: Optional[float] = None, max_retries: int = 8, base_delay: float = 1.,
+                 max_delay: float = 60., failure_threshold: int = 5, cooldown: float = 30.):
+        assert len(keys) > 0, "the key pool is empty"
+        self.keys = [_KeyState(key) for key in keys]
+        self.requests_per_min = requests_per_min
+        self.tokens_per_min = tokens_per_min
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.failure_threshold = failure_threshold
+        self.cooldown = cooldown
+        self.next_key = 0
+        self.lock = threading.Lock()
+        self.retries = 0
+        self.throttled = 0.
+
+    def _buckets(self, state, model):
+        buckets = state.buckets.get(model)
+        if buckets is None:
+            buckets = state.buckets[model] = (
+                None if self.requests_per_min is None else TokenBucket(self.requests_per_min),
+                None if self.tokens_per_min is None else TokenBucket(self.tokens_per_min))
+        return buckets
+
+    def acquire(self, model: str, num_tokens: int = 0):
+        # (key state, seconds to wait) of the next request, its budget is reserved
+        with self.lock:
+            now = time.monotonic()
+            n = len(self.keys)
+            order = [self.keys[(self.next_key + i) % n] for i in range(n)]
+            available = [state for state in order if state.open_until <= now]
+            # all the breakers are open: the first key to cool down is tried again
+            state = available[0] if available else min(order, key=lambda s: s.open_until)
+            self.next_key = (self.keys.index(state) + 1) % n
+            wait = max(0., state.open_until - now)
+            requests, tokens = self._buckets(state, model)
+            if requests is not None:
+                wait = max(wait, requests.reserve(1))
+            if tokens is not None:
+                wait = max(wait, tokens.reserve(num_tokens))
+            self.throttled += wait
+            return state, wait
+
+    def release(self, state, model: str, num_tokens: int):
+        # gives back the budget of a request that was not sent
+        requests, tokens = self._buckets(state, model)
+        with self.lock:
+            if requests is not None:
+                requests.refund(1)
+            if tokens is not None:
+                tokens.refund(num_tokens)
+
+    def settle(self, state, model: str, reserved: int, used: Optional[int]):
+        # corrects the token budget with the tokens the response reports
+        tokens = self._buckets(state, model)[1]
+        if tokens is not None and used is not None:
+            with self.lock:
+                tokens.refund(reserved - used)
+
+    def success(self, state):
+        with self.lock:
+            state.failures = 0
+            state.open_until = 0.
+
+    def failure(self, state, attempt: int, error) -> float:
+        # seconds to wait before the retry (the next attempt may go to another key)
+        delay = retry_after(error)
+        if delay is None:
+            delay = min(self.max_delay, self.base_delay * 2 ** attempt)
+            delay = random.uniform(delay / 2, delay)
+        with self.lock:
+            self.retries += 1
+            now = time.monotonic()
+            if status_code(error) == 429:
+                # the key is paused, the other keys can take the retry right away
+                state.open_until = max(state.open_until, now + delay)
+                if len(self.keys) > 1:
+                    delay = 0.
+            else:
+                state.failures += 1
+                if state.failures >= self.failure_threshold:
+                    state.open_until = now + self.cooldown
+                    state.failures = 0
+        logger.warning('request failed (%s), retry %d in %.1fs', error, attempt + 1, delay)
+        return delay
+
+    def call(self, model: str, num_tokens: int, send: Callable, retryable: Callable):
+        """
+        `send(key)` within the budget of `model`, retried on the `retryable(error)` errors. `send` returns the
+        response and the tokens it used (None if unknown).
+        """
+        for attempt in range(self.max_retries + 1):
+            state, wait = self.acquire(model, num_tokens)
+            while wait > 0:
+                time.sleep(wait)
+                # the key may have been rate limited or broken while we waited, then another one is picked
+                if state.open_until <= time.monotonic():
+                    break
+                self.release(state, model, num_tokens)
+                state, wait = self.acquire(model, num_tokens)
+            try:
+                response, used = send(state.key)
+            except Exception as e:
+                if not retryable(e) or attempt == self.max_retries:
+                    raise
+                time.sleep(self.failure(state, attempt, e))
+                continue
+            self.success(state)
+            self.settle(state, model, num_tokens, used)
+            return response
+
+    async def acall(self, model: str, num_tokens: int, send: Callable, retryable: Callable):
+        # `call` with a coroutine function `send`
+        for attempt in range(self.max_retries + 1):
+            state, wait = self.acquire(model, num_tokens)
+            while wait > 0:
+                await asyncio.sleep(wait)
+                if state.open_until <= time.monotonic():
+                    break
+                self.release(state, model, num_tokens)
+                state, wait = self.acquire(model, num_tokens)
+            try:
+                response, used = await send(state.key)
+            except Exception as e:
+                if not retryable(e) or attempt == self.max_retries:
+                    raise
+                await asyncio.sleep(self.failure(state, attempt, e))
+                continue
+            self.success(state)
+            self.settle(state, model, num_tokens, used)
+            return response
+
+
+def status_code(error) -> Optional[int]:
+    # the HTTP status of the error of a client (openai, requests), None if it has none
+    code = getattr(error, 'status_code', None)
+    if code is None:
+        code = getattr(getattr(error, 'response', None), 'status_code', None)
+    return code
+
+
+def retry_after(error) -> Optional[float]:
+    # the Retry-After (seconds) of the response of the error, if any
+    headers = getattr(getattr(error, 'response', None), 'headers', None)
+    if not headers:
+        return None
+    try:
+        return float(headers.get('retry-after'))
+    except (TypeError, ValueError):
+        return None